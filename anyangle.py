@@ -0,0 +1,138 @@
+import heapq
+import math
+import numpy as np
+
+# 8-connected and any-angle planning on the occupancy grid (0 = free).
+# The 8-connected search lets diagonal crossings of the room be driven as
+# one diagonal run instead of a staircase of right/down segments. The
+# any-angle mode then pulls the path tight with line-of-sight checks, so a
+# leg becomes a handful of straight lines joined by arbitrary-angle turns.
+
+SQRT2 = math.sqrt(2)
+
+# Slack for a line that runs exactly along a cell boundary
+EPSILON = 1e-9
+
+
+def octile(a, b):
+    dr = abs(a[0] - b[0])
+    dc = abs(a[1] - b[1])
+    return max(dr, dc) + (SQRT2 - 1) * min(dr, dc)
+
+
+def path_corners(path):
+    # Keep the endpoints and every cell where the step direction changes,
+    # as an (N, 2) int16 array
+    path = np.asarray(path, dtype=np.int16).reshape(-1, 2)
+    if len(path) < 3:
+        return path
+    steps = np.diff(path, axis=0)
+    turns = np.flatnonzero(np.any(steps[1:] != steps[:-1], axis=1)) + 1
+    return path[np.concatenate(([0], turns, [len(path) - 1]))]
+
+
+def supercover(a, b):
+    # Rows and columns of every cell whose square the segment between the
+    # centres of cells a and b touches. Passing exactly through a corner
+    # counts as touching all four cells there, the same rule the octile
+    # search uses for diagonal steps.
+    (r0, c0), (r1, c1) = (float(a[0]), float(a[1])), (float(b[0]), float(b[1]))
+    transpose = abs(r1 - r0) > abs(c1 - c0)
+    if transpose:
+        r0, c0, r1, c1 = c0, r0, c1, r1
+    if c0 == c1:
+        rows, cols = np.array([int(r0)]), np.array([int(c0)])
+        return (cols, rows) if transpose else (rows, cols)
+    # Walk the columns; within one column strip the line spans at most two
+    # cell boundaries because it is at most 45 degrees off the column axis
+    low_col, high_col = min(c0, c1), max(c0, c1)
+    cols = np.arange(int(low_col), int(high_col) + 1)
+    slope = (r1 - r0) / (c1 - c0)
+    enter = r0 + (np.maximum(cols - 0.5, low_col) - c0) * slope
+    leave = r0 + (np.minimum(cols + 0.5, high_col) - c0) * slope
+    first = np.ceil(np.minimum(enter, leave) - 0.5 - EPSILON).astype(int)
+    last = np.floor(np.maximum(enter, leave) + 0.5 + EPSILON).astype(int)
+    offsets = np.arange((last - first).max() + 1)
+    touched = offsets <= (last - first)[:, None]
+    rows = (first[:, None] + offsets)[touched]
+    cols = np.broadcast_to(cols[:, None], touched.shape)[touched]
+    return (cols, rows) if transpose else (rows, cols)
+
+
+class AnyAnglePlanner:
+    def __init__(self, grid):
+        self.free = grid == 0
+        self.nodes_expanded = 0
+        self.explored = {}
+
+    def is_free(self, cell):
+        rows, cols = self.free.shape
+        return 0 <= cell[0] < rows and 0 <= cell[1] < cols and bool(self.free[cell])
+
+    def line_of_sight(self, a, b):
+        # Every cell the segment touches must be free
+        rows, cols = supercover(a, b)
+        return bool(self.free[rows, cols].all())
+
+    def octile_search(self, start, goal):
+        self.nodes_expanded = 0
+        self.explored = {}
+        if not self.is_free(start) or not self.is_free(goal):
+            return []
+
+        open_set = [(octile(start, goal), start)]
+        came_from = {}
+        g_score = {start: 0}
+        self.explored = g_score
+        closed = set()
+        neighbors = [(0,1), (1,0), (0,-1), (-1,0), (1,1), (1,-1), (-1,1), (-1,-1)]
+
+        while open_set:
+            _, current = heapq.heappop(open_set)
+            if current in closed:
+                continue
+            if current == goal:
+                path = [current]
+                while current in came_from:
+                    current = came_from[current]
+                    path.append(current)
+                path.reverse()
+                return path
+            closed.add(current)
+            self.nodes_expanded += 1
+
+            for dx, dy in neighbors:
+                neighbor = (current[0] + dx, current[1] + dy)
+                if not self.is_free(neighbor):
+                    continue
+                if dx and dy:
+                    # Never cut a wall corner on a diagonal step
+                    if not (self.free[current[0] + dx, current[1]] and self.free[current[0], current[1] + dy]):
+                        continue
+                    step = SQRT2
+                else:
+                    step = 1
+                tentative_g_score = g_score[current] + step
+                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    heapq.heappush(open_set, (tentative_g_score + octile(neighbor, goal), neighbor))
+        return []
+
+    def string_pull(self, path):
+        # Greedily keep the farthest cell that is still in sight of the last
+        # corner; the result is a list of corner waypoints
+        if len(path) < 3:
+            return list(path)
+        corners = [path[0]]
+        for previous, current in zip(path, path[1:]):
+            if not self.line_of_sight(corners[-1], current):
+                corners.append(previous)
+        corners.append(path[-1])
+        return corners
+
+    def find_path(self, start, goal, smooth=False):
+        path = self.octile_search(start, goal)
+        if smooth:
+            return self.string_pull(path)
+        return path
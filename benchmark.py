@@ -0,0 +1,122 @@
+import sys
+import time
+import numpy as np
+from main import STATIONS
+from planner import Planner, get_directions, image_to_binary_array
+from anyangle import path_corners
+from commands import compile_commands, compile_polyline, INITIAL_HEADING
+from motion import command_duration
+
+# Offline planner benchmark on the shipped layouts. Run with
+#   python benchmark.py [layout.png ...]
+# Reports time, nodes expanded, driven length, the number of compiled
+# FWD/TURN commands and the expected drive time at constant speed and with
+# speed profiles for every planner and leg. Layouts with a calibration
+# (see metricmap.py) get a second row per planner, prefixed m-, for the same
+# leg planned on robot-sized cells and compiled to FWD_MM.
+
+LAYOUTS = ['demolayout.png', 'restaurant.png', 'maze.png', 'maze2.png', 'maze3.png']
+
+
+def nearest_free_cell(grid, cell):
+    # Snap a requested cell to the closest free pixel of the layout
+    free = np.argwhere(grid == 0)
+    if free.size == 0:
+        return None
+    distances = np.abs(free[:, 0] - cell[0]) + np.abs(free[:, 1] - cell[1])
+    r, c = free[np.argmin(distances)]
+    return (int(r), int(c))
+
+
+def layout_legs(grid, image_path):
+    rows, cols = grid.shape
+    home = nearest_free_cell(grid, (0, cols // 2))
+    if image_path == 'demolayout.png':
+        legs = [('home', home)] + list(STATIONS.items())
+        return [(f"{a}->{b}", pa, pb) for (a, pa), (b, pb) in zip(legs, legs[1:] + legs[:1])]
+
+    # Other layouts: home to the far corners and back
+    corners = {
+        'bottom-left': nearest_free_cell(grid, (rows - 1, 0)),
+        'bottom-right': nearest_free_cell(grid, (rows - 1, cols - 1)),
+        'top-left': nearest_free_cell(grid, (0, 0)),
+    }
+    legs = [(f"home->{name}", home, cell) for name, cell in corners.items()]
+    legs.append(('bottom-right->home', corners['bottom-right'], home))
+    return legs
+
+
+def run_planner(name, planner, grid, start, goal):
+    start_time = time.perf_counter()
+    if name == 'grid':
+        path = planner.a_star_search(grid, start, goal)
+        nodes = planner.nodes_expanded
+    elif name == 'bidir':
+        path = planner.bidirectional_search(grid, start, goal)
+        nodes = planner.nodes_expanded
+    elif name == 'alt':
+        path = planner.a_star_search(grid, start, goal, planner.landmarks.heuristic_to(goal))
+        nodes = planner.nodes_expanded
+    elif name == 'navmesh':
+        path = planner.region_graph.find_path(start, goal)
+        nodes = planner.region_graph.nodes_expanded
+    elif name in ('octile', 'anyangle'):
+        path = planner.any_angle.find_path(start, goal, smooth=name == 'anyangle')
+        nodes = planner.any_angle.nodes_expanded
+    elapsed = (time.perf_counter() - start_time) * 1000
+    return path, nodes, elapsed
+
+
+def route_cost(name, planner, path, unit_mm=None):
+    # Driven length in cells, the number of firmware commands for a leg and
+    # its drive time in seconds without and with speed profiles
+    corners = path_corners(path)
+    if name in ('octile', 'anyangle') or unit_mm is not None:
+        commands, _ = compile_polyline(corners, INITIAL_HEADING, unit_mm=unit_mm)
+    else:
+        commands, _ = compile_commands(get_directions(path), INITIAL_HEADING)
+    profiled, _ = compile_polyline(corners, INITIAL_HEADING, clearance=planner.clearance, unit_mm=unit_mm)
+    length = np.hypot(*np.diff(corners.astype(float), axis=0).T).sum()
+    constant_time = sum(map(command_duration, commands)) / 1000
+    profiled_time = sum(map(command_duration, profiled)) / 1000
+    return length, len(commands), constant_time, profiled_time
+
+
+def benchmark_layout(image_path, planners):
+    planner = Planner('grid', use_landmarks=True)
+    grid = image_to_binary_array(image_path)
+    planner.compile_layout(grid, image_path, calibrated=False)
+    metric = Planner('grid', use_landmarks=True)
+    metric.compile_layout(grid, image_path)
+    metric_map = metric.metric_map
+
+    print(f"\n=== {image_path} {grid.shape[0]}x{grid.shape[1]} ===")
+    print(f"{'leg':<26}{'planner':<10}{'ms':>10}{'nodes':>10}{'length':>8}{'cmds':>6}"
+          f"{'drive s':>9}{'prof s':>8}")
+    for leg_name, start, goal in layout_legs(grid, image_path):
+        for name in planners:
+            path, nodes, elapsed = run_planner(name, planner, grid, start, goal)
+            length, commands, constant_time, profiled_time = route_cost(name, planner, path)
+            print(f"{leg_name:<26}{name:<10}{elapsed:>10.1f}{nodes:>10}{length:>8.0f}{commands:>6}"
+                  f"{constant_time:>9.1f}{profiled_time:>8.1f}")
+            if metric_map is None:
+                continue
+            cell_start, cell_goal = metric_map.to_cell(start), metric_map.to_cell(goal)
+            if cell_start is None or cell_goal is None:
+                print(f"{leg_name:<26}m-{name:<8} robot doesn't fit at the start or goal")
+                continue
+            path, nodes, elapsed = run_planner(name, metric, metric_map.cells, cell_start, cell_goal)
+            length, commands, constant_time, profiled_time = route_cost(
+                name, metric, metric_map.to_pixels(path), metric_map.mm_per_pixel)
+            print(f"{leg_name:<26}m-{name:<8}{elapsed:>10.1f}{nodes:>10}{length:>8.0f}{commands:>6}"
+                  f"{constant_time:>9.1f}{profiled_time:>8.1f}")
+
+
+def main():
+    layouts = sys.argv[1:] or LAYOUTS
+    for image_path in layouts:
+        benchmark_layout(image_path, ['grid', 'alt', 'bidir', 'navmesh', 'octile', 'anyangle'])
+
+
+if __name__ == "__main__":
+    main()
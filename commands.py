@@ -0,0 +1,129 @@
+import math
+from motion import forward_command, segment_clearance
+
+# Heading-aware command compiler.
+# get_directions produces absolute run-lengths ("148down", "12left", ...)
+# and the any-angle planner produces polylines, but the robot can only pivot
+# in place and drive straight ahead. This turns both into relative firmware
+# commands while tracking where the robot is facing across legs:
+#   FWD:<cells>   drive forward (optionally speed-profiled, see motion.py)
+#   FWD_MM:<mm>   the same in millimetres, for calibrated layouts
+#   TURN:<deg>    pivot in place, positive is clockwise (right)
+# Headings are compass degrees on the layout image: 0 is up, 90 is right.
+
+HEADING_DEGREES = {'up': 0, 'right': 90, 'down': 180, 'left': 270}
+
+# The robot leaves home facing into the room
+INITIAL_HEADING = HEADING_DEGREES['down']
+
+
+def parse_direction(direction):
+    # "148down" -> (148, 'down')
+    i = 0
+    while i < len(direction) and direction[i].isdigit():
+        i += 1
+    return int(direction[:i] or 0), direction[i:].strip()
+
+
+def normalize_turn(degrees):
+    # Fold into (-180, 180] so we always take the short way round
+    degrees = (degrees + 180) % 360 - 180
+    return 180 if degrees == -180 else degrees
+
+
+def bearing(a, b):
+    # Compass bearing in whole degrees from cell a to cell b
+    return round(math.degrees(math.atan2(b[1] - a[1], a[0] - b[0]))) % 360
+
+
+def compile_segments(segments, heading, final_heading=None, unit_mm=None):
+    # segments is a list of (bearing, cells) or (bearing, cells, clearance)
+    # in driving order. Runs with a known clearance get a speed profile.
+    # With unit_mm (millimetres per cell) runs are sent as FWD_MM.
+    commands = []
+    pending_turn = 0
+    pending_forward = 0
+    pending_clearance = None
+
+    def flush_forward():
+        nonlocal pending_forward, pending_clearance
+        if pending_forward:
+            commands.append(forward_command(pending_forward, pending_clearance, unit_mm))
+            pending_forward = 0
+            pending_clearance = None
+
+    def flush_turn():
+        nonlocal pending_turn
+        pending_turn = normalize_turn(pending_turn)
+        if pending_turn:
+            commands.append(f"TURN:{pending_turn}")
+            pending_turn = 0
+
+    for segment in segments:
+        segment_bearing, cells = segment[:2]
+        clearance = segment[2] if len(segment) > 2 else None
+        # Turns with no driving in between are merged into a single pivot
+        pending_turn += segment_bearing - heading
+        heading = segment_bearing
+        if cells <= 0:
+            continue
+        if normalize_turn(pending_turn):
+            flush_forward()
+            flush_turn()
+        pending_turn = 0
+        # A merged run is only as fast as its tightest part allows
+        if clearance is not None:
+            if pending_forward == 0:
+                pending_clearance = clearance
+            elif pending_clearance is not None:
+                pending_clearance = min(pending_clearance, clearance)
+        pending_forward += cells
+
+    if final_heading is not None:
+        pending_turn += final_heading - heading
+        heading = final_heading
+
+    flush_forward()
+    flush_turn()
+    return commands, heading
+
+
+def compile_commands(directions, heading, final_heading=None):
+    segments = []
+    for direction in directions:
+        count, absolute = parse_direction(direction)
+        segments.append((HEADING_DEGREES[absolute], count))
+    return compile_segments(segments, heading, final_heading)
+
+
+def compile_polyline(waypoints, heading, final_heading=None, clearance=None, unit_mm=None):
+    # Straight legs between corner waypoints, rounded to whole cells. With a
+    # clearance map (motion.clearance_map) long runs are speed-profiled.
+    # With unit_mm lengths are only rounded once converted to millimetres.
+    waypoints = [(int(point[0]), int(point[1])) for point in waypoints]
+    segments = []
+    for a, b in zip(waypoints, waypoints[1:]):
+        if a == b:
+            continue
+        length = math.hypot(b[0] - a[0], b[1] - a[1])
+        segment = (bearing(a, b), length if unit_mm is not None else round(length))
+        if clearance is not None:
+            segment += (segment_clearance(clearance, a, b),)
+        segments.append(segment)
+    return compile_segments(segments, heading, final_heading, unit_mm)
+
+
+def pose_after(commands, position, heading, unit_mm=None):
+    # Dead-reckon (position, heading) after driving commands from a pose.
+    # Positions are (row, col) floats; FWD_MM needs unit_mm (mm per cell).
+    row, col = float(position[0]), float(position[1])
+    for command in commands:
+        kind, _, args = command.partition(':')
+        value = int(args.split(':')[0])
+        if kind == 'TURN':
+            heading = (heading + value) % 360
+        elif kind in ('FWD', 'FWD_MM'):
+            cells = value / unit_mm if kind == 'FWD_MM' else value
+            row -= cells * math.cos(math.radians(heading))
+            col += cells * math.sin(math.radians(heading))
+    return (row, col), heading
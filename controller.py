@@ -0,0 +1,657 @@
+import glob
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from planner import Planner
+from profiling import SamplingProfiler
+from seriallink import (DEFAULT_BAUD, READY_TIMEOUT, handshake, negotiate_baud, open_port,
+                        run_self_test, set_log_level, start_session)
+
+# Controller process.
+# The serial link and the planner run in their own process so neither shares
+# a GIL with Tk and matplotlib: a heavy redraw can't delay reading
+# DIRECTION_DONE, and a long search can't freeze the touchscreen.
+#
+# The UI talks to it through a Pipe with small tuples. The occupancy grid and
+# the planned routes travel through shared memory instead. Each layout is one
+# SharedLayout block holding the grid followed by ROUTE_SLOTS route buffers.
+# The controller copies the grid out once and writes every route straight
+# into the slot the UI reserved for it. The UI makes a new block for every
+# layout, so nothing is ever rewritten under a reader.
+#
+# Within a leg the controller streams the commands itself: it sends the next
+# one as soon as DIRECTION_DONE arrives and forwards the line to the UI for
+# bookkeeping, so the robot never waits for the UI to catch up.
+#
+# If the link drops (a loose USB cable, a brown-out reset) the controller
+# reports ('serial', None, ...) and keeps probing the port that dropped, and
+# any ports it was given, backing off between rounds. Ports are opened with
+# DTR low so reconnecting doesn't reset the board, and the session tag (see
+# seriallink.py) says whether it reset anyway:
+#   - It kept running: its count of finished moves says whether the command
+#     that had not been acknowledged finished while the link was down. If it
+#     did, it is acknowledged to the UI as usual; if it never arrived it is
+#     sent again. Either way the rest of the leg follows, so the trip carries
+#     on from the UI's current_path_index and current_direction_index.
+#   - It reset: the motors stopped part way through that command, so the
+#     rest of the leg is dropped and the UI is told to replan it from the
+#     last acknowledged pose.
+# The table LEDs are set again on every reconnect.
+# The motor and LED self-test only runs on the first connection after the
+# board boots with the kiosk, never on a reconnect.
+#
+# UI -> controller                      controller -> UI
+#   ('layout', name, shape, settings)     ('serial', port, baud, downtime, replan)
+#   ('plan', id, start, goal, name, slot) ('line', text, round_trip_seconds)
+#   ('drive', commands)                   ('sent', command)
+#   ('stop',)                             ('planned', id, length, bounds, stats)
+#   ('write', data)                       ('failed', id, message)
+#   ('profile', running)                  ('profile', stacks, samples)
+#   ('close',)
+#
+# ('profile', True) starts sampling this process's threads and
+# ('profile', False) stops and sends the samples back (see profiling.py).
+
+SERIAL_PORTS = ['/dev/ttyACM0', '/dev/ttyUSB0', '/dev/ttyAMA0']
+
+# A board that comes back after a USB glitch may enumerate under a new name
+SERIAL_PORT_PATTERNS = ['/dev/ttyACM*', '/dev/ttyUSB*']
+
+# How long a port gets to answer PING at the rate we were last using. A board
+# that kept running answers straight away; one that reset is back at
+# DEFAULT_BAUD and gets READY_TIMEOUT to boot (seconds).
+PROBE_TIMEOUT = 0.3
+
+# Wait between probe rounds while the Arduino is missing (seconds)
+RECONNECT_DELAY = 0.25
+RECONNECT_MAX_DELAY = 5.0
+
+# Route buffers per layout block; a trip has at most four legs in flight
+ROUTE_SLOTS = 8
+
+# How long the UI waits for the controller to find the Arduino (seconds)
+CONNECT_TIMEOUT = READY_TIMEOUT + 5
+
+# Longest the UI blocks on a leg that is still planning (seconds)
+PLAN_TIMEOUT = 30.0
+
+
+class SharedLayout:
+    # Grid (uint8) followed by ROUTE_SLOTS buffers of int16 (row, col)
+    # pairs. A route never visits a cell twice, so rows * cols pairs is
+    # always enough for one slot.
+    def __init__(self, shape, name=None):
+        self.shape = tuple(shape)
+        self.cells = self.shape[0] * self.shape[1]
+        self.slot_bytes = self.cells * 2 * np.dtype(np.int16).itemsize
+        size = self.cells + ROUTE_SLOTS * self.slot_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.free_slots = list(range(ROUTE_SLOTS))
+
+    def write_grid(self, grid):
+        view = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        view[:] = grid
+        del view
+
+    def read_grid(self):
+        view = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        grid = view.copy()
+        del view
+        return grid
+
+    def write_route(self, slot, route):
+        view = np.ndarray((len(route), 2), dtype=np.int16, buffer=self.shm.buf,
+                          offset=self.cells + slot * self.slot_bytes)
+        view[:] = route
+        del view
+
+    def read_route(self, slot, length):
+        view = np.ndarray((length, 2), dtype=np.int16, buffer=self.shm.buf,
+                          offset=self.cells + slot * self.slot_bytes)
+        route = view.copy()
+        del view
+        return route
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def candidate_ports(ports=None):
+    # An explicit list is probed as given. By default SERIAL_PORTS comes
+    # first, then anything that looks like a USB serial adapter.
+    if ports is not None:
+        return list(ports)
+    names = list(SERIAL_PORTS)
+    for pattern in SERIAL_PORT_PATTERNS:
+        names += [name for name in sorted(glob.glob(pattern)) if name not in names]
+    return names
+
+
+def probe_port(name, bauds):
+    # Open one port and handshake at each rate in turn.
+    # Returns (port, baud) or None.
+    try:
+        port = open_port(name, bauds[0])
+    except Exception:
+        return None
+    try:
+        for baud in bauds:
+            port.baudrate = baud
+            timeout = READY_TIMEOUT if baud == DEFAULT_BAUD else PROBE_TIMEOUT
+            if handshake(port, timeout) is not None:
+                return port, baud
+    except Exception:
+        pass
+    port.close()
+    return None
+
+
+def probe_ports(names, bauds=(DEFAULT_BAUD,)):
+    # Probe every port at once and return the first (port, baud) to answer,
+    # or (None, None). Ports that answer later are closed in the background.
+    results = queue.Queue()
+    for name in names:
+        threading.Thread(target=lambda name=name: results.put(probe_port(name, bauds)),
+                         daemon=True, name=f"probe {name}").start()
+
+    def close_rest(remaining):
+        for _ in range(remaining):
+            result = results.get()
+            if result is not None:
+                result[0].close()
+
+    for answered in range(1, len(names) + 1):
+        result = results.get()
+        if result is not None:
+            threading.Thread(target=close_rest, args=(len(names) - answered,), daemon=True).start()
+            return result
+    return None, None
+
+
+class Controller:
+    # Runs in the controller process
+    def __init__(self, conn, ports, log_level):
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.ports = ports
+        self.log_level = log_level
+        self.port = None
+        self.port_name = None
+        self.baud = None
+        self.lost_at = None
+        # Tags the board so a reset shows up on reconnect; never 0, which is
+        # what the board holds after a reset
+        self.session = random.randint(1, 2 ** 31 - 1)
+        # The board's count of finished moves as of the last DIRECTION_DONE
+        self.board_moves = None
+        self.write_lock = threading.Lock()
+        self.pending_commands = []
+        self.in_flight = None
+        self.command_sent = None
+        # LED commands since the last PATH_START, replayed on reconnect
+        self.led_commands = []
+        self.planner = None
+        self.grid = None
+        self.layouts = {}
+        self.plan_requests = []
+        self.plan_ready = threading.Condition()
+        self.profiler = SamplingProfiler()
+        self.running = True
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def run(self):
+        threading.Thread(target=self.plan_loop, daemon=True, name="planner").start()
+        threading.Thread(target=self.serial_loop, daemon=True, name="serial-listener").start()
+
+        while self.running:
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                break
+            kind = message[0]
+            if kind in ('layout', 'plan'):
+                with self.plan_ready:
+                    self.plan_requests.append(message)
+                    self.plan_ready.notify()
+            elif kind == 'drive':
+                with self.write_lock:
+                    self.pending_commands = list(message[1])
+                    self.report_sent(self.send_next_command())
+            elif kind == 'stop':
+                with self.write_lock:
+                    self.pending_commands = []
+                    self.in_flight = None
+            elif kind == 'write':
+                self.write(message[1])
+            elif kind == 'profile':
+                if message[1]:
+                    self.profiler.start(trace=False)
+                else:
+                    self.profiler.halt()
+                    self.send(('profile', dict(self.profiler.stacks), self.profiler.sample_count))
+            elif kind == 'close':
+                self.running = False
+
+        with self.write_lock:
+            if self.port is not None:
+                self.port.close()
+        for layout in self.layouts.values():
+            layout.close()
+
+    # --- Serial ---
+
+    def write(self, data):
+        with self.write_lock:
+            for line in data.decode(errors='replace').split():
+                if line.startswith('PATH_START:'):
+                    self.led_commands = [line]
+                elif line.startswith('FOOD_RECEIVED:'):
+                    self.led_commands.append(line)
+            if self.port is None:
+                return
+            try:
+                self.port.write(data)
+                self.port.flush()
+            except Exception as e:
+                print(f"Error sending to Arduino: {e}")
+
+    def send_next_command(self):
+        # Caller holds write_lock. A command stays in flight until its
+        # DIRECTION_DONE, so it can be resent if the link drops first.
+        # Returns the command written, if any.
+        if self.in_flight is not None or not self.pending_commands or self.port is None:
+            return None
+        self.in_flight = self.pending_commands.pop(0)
+        try:
+            self.command_sent = time.perf_counter()
+            self.port.write(f"{self.in_flight}\n".encode())
+            self.port.flush()
+            print(f"Sent to Arduino: {self.in_flight}")
+            return self.in_flight
+        except Exception as e:
+            print(f"Error sending to Arduino: {e}")
+            return None
+
+    def report_sent(self, command):
+        if command is not None:
+            self.send(('sent', command))
+
+    def reconnect_ports(self):
+        # Only the port that dropped and the ports we were given. Other
+        # serial devices on the machine never get a PING from us.
+        names = [self.port_name]
+        if self.ports is not None:
+            names += [name for name in self.ports if name != self.port_name]
+        return names
+
+    def connect(self):
+        # One round of parallel probing. Try the rate we were last using
+        # first, in case the board kept running through the glitch.
+        reconnecting = self.port_name is not None
+        names = self.reconnect_ports() if reconnecting else candidate_ports(self.ports)
+        bauds = (DEFAULT_BAUD,) if self.baud in (None, DEFAULT_BAUD) else (self.baud, DEFAULT_BAUD)
+        port, baud = probe_ports(names, bauds)
+        if port is None:
+            return False
+        print(f"Connected to {port.port} at {baud} baud")
+        if baud == DEFAULT_BAUD:
+            baud = negotiate_baud(port)
+        if set_log_level(port, self.log_level):
+            print(f"Arduino logging set to {self.log_level}")
+        # Firmware without sessions can't say, so count it as reset
+        previous, moves = start_session(port, self.session)
+        board_reset = previous != self.session
+        if previous == 0 and not reconnecting:
+            # Freshly booted with the kiosk; the robot is at home
+            print("Running the motor and LED self-test")
+            if not run_self_test(port):
+                print("Self-test did not finish")
+
+        with self.write_lock:
+            self.port, self.port_name, self.baud = port, port.port, baud
+            downtime = None
+            if self.lost_at is not None:
+                downtime = time.perf_counter() - self.lost_at
+                self.lost_at = None
+            replan = False
+            if reconnecting:
+                # The LEDs are off after a reset, and anything sent while
+                # the link was down never arrived
+                for command in self.led_commands:
+                    port.write(f"{command}\n".encode())
+                port.flush()
+            if board_reset and reconnecting:
+                print("The Arduino reset while the link was down")
+                if self.in_flight is not None or self.pending_commands:
+                    # The robot stopped somewhere inside the interrupted
+                    # command; running it again in full would overshoot
+                    print(f"Dropping {self.in_flight} and {len(self.pending_commands)} more, "
+                          f"the UI replans the leg")
+                    self.in_flight = None
+                    self.pending_commands = []
+                    replan = True
+            self.send(('serial', port.port, baud, downtime, replan))
+            finished = self.in_flight is not None and moves is not None and \
+                self.board_moves is not None and moves > self.board_moves
+            self.board_moves = moves
+            if finished:
+                # Its DIRECTION_DONE was lost with the link
+                print(f"{self.in_flight} finished while the link was down")
+                self.in_flight = None
+                sent = self.send_next_command()
+                self.send(('line', "DIRECTION_DONE", None))
+                self.report_sent(sent)
+                return True
+            # Pick the leg up where the robot left off
+            if self.in_flight is not None:
+                print(f"Resuming at {self.in_flight}")
+                self.pending_commands.insert(0, self.in_flight)
+                self.in_flight = None
+            self.report_sent(self.send_next_command())
+        return True
+
+    def connection_lost(self, error):
+        print(f"Lost the Arduino: {error}")
+        with self.write_lock:
+            try:
+                self.port.close()
+            except Exception:
+                pass
+            self.port = None
+            self.command_sent = None
+            self.lost_at = time.perf_counter()
+        self.send(('serial', None, None, None, False))
+
+    def serial_loop(self):
+        attempt = 0
+        while self.running:
+            if self.port is None:
+                if self.connect():
+                    attempt = 0
+                    continue
+                if attempt == 0 and self.lost_at is None:
+                    # Nothing at startup; let the UI know, but keep looking
+                    self.send(('serial', None, None, None, False))
+                time.sleep(min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2 ** attempt))
+                attempt += 1
+                continue
+            try:
+                response = self.port.readline().decode(errors='replace').strip()
+            except Exception as e:
+                # pyserial raises once the device node is gone
+                self.connection_lost(e)
+                continue
+            if not response:
+                continue
+            round_trip = None
+            sent = None
+            if response == "DIRECTION_DONE":
+                with self.write_lock:
+                    if self.command_sent is not None:
+                        round_trip = time.perf_counter() - self.command_sent
+                        self.command_sent = None
+                    self.in_flight = None
+                    if self.board_moves is not None:
+                        self.board_moves += 1
+                    sent = self.send_next_command()
+            # The reply goes to the UI before the command it released, so
+            # the two arrive in the order the Arduino saw them
+            self.send(('line', response, round_trip))
+            self.report_sent(sent)
+
+    # --- Planning ---
+
+    def plan_loop(self):
+        while True:
+            with self.plan_ready:
+                while not self.plan_requests:
+                    self.plan_ready.wait()
+                message = self.plan_requests.pop(0)
+            try:
+                if message[0] == 'layout':
+                    self.load_layout(*message[1:])
+                else:
+                    self.plan(*message[1:])
+            except Exception as e:
+                print(f"Error in planner: {e}")
+                if message[0] == 'plan':
+                    self.send(('failed', message[1], str(e)))
+
+    def load_layout(self, name, shape, settings):
+        layout = SharedLayout(shape, name)
+        self.grid = layout.read_grid()
+        self.planner = Planner(settings['planner_mode'], settings['use_landmarks'])
+        self.planner.compile_layout(self.grid, settings['image_path'])
+        # Requests are handled in order, so nothing will write into the
+        # earlier blocks any more
+        for old_layout in self.layouts.values():
+            old_layout.close()
+        self.layouts = {name: layout}
+
+    def plan(self, request_id, start, goal, layout_name, slot):
+        started = time.perf_counter()
+        path = self.planner.plan_path(self.grid, start, goal)
+        route = np.array(path, dtype=np.int16).reshape(-1, 2)
+        stats = {
+            'seconds': time.perf_counter() - started,
+            'nodes_expanded': self.planner.nodes_expanded
+        }
+        layout = self.layouts.get(layout_name)
+        if layout is not None and slot is not None:
+            layout.write_route(slot, route)
+            self.send(('planned', request_id, len(route), self.planner.search_bounds, stats))
+        else:
+            # No slot to spare, fall back to sending the route itself
+            self.send(('planned', request_id, route, self.planner.search_bounds, stats))
+
+
+def run_controller(conn, ports, log_level):
+    Controller(conn, ports, log_level).run()
+
+
+class ControllerLink:
+    # UI side of the controller process. Looks enough like a serial port
+    # (write, flush, is_open, close) for the UI's LED commands, and calls
+    # back into handler from its reader thread:
+    #   handler.serial_connected(port, baud, downtime_seconds, replan)
+    #   handler.serial_line(text, round_trip_seconds)
+    #   handler.leg_planned(start, goal, route, bounds, version, stats)
+    # Serial lines in both directions go to recorder (see replay.py) if given.
+    def __init__(self, handler, ports=None, log_level='QUIET', recorder=None):
+        self.handler = handler
+        self.ports = ports
+        self.log_level = log_level
+        self.recorder = recorder
+        self.conn = None
+        self.process = None
+        self.send_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.port_name = None
+        self.baud = None
+        self.layout = None
+        self.layouts = {}
+        self.requests = {}
+        self.next_request = 0
+        # Set once the controller process has gone; nothing is sent after
+        self.down = False
+        self.profile_request = None
+
+    def start(self):
+        # spawn keeps the child clear of the Tk and X state of this process
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_controller, daemon=True, name="controller",
+                                       args=(child_conn, self.ports, self.log_level))
+        self.process.start()
+        threading.Thread(target=self.receive_loop, daemon=True, name="controller-link").start()
+
+    def send(self, message):
+        with self.send_lock:
+            if not self.down:
+                self.conn.send(message)
+
+    def wait_for_serial(self, timeout=CONNECT_TIMEOUT):
+        self.connected.wait(timeout)
+        return self.port_name is not None
+
+    # --- Serial port stand-in ---
+
+    @property
+    def is_open(self):
+        return self.port_name is not None
+
+    def write(self, data):
+        if self.recorder is not None:
+            for line in data.decode(errors='replace').splitlines():
+                self.recorder.tx(line.strip())
+        self.send(('write', data))
+
+    def flush(self):
+        pass
+
+    def drive(self, commands):
+        # The controller sends these one per DIRECTION_DONE
+        self.send(('drive', list(commands)))
+
+    def stop(self):
+        self.send(('stop',))
+
+    def close(self):
+        if self.process is not None and self.process.is_alive():
+            self.send(('close',))
+            self.process.join(timeout=2)
+        for layout in self.layouts.values():
+            layout.unlink()
+        self.layouts.clear()
+
+    # --- Planning ---
+
+    def load_layout(self, grid, settings):
+        layout = SharedLayout(grid.shape)
+        layout.write_grid(grid)
+        # finish_request releases blocks on the link thread
+        with self.send_lock:
+            self.layouts[layout.name] = layout
+            previous, self.layout = self.layout, layout.name
+            if not self.down:
+                self.conn.send(('layout', layout.name, layout.shape, settings))
+            self.release_layout(previous)
+
+    def release_layout(self, name):
+        # Unlink a replaced block once no route slots are reserved in it.
+        # Called with send_lock held.
+        layout = self.layouts.get(name)
+        if layout is not None and name != self.layout and len(layout.free_slots) == ROUTE_SLOTS:
+            del self.layouts[name]
+            layout.unlink()
+
+    def plan(self, start, goal, version):
+        # Returns a Future resolved with the route array
+        future = Future()
+        with self.send_lock:
+            if self.down:
+                future.set_exception(RuntimeError("the controller process is not running"))
+                return future
+            request_id = self.next_request
+            self.next_request += 1
+            layout = self.layouts[self.layout]
+            slot = layout.free_slots.pop() if layout.free_slots else None
+            self.requests[request_id] = (future, start, goal, version, layout.name, slot)
+            self.conn.send(('plan', request_id, start, goal, layout.name, slot))
+        return future
+
+    # --- Profiling ---
+
+    def start_profile(self):
+        self.send(('profile', True))
+
+    def stop_profile(self):
+        # Returns a Future resolved with the controller's (stacks, samples)
+        future = Future()
+        with self.send_lock:
+            if self.down:
+                future.set_exception(RuntimeError("the controller process is not running"))
+                return future
+            self.profile_request = future
+            self.conn.send(('profile', False))
+        return future
+
+    def receive_loop(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                self.link_down()
+                return
+            kind = message[0]
+            if kind == 'serial':
+                self.port_name, self.baud = message[1], message[2]
+                self.connected.set()
+                self.handler.serial_connected(self.port_name, self.baud, message[3], message[4])
+            elif kind == 'line':
+                if self.recorder is not None:
+                    self.recorder.rx(message[1])
+                self.handler.serial_line(message[1], message[2])
+            elif kind == 'sent':
+                if self.recorder is not None:
+                    self.recorder.tx(message[1])
+            elif kind in ('planned', 'failed'):
+                self.finish_request(message)
+            elif kind == 'profile':
+                with self.send_lock:
+                    future, self.profile_request = self.profile_request, None
+                if future is not None:
+                    future.set_result((message[1], message[2]))
+
+    def link_down(self):
+        # The controller process died: fail every leg still planning so the
+        # UI doesn't wait on them, and report the Arduino as gone
+        print("Controller process exited")
+        with self.send_lock:
+            self.down = True
+            pending = [request[0] for request in self.requests.values()]
+            self.requests.clear()
+            if self.profile_request is not None:
+                pending.append(self.profile_request)
+                self.profile_request = None
+        for future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("the controller process exited"))
+        self.port_name = self.baud = None
+        self.connected.set()
+        self.handler.serial_connected(None, None, None, False)
+
+    def finish_request(self, message):
+        with self.send_lock:
+            future, start, goal, version, layout_name, slot = self.requests.pop(message[1])
+            layout = self.layouts.get(layout_name)
+            route = None
+            if message[0] == 'planned':
+                route = message[2]
+                if slot is not None:
+                    route = layout.read_route(slot, route)
+            if slot is not None:
+                layout.free_slots.append(slot)
+                self.release_layout(layout_name)
+        if route is not None:
+            self.handler.leg_planned(start, goal, route, message[3], version, message[4])
+        # Legs dropped by a new trip have been cancelled in the meantime
+        if not future.set_running_or_notify_cancel():
+            return
+        if route is None:
+            future.set_exception(RuntimeError(message[2]))
+        else:
+            future.set_result(route)
@@ -0,0 +1,118 @@
+# Delivery state machine.
+# A trip is a list of legs: one leg to each selected table, then one leg
+# back home. Every transition is an event (a command finished, the customer
+# picked up, a timeout fired), so nothing waits in a nested event loop and
+# the call stack stays flat however many legs a trip has.
+#
+#   IDLE -> DRIVING -> AWAITING_PICKUP -> DRIVING ... -> RETURNING -> IDLE
+#
+# The controller (the app, or the simulator) does the actual work:
+#   resolve_leg(index)          -> leg dict with 'directions', or None
+#   leg_started(index)
+#   send_command(leg, index)
+#   prompt_pickup(table)
+#   pickup_done(table, source)  source is 'kiosk', 'sensor' or 'timeout'
+#   trip_complete()
+
+IDLE = 'idle'
+DRIVING = 'driving'
+AWAITING_PICKUP = 'awaiting_pickup'
+RETURNING = 'returning'
+
+# Leave a table on our own after this long without a pickup (None waits forever)
+PICKUP_TIMEOUT_MS = 60000
+
+
+class DeliveryStateMachine:
+    def __init__(self, controller, schedule, cancel, pickup_timeout_ms=PICKUP_TIMEOUT_MS):
+        self.controller = controller
+        self.schedule = schedule
+        self.cancel = cancel
+        self.pickup_timeout_ms = pickup_timeout_ms
+        self.state = IDLE
+        self.tables = []
+        self.current_path_index = 0
+        self.current_direction_index = 0
+        self.current_leg = None
+        self.timeout_id = None
+
+    def start(self, tables):
+        self.tables = list(tables)
+        self.current_path_index = 0
+        self.begin_leg()
+
+    def begin_leg(self):
+        self.current_direction_index = 0
+        self.current_leg = self.controller.resolve_leg(self.current_path_index)
+        if self.current_leg is None:
+            self.finish()
+            return
+        is_delivery = self.current_path_index < len(self.tables)
+        self.state = DRIVING if is_delivery else RETURNING
+        self.controller.leg_started(self.current_path_index)
+        self.send_next()
+
+    def send_next(self):
+        directions = self.current_leg['directions']
+        if self.current_direction_index < len(directions):
+            index = self.current_direction_index
+            self.current_direction_index += 1
+            self.controller.send_command(self.current_leg, index)
+        else:
+            self.leg_finished()
+
+    def direction_done(self):
+        # Stray acknowledgements outside a drive are ignored
+        if self.state in (DRIVING, RETURNING):
+            self.send_next()
+
+    def leg_finished(self):
+        if self.state == DRIVING:
+            self.state = AWAITING_PICKUP
+            self.controller.prompt_pickup(self.current_table())
+            self.restart_timeout()
+        else:
+            self.advance()
+
+    def current_table(self):
+        return self.tables[self.current_path_index]
+
+    def restart_timeout(self):
+        self.cancel_timeout()
+        if self.pickup_timeout_ms is not None:
+            self.timeout_id = self.schedule(self.pickup_timeout_ms, self.pickup_timed_out)
+
+    def cancel_timeout(self):
+        if self.timeout_id is not None:
+            self.cancel(self.timeout_id)
+            self.timeout_id = None
+
+    def pickup_confirmed(self, source='kiosk'):
+        if self.state != AWAITING_PICKUP:
+            return False
+        self.cancel_timeout()
+        self.controller.pickup_done(self.current_table(), source)
+        self.advance()
+        return True
+
+    def pickup_timed_out(self):
+        self.timeout_id = None
+        if self.state == AWAITING_PICKUP:
+            self.controller.pickup_done(self.current_table(), 'timeout')
+            self.advance()
+
+    def advance(self):
+        self.current_path_index += 1
+        self.begin_leg()
+
+    def finish(self):
+        self.cancel_timeout()
+        self.state = IDLE
+        self.current_leg = None
+        self.controller.trip_complete()
+
+    def reset(self):
+        # Abandon the current trip without completing it
+        self.cancel_timeout()
+        self.state = IDLE
+        self.current_leg = None
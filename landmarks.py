@@ -0,0 +1,135 @@
+import hashlib
+import os
+from collections import deque
+import numpy as np
+
+# ALT (A*, landmarks, triangle inequality) heuristic for the grid planner.
+# A few landmarks are picked per layout and the exact walking distance from
+# each of them to every free cell is stored. For any cell n and goal g,
+#   |d(L, n) - d(L, g)| <= d(n, g)
+# so the largest of these differences is an admissible heuristic that is
+# much tighter than Manhattan distance on maze-like layouts.
+
+DEFAULT_LANDMARK_COUNT = 4
+
+
+def bfs_distances(grid, source):
+    rows, cols = grid.shape
+    free = (grid == 0).ravel().tolist()
+    distances = [-1] * (rows * cols)
+
+    start = source[0] * cols + source[1]
+    distances[start] = 0
+    queue = deque([start])
+    while queue:
+        index = queue.popleft()
+        next_distance = distances[index] + 1
+        col = index % cols
+        neighbors = []
+        if col > 0:
+            neighbors.append(index - 1)
+        if col < cols - 1:
+            neighbors.append(index + 1)
+        if index >= cols:
+            neighbors.append(index - cols)
+        if index < (rows - 1) * cols:
+            neighbors.append(index + cols)
+        for neighbor in neighbors:
+            if free[neighbor] and distances[neighbor] < 0:
+                distances[neighbor] = next_distance
+                queue.append(neighbor)
+
+    return np.array(distances, dtype=np.int32).reshape(rows, cols)
+
+
+def grid_hash(grid):
+    digest = hashlib.sha1(np.ascontiguousarray(grid, dtype=np.uint8).tobytes())
+    digest.update(str(grid.shape).encode())
+    return digest.hexdigest()
+
+
+def landmark_path(image_path):
+    base, _ = os.path.splitext(image_path)
+    return base + ".landmarks.npz"
+
+
+class LandmarkTable:
+    def __init__(self, landmarks, distances, layout_hash):
+        self.landmarks = landmarks
+        self.distances = distances  # shape (landmarks, rows, cols), -1 where unreachable
+        self.layout_hash = layout_hash
+
+    @classmethod
+    def build(cls, grid, seed=None, count=DEFAULT_LANDMARK_COUNT):
+        # Farthest-point selection: start from the cell farthest from the
+        # seed, then keep adding the cell farthest from every landmark so far
+        if seed is None or grid[seed] != 0:
+            free = np.argwhere(grid == 0)
+            if free.size == 0:
+                raise ValueError("Layout has no free cells for landmarks.")
+            seed = (int(free[0][0]), int(free[0][1]))
+
+        seed_distances = bfs_distances(grid, seed)
+        reachable = seed_distances >= 0
+        landmark = np.unravel_index(np.argmax(seed_distances), grid.shape)
+
+        landmarks = []
+        tables = []
+        closest = np.full(grid.shape, np.iinfo(np.int32).max, dtype=np.int64)
+        for _ in range(count):
+            landmark = (int(landmark[0]), int(landmark[1]))
+            distances = bfs_distances(grid, landmark)
+            landmarks.append(landmark)
+            tables.append(distances)
+
+            closest = np.minimum(closest, np.where(distances >= 0, distances, closest))
+            candidates = np.where(reachable, closest, -1)
+            landmark = np.unravel_index(np.argmax(candidates), grid.shape)
+            if candidates[landmark] <= 0:
+                break
+
+        return cls(landmarks, np.stack(tables), grid_hash(grid))
+
+    @classmethod
+    def load(cls, path, grid):
+        # Returns None when the file is missing or belongs to another layout
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if str(data['layout_hash']) != grid_hash(grid):
+                return None
+            landmarks = [tuple(int(v) for v in cell) for cell in data['landmarks']]
+            return cls(landmarks, data['distances'], str(data['layout_hash']))
+
+    @classmethod
+    def load_or_build(cls, image_path, grid, seed=None, count=DEFAULT_LANDMARK_COUNT):
+        path = landmark_path(image_path)
+        table = cls.load(path, grid)
+        if table is None:
+            table = cls.build(grid, seed, count)
+            table.save(path)
+        return table
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            landmarks=np.array(self.landmarks, dtype=np.int32),
+            distances=self.distances,
+            layout_hash=np.array(self.layout_hash)
+        )
+
+    def heuristic_to(self, goal):
+        # Evaluate the bound for every cell at once, then hand A* a plain
+        # lookup so the per-node cost stays a couple of list indexings
+        rows, cols = self.distances.shape[1:]
+        row_index, col_index = np.ogrid[:rows, :cols]
+        bound = np.abs(row_index - goal[0]) + np.abs(col_index - goal[1])
+        for distances in self.distances:
+            to_goal = distances[goal]
+            if to_goal < 0:
+                continue
+            difference = np.where(distances >= 0, np.abs(distances - to_goal), 0)
+            bound = np.maximum(bound, difference)
+
+        table = bound.tolist()
+        return lambda node: table[node[0]][node[1]]
@@ -1,14 +1,25 @@
-import cv2
 import numpy as np
-import heapq
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import tkinter as tk
 from tkinter import messagebox
 import time
-import serial
-import threading
-from PIL import Image, ImageTk
+import os
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeout
+from types import SimpleNamespace
+from anyangle import path_corners
+from commands import compile_polyline, pose_after, INITIAL_HEADING
+from motion import command_duration
+from orderapi import OrderServer, OrderRejected
+from telemetry import Telemetry, COUNT_BUCKETS
+from profiling import SamplingProfiler
+from delivery import DeliveryStateMachine, IDLE, DRIVING, RETURNING, PICKUP_TIMEOUT_MS
+from reachability import UnreachableError
+from routecache import RouteCache, layout_changes, load_stations, stations_path
+from metricmap import MetricMap, calibration_path, load_calibration
+from planner import Planner, get_directions, image_to_binary_array
+from controller import ControllerLink, CONNECT_TIMEOUT, PLAN_TIMEOUT
+from replay import SessionRecorder
+from pools import FigurePool, DialogPool, ImageCache
 
 # Define stations and their coordinates
 STATIONS = {
@@ -18,8 +29,41 @@ STATIONS = {
     'table4': (255, 146)
 }
 
+# Layout image, watched for changes while the app runs. Stations can be
+# overridden with a <layout>.stations.json file next to it, and a
+# <layout>.calibration.json gives its scale and the robot's size so routes
+# are planned on robot-sized cells and driven in millimetres (see metricmap.py).
+LAYOUT_IMAGE = "demolayout.png"
+LAYOUT_POLL_MS = 1000
+
+
+# Metrics file and optional local Prometheus endpoint (None to disable)
+METRICS_FILE = "mesamate_metrics.log"
+METRICS_HTTP_PORT = None
+
+# How long the admin profiling window runs (milliseconds)
+PROFILE_WINDOW_MS = 15000
+# How long to wait for the controller process's samples after it (milliseconds)
+PROFILE_REPLY_MS = 2000
+
+# Arduino log level once connected: 'QUIET' sends only protocol messages,
+# 'VERBOSE' adds the debug text (see seriallink.py)
+SERIAL_LOG_LEVEL = 'QUIET'
+
+# Order intake API for waiter tablets (None to disable). Set a token to
+# require "Authorization: Bearer <token>" (or ?token= on the WebSocket).
+# Anything can dispatch the robot through it, so it only listens on the
+# kiosk itself unless a token is set; with a token, "0.0.0.0" opens it to
+# the tablets on the network.
+ORDER_API_HOST = "127.0.0.1"
+ORDER_API_PORT = 8765
+ORDER_API_TOKEN = None
+
+# Log of serial traffic and UI events for replay.py (None to disable)
+SESSION_LOG = None
+
 class MesamateApp:
-    def __init__(self, root):
+    def __init__(self, root, serial_ports=None):
         self.root = root
         self.root.title("MESAMATE")
         self.root.geometry("800x480")  # Reduced height for 10.1-inch display
@@ -29,43 +73,36 @@ class MesamateApp:
         self.accent_color = "#4a4a4a"
         self.text_color = "#2c2c2c"
         
-        # Initialize serial communication
-        try:
-            # Try different possible serial ports for Raspberry Pi
-            possible_ports = ['/dev/ttyACM0', '/dev/ttyUSB0', '/dev/ttyAMA0']
-            self.serial_port = None
-            
-            for port in possible_ports:
-                try:
-                    print(f"Attempting to connect to {port}...")
-                    self.serial_port = serial.Serial(port, 9600, timeout=1)
-                    # Wait for Arduino to reset
-                    time.sleep(2)
-                    print(f"Successfully connected to {port}")
-                    break
-                except Exception as e:
-                    print(f"Failed to connect to {port}: {str(e)}")
-                    continue
-                    
-            if self.serial_port is None:
-                raise Exception("No valid serial port found")
-                
-            self.serial_thread = threading.Thread(target=self.serial_listener, daemon=True)
-            self.serial_thread.start()
-            
+        # Runtime metrics, written to a rotating file in the background
+        self.metrics = Telemetry(METRICS_FILE)
+        self.metrics.start(METRICS_HTTP_PORT)
+        
+        # On-demand profiler, toggled with Ctrl+Shift+P from any screen
+        self.profiler = SamplingProfiler()
+        self.profile_reply = None
+        
+        # Drives each trip leg by leg from serial events and timeouts
+        self.delivery = DeliveryStateMachine(self, self.root.after, self.root.after_cancel, PICKUP_TIMEOUT_MS)
+        self.pickup_window = None
+        
+        # Serial traffic and kiosk inputs, for replaying the session offline
+        self.recorder = SessionRecorder(SESSION_LOG) if SESSION_LOG else None
+        
+        # The serial link and the planner live in a separate controller
+        # process (see controller.py); the link stands in for the serial port
+        self.controller = ControllerLink(self, serial_ports, SERIAL_LOG_LEVEL, self.recorder)
+        self.controller.start()
+        self.serial_port = self.controller
+        if self.controller.wait_for_serial(CONNECT_TIMEOUT):
             # Test communication
             self.serial_port.write(b"test\n")
-            time.sleep(0.1)
-            if self.serial_port.in_waiting:
-                response = self.serial_port.readline().decode().strip()
-                print(f"Arduino response: {response}")
-                
-        except Exception as e:
-            print(f"Error initializing serial port: {e}")
+        else:
+            # The controller keeps probing and connects as soon as the
+            # Arduino shows up
+            print("Error initializing serial port: No valid serial port found")
             messagebox.showerror("Serial Error", 
                                "Failed to initialize serial communication.\n" +
-                               "Please check if Arduino is connected and try again.")
-            self.serial_port = None
+                               "Please check if Arduino is connected; the kiosk will keep trying.")
             
         # Configure root window
         self.root.configure(bg=self.theme_color)
@@ -78,145 +115,289 @@ class MesamateApp:
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
         # Initialize variables
+        # Tables of the running trip, and of the selection screen, which
+        # stays open to the kiosk during a trip
         self.selected_tables = []
+        self.table_selection = []
         self.binary_array = None
         self.fig = None
         self.ax = None
         self.canvas = None
-        self.current_path_index = 0
         self.paths_to_process = []
-        self.processing_path = False
+        
+        # The trip figure, prompts and welcome images are reused every cycle
+        # instead of rebuilt (see pools.py)
+        self.figures = FigurePool()
+        self.dialogs = DialogPool(self.root)
+        self.images = ImageCache(self.root)
+        self.completion_popup = None
+        
+        # Planner settings (see planner.Planner), with the optional ALT
+        # landmark heuristic for grid searches (cached next to the layout).
+        # The searches run in the controller process; this side keeps the
+        # layout's metric map, the clearance map used to pick cruise speeds
+        # and the reachability index, so impossible legs are refused without
+        # a search.
+        self.planner = Planner('navmesh', use_landmarks=False)
+        self.unreachable_stations = {}
+        
+        # Scale of the layout and the robot-sized cells planned on, when the
+        # layout is calibrated
+        self.calibration = None
+        
+        # Heading the robot will have after the legs compiled so far
+        self.robot_heading = INITIAL_HEADING
+        
+        # Later legs are planned in the controller process while the robot drives
+        self.trip_started = time.perf_counter()
+        
+        # Routes planned so far, kept across trips and layout reloads
+        self.route_cache = RouteCache()
+        self.layout_version = None
+        
+        # Orders from waiter tablets wait here while the robot is out
+        self.order_queue = []
+        self.order_count = 0
+        self.order_api = None
+        if ORDER_API_PORT is not None:
+            self.order_api = OrderServer(self.submit_order, ORDER_API_HOST, ORDER_API_PORT, ORDER_API_TOKEN)
+            self.order_api.start()
         
         # Create welcome screen
         self.create_welcome_screen()
         
-    def serial_listener(self):
-        while True:
-            if self.serial_port and self.serial_port.is_open:
-                try:
-                    if self.serial_port.in_waiting:
-                        response = self.serial_port.readline().decode().strip()
-                        print(f"Received from Arduino: {response}")
-                        if response == "DIRECTION_DONE":
-                            # Only process next direction after receiving DIRECTION_DONE
-                            self.root.after(100, self.process_next_direction)  # Added small delay
-                except Exception as e:
-                    print(f"Error reading from serial port: {e}")
-            time.sleep(0.1)
+        # Load the layout now and keep watching it for edits
+        self.poll_layout()
+        
+    # --- Controller process callbacks (called on the controller-link thread) ---
+    
+    def serial_connected(self, port, baud, downtime, replan=False):
+        if port is None:
+            print("Controller has no serial link, reconnecting...")
+            self.metrics.increment("serial_disconnects")
+            return
+        print(f"Controller connected to {port} at {baud} baud")
+        if downtime is not None:
+            # Back after a glitch; unless the board reset, the controller
+            # resumed the leg on its own
+            print(f"Serial link restored after {downtime:.2f} s")
+            self.metrics.increment("serial_reconnects")
+            self.metrics.observe("serial_downtime_seconds", downtime)
+        if replan:
+            self.root.after(0, self.replan_leg)
             
-    def send_direction_to_arduino(self, direction):
-        if self.serial_port and self.serial_port.is_open:
+    def serial_line(self, response, round_trip):
+        print(f"Received from Arduino: {response}")
+        self.metrics.increment("serial_lines_received")
+        if response == "DIRECTION_DONE":
+            if round_trip is not None:
+                self.metrics.observe("command_round_trip_seconds", round_trip)
+            # The controller has already sent the next command of the leg
+            self.root.after(0, self.delivery.direction_done)
+        elif response == "PICKUP_DETECTED":
+            # Optional pickup sensor on the robot
+            self.root.after(0, self.delivery.pickup_confirmed, 'sensor')
+            
+    def leg_planned(self, start, goal, route, bounds, version, stats):
+        # Planning time and search effort recorded per leg
+        self.metrics.observe("leg_planning_seconds", stats['seconds'])
+        self.metrics.observe("leg_nodes_expanded", stats['nodes_expanded'], COUNT_BUCKETS)
+        self.metrics.increment("legs_planned" if len(route) else "legs_unreachable")
+        if len(route):
+            self.route_cache.put(start, goal, route, bounds, version)
+            
+    # --- Delivery state machine hooks (see delivery.py) ---
+    
+    def resolve_leg(self, index):
+        return self.wait_for_leg(index)
+        
+    def leg_started(self, index):
+        # Turn ON LED at the start of the trip; later legs get their LED
+        # from handle_food_received when the previous table is served
+        path_number = index + 1
+        print(f"\nStarting Path {path_number}: {self.paths_to_process[index]['description']}")
+        if path_number == 1 and self.serial_port and self.serial_port.is_open:
             try:
-                # Send single direction
-                direction_str = direction + "\n"
-                self.serial_port.write(direction_str.encode())
-                print(f"Sent to Arduino: {direction_str.strip()}")
-                # Flush to ensure the data is sent immediately
+                # First turn off all LEDs
+                for path in range(1, 4):
+                    command = f"FOOD_RECEIVED:{path}\n"
+                    self.serial_port.write(command.encode())
+                    self.serial_port.flush()
+                    time.sleep(0.1)
+                
+                # Then turn ON LED 10 for Path 1
+                command = "PATH_START:1\n"
+                print("Starting Path 1 - Turning ON LED 10")
+                self.serial_port.write(command.encode())
                 self.serial_port.flush()
-                # Wait for acknowledgment
-                time.sleep(0.1)
+                print("Sent path start command for Path 1")
+                time.sleep(0.5)
             except Exception as e:
-                print(f"Error sending to Arduino: {e}")
-                messagebox.showerror("Communication Error", "Failed to send direction to Arduino")
+                print(f"Error sending path start command: {e}")
                 
-    def process_next_direction(self):
-        if not self.processing_path and self.current_path_index < len(self.paths_to_process):
-            current_path = self.paths_to_process[self.current_path_index]
+    def send_command(self, current_path, index):
+        current_direction = current_path['directions'][index]
+        print(f"\nProcessing Path {self.delivery.current_path_index + 1}: {current_path['description']}")
+        print(f"Current direction {index + 1}/{len(current_path['directions'])}: {current_direction}")
+        
+        # The controller streams the whole leg, one command per DIRECTION_DONE,
+        # and holds it while the link is down
+        if index == 0 and self.serial_port:
+            self.serial_port.drive(current_path['directions'])
+        self.metrics.increment("commands_sent")
+        
+        # Clear the previous path and redraw the base image
+        redraw_started = time.perf_counter()
+        self.ax.clear()
+        self.ax.imshow(self.binary_array, cmap='gray')
+        
+        # Redraw all station points and labels
+        for station_name, coords in STATIONS.items():
+            self.ax.scatter(coords[1], coords[0], c='blue', s=100)
+            self.ax.text(coords[1], coords[0] - 10, f"Table {station_name[-1]}", 
+                        ha='center', va='bottom', color='blue', fontsize=10)
+        
+        # Redraw initial position
+        initial_position = (0, self.binary_array.shape[1] // 2)
+        self.ax.scatter(initial_position[1], initial_position[0], c='green', s=100)
+        self.ax.text(initial_position[1], initial_position[0] - 10, "Initial Position",
+                    ha='center', va='bottom', color='green', fontsize=10)
+        
+        # Draw the current path from its corner waypoints
+        corners = current_path['corners']
+        self.ax.plot(corners[:, 1], corners[:, 0], c='red', linewidth=2)
+        self.canvas.draw()
+        self.metrics.observe("ui_redraw_seconds", time.perf_counter() - redraw_started)
+        self.publish_status()
+        
+    def prompt_pickup(self, table):
+        print(f"\nArrived at Table {table[-1]}, waiting for pickup")
+        self.publish_status()
+        self.show_food_delivery_confirmation(table)
+        
+    def pickup_done(self, table, source):
+        # Close the prompt if the robot is leaving without a tap on it
+        print(f"Pickup at Table {table[-1]} finished ({source})")
+        self.metrics.increment(f"pickups_{source}")
+        if source != 'kiosk':
+            self.metrics.end_span(("confirmation", table), "confirmation_dwell_seconds")
+            if self.pickup_window is not None:
+                self.dialogs.release(self.pickup_window)
+            self.update_pickup_leds(table)
+        self.pickup_window = None
+        
+    def trip_complete(self):
+        print("\nAll orders have been completed!")
+        self.publish_status()
+        if self.order_queue:
+            # Orders from the tablets are waiting, go straight to the next trip
+            self.root.after(0, self.dispatch_next_order)
+        else:
+            self.show_completion_message()
             
-            if not hasattr(self, 'current_direction_index'):
-                self.current_direction_index = 0
-                # Turn ON LED at the start of the path
-                path_number = self.current_path_index + 1
-                if self.serial_port and self.serial_port.is_open:
-                    try:
-                        # For Path 1, explicitly turn ON LED 10
-                        if path_number == 1:
-                            # First turn off all LEDs
-                            for path in range(1, 4):
-                                command = f"FOOD_RECEIVED:{path}\n"
-                                self.serial_port.write(command.encode())
-                                self.serial_port.flush()
-                                time.sleep(0.1)
-                            
-                            # Then turn ON LED 10 for Path 1
-                            command = "PATH_START:1\n"
-                            print("Starting Path 1 - Turning ON LED 10")
-                            self.serial_port.write(command.encode())
-                            self.serial_port.flush()
-                            print("Sent path start command for Path 1")
-                        else:
-                            command = f"PATH_START:{path_number}\n"
-                            print(f"Sending path start command: {command.strip()}")
-                            self.serial_port.write(command.encode())
-                            self.serial_port.flush()
-                            print(f"Sent path start command for Path {path_number}")
-                        time.sleep(0.5)
-                    except Exception as e:
-                        print(f"Error sending path start command: {e}")
-                
-            if self.current_direction_index < len(current_path['directions']):
-                # Get current direction
-                current_direction = current_path['directions'][self.current_direction_index]
-                print(f"\nProcessing Path {self.current_path_index + 1}: {current_path['description']}")
-                print(f"Current direction {self.current_direction_index + 1}/{len(current_path['directions'])}: {current_direction}")
-                
-                # Send direction to Arduino
-                self.send_direction_to_arduino(current_direction)
-                
-                # Clear the previous path and redraw the base image
-                self.ax.clear()
-                self.ax.imshow(self.binary_array, cmap='gray')
-                
-                # Redraw all station points and labels
-                for station_name, coords in STATIONS.items():
-                    self.ax.scatter(coords[1], coords[0], c='blue', s=100)
-                    self.ax.text(coords[1], coords[0] - 10, f"Table {station_name[-1]}", 
-                                ha='center', va='bottom', color='blue', fontsize=10)
-                
-                # Redraw initial position
-                initial_position = (0, self.binary_array.shape[1] // 2)
-                self.ax.scatter(initial_position[1], initial_position[0], c='green', s=100)
-                self.ax.text(initial_position[1], initial_position[0] - 10, "Initial Position",
-                            ha='center', va='bottom', color='green', fontsize=10)
-                
-                # Draw the current path up to this direction
-                path = current_path['path']
-                path_x = [p[1] for p in path]
-                path_y = [p[0] for p in path]
-                self.ax.plot(path_x, path_y, c='red', linewidth=2)
-                self.canvas.draw()
-                
-                # Move to next direction
-                self.current_direction_index += 1
-                
-            else:
-                # All directions for current path completed
-                path_number = self.current_path_index + 1
-                print(f"\nPath {path_number} completed: {current_path['description']}")
-                
-                # Show food delivery confirmation for current table
-                if self.current_path_index < len(self.selected_tables):
-                    current_table = self.selected_tables[self.current_path_index]
-                    self.show_food_delivery_confirmation(current_table)
-                else:
-                    print("Warning: No table selected for current path")
-                
-                self.current_path_index += 1
-                self.current_direction_index = 0
-                
-                if self.current_path_index >= len(self.paths_to_process):
-                    # All paths processed, show completion message
-                    print("\nAll orders have been completed!")
-                    self.show_completion_message()
-                else:
-                    # Process next path
-                    print(f"\nMoving to next path: {self.current_path_index + 1}")
-                    self.process_next_direction()
+    # --- Order intake from waiter tablets (see orderapi.py) ---
+    
+    def submit_order(self, tables):
+        # Called on the order API thread; the order is checked and queued on
+        # the Tk thread so it goes through the same path as the kiosk
+        future = Future()
+        self.root.after(0, self.accept_order, tables, future)
+        return future
+        
+    def accept_order(self, tables, future):
+        # Resolve the future, so a bad order gets its answer right away
+        # instead of waiting out the API's timeout. An order the API already
+        # gave up on (the tablet got a 503) is dropped, so a retry doesn't
+        # deliver it twice.
+        if not future.set_running_or_notify_cancel():
+            print(f"Dropping order {tables!r}, the tablet stopped waiting")
+            return
+        self.record_event('order', tables)
+        try:
+            result = self.queue_order(tables)
+        except OrderRejected as e:
+            future.set_exception(e)
+            return
+        except Exception as e:
+            print(f"Error accepting order {tables!r}: {e}")
+            future.set_exception(e)
+            return
+        future.set_result(result)
+        self.publish_status()
+        
+    def queue_order(self, tables, source="a tablet"):
+        # Dispatch or queue an order; raises OrderRejected for bad ones
+        if (not isinstance(tables, list) or not 1 <= len(tables) <= 3
+                or not all(isinstance(table, str) for table in tables)
+                or len(set(tables)) != len(tables)):
+            raise OrderRejected("an order needs 1 to 3 different table names")
+        unknown = [table for table in tables if table not in STATIONS]
+        if unknown:
+            raise OrderRejected(f"unknown tables: {unknown}")
+        unreachable = [table for table in tables if table in self.unreachable_stations]
+        if unreachable:
+            raise OrderRejected(f"unreachable on the current layout: {unreachable}")
             
+        self.order_count += 1
+        order_id = self.order_count
+        self.metrics.increment("orders_received")
+        if self.delivery.state == IDLE and not self.order_queue:
+            print(f"\nOrder {order_id} from {source}: {tables}, dispatching now")
+            self.dispatch_tables(tables)
+            position = 0
+        else:
+            self.order_queue.append((order_id, tables))
+            position = len(self.order_queue)
+            print(f"\nOrder {order_id} from {source}: {tables}, queued at position {position}")
+        return {'order_id': order_id, 'tables': tables, 'queue_position': position}
+        
+    def dispatch_next_order(self):
+        if self.order_queue and self.delivery.state == IDLE:
+            order_id, tables = self.order_queue.pop(0)
+            print(f"\nDispatching queued order {order_id}: {tables}")
+            self.dispatch_tables(tables)
+            
+    def robot_status(self):
+        delivery = self.delivery
+        status = {
+            'state': delivery.state,
+            'tables': list(delivery.tables),
+            'leg': None,
+            'legs': len(self.paths_to_process),
+            'description': None,
+            'direction_index': None,
+            'directions': None,
+            'eta_seconds': None,
+            'queued_orders': [{'order_id': order_id, 'tables': tables}
+                              for order_id, tables in self.order_queue]
+        }
+        leg = delivery.current_leg
+        if leg is not None and delivery.state != IDLE:
+            # The command in progress counts in full, so the ETA errs late
+            remaining = leg['directions'][max(delivery.current_direction_index - 1, 0):]
+            status.update({
+                'leg': delivery.current_path_index,
+                'description': leg['description'],
+                'direction_index': delivery.current_direction_index,
+                'directions': len(leg['directions']),
+                'eta_seconds': round(sum(map(command_duration, remaining)) / 1000, 1)
+            })
+        return status
+        
+    def publish_status(self):
+        if self.order_api is not None:
+            self.order_api.publish(self.robot_status())
+        
+    def clear_root(self):
+        # Destroy the current screen, keeping the pooled figure and dialogs
+        for widget in self.root.winfo_children():
+            if not (self.figures.owns(widget) or self.dialogs.owns(widget)):
+                widget.destroy()
+                
     def create_welcome_screen(self):
         # Clear any existing widgets
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self.figures.release()
+        self.clear_root()
             
         # Make window full screen (compatible with both macOS and Raspberry Pi OS)
         try:
@@ -240,17 +421,13 @@ class MesamateApp:
         main_frame.grid_columnconfigure(0, weight=1)
         
         # Create background image
+        screen_width = self.root.winfo_screenwidth()
+        screen_height = self.root.winfo_screenheight()
         try:
-            # Use PIL for better image handling
-            bg_img = Image.open("mesamatebg.png")
-            # Resize background image to fit screen
-            screen_width = self.root.winfo_screenwidth()
-            screen_height = self.root.winfo_screenheight()
-            bg_img = bg_img.resize((screen_width, screen_height), Image.Resampling.LANCZOS)
-            bg_image = ImageTk.PhotoImage(bg_img)
+            # Resized to fit the screen once, then reused from the cache
+            bg_image = self.images.get("mesamatebg.png", size=(screen_width, screen_height))
             # Add background to canvas
             canvas.create_image(0, 0, image=bg_image, anchor="nw")
-            canvas.image = bg_image  # Keep a reference to prevent garbage collection
         except Exception as e:
             print(f"Error loading background image: {e}")
             # Fallback to solid color background
@@ -258,13 +435,8 @@ class MesamateApp:
             
         # Create logo image
         try:
-            # Use PIL for better image handling
-            logo_img = Image.open("mesamatelogo.png")
-            # Calculate new size (reduce by 70% for smaller display)
-            new_width = int(logo_img.width * 0.3)
-            new_height = int(logo_img.height * 0.3)
-            logo_img = logo_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logo_image = ImageTk.PhotoImage(logo_img)
+            # Reduced by 70% for smaller display
+            logo_image = self.images.get("mesamatelogo.png", scale=0.3)
             # Add logo to canvas
             canvas.create_image(
                 screen_width // 2,
@@ -272,7 +444,6 @@ class MesamateApp:
                 image=logo_image,
                 anchor="center"
             )
-            canvas.logo_image = logo_image  # Keep a reference to prevent garbage collection
         except Exception as e:
             print(f"Error loading logo image: {e}")
             # Fallback to text logo
@@ -309,6 +480,73 @@ class MesamateApp:
                     pass
         self.root.bind("<Escape>", exit_fullscreen)
         
+        # Hidden admin key: profile the Tk threads here and the serial and
+        # planner threads in the controller process
+        self.root.bind("<Control-P>", self.toggle_profiling)
+        
+    def toggle_profiling(self, event=None):
+        if self.profiler.running:
+            # Pressing the key again ends the window early
+            self.finish_profiling()
+            return
+        if self.profile_reply is not None:
+            # Still collecting the last window
+            return
+        print(f"Profiling started for {PROFILE_WINDOW_MS / 1000:.0f} s")
+        self.profiler.start()
+        self.controller.start_profile()
+        self.profile_after_id = self.root.after(PROFILE_WINDOW_MS, self.finish_profiling)
+        
+    def finish_profiling(self):
+        if not self.profiler.running:
+            return
+        self.root.after_cancel(self.profile_after_id)
+        self.profiler.halt()
+        # Save once the controller's samples are in, or without them if the
+        # controller process doesn't answer in time
+        reply = self.profile_reply = self.controller.stop_profile()
+        reply.add_done_callback(lambda future: self.root.after(0, self.save_profile, future))
+        self.root.after(PROFILE_REPLY_MS, self.save_profile, reply)
+        
+    def save_profile(self, reply):
+        if reply is not self.profile_reply:
+            # Already saved
+            return
+        self.profile_reply = None
+        if reply.done() and reply.exception() is None:
+            stacks, samples = reply.result()
+            self.profiler.merge(stacks, "controller", samples)
+        else:
+            print("Profile is missing the controller process's samples")
+        summary, files = self.profiler.stop()
+        print("Profiling finished, wrote " + ", ".join(files))
+        for line in summary:
+            print(line)
+        self.show_profile_overlay(summary, files)
+        
+    def show_profile_overlay(self, summary, files):
+        overlay = tk.Toplevel(self.root)
+        overlay.title("Profile")
+        overlay.configure(bg="black")
+        overlay.attributes('-topmost', True)
+        
+        # Top-N hot functions in a monospaced list
+        text = "\n".join(summary + [""] + [f"Saved {path}" for path in files] + ["", "Tap to close"])
+        label = tk.Label(
+            overlay,
+            text=text,
+            font=("Courier", 10),
+            bg="black",
+            fg="#00ff00",
+            justify=tk.LEFT,
+            anchor="w",
+            padx=10,
+            pady=10
+        )
+        label.pack(fill="both", expand=True)
+        label.bind("<Button-1>", lambda e: overlay.destroy())
+        self.center_window(overlay)
+        
     def create_rounded_button(self, parent, text, command, width=15, height=1, font_size=10, is_bold=False):  # Reduced sizes
         # Create a frame for the button
         button_frame = tk.Frame(
@@ -335,6 +573,7 @@ class MesamateApp:
             highlightthickness=0
         )
         btn.pack(fill="both", expand=True)
+        button_frame.button = btn
         
         # Add hover effect
         def on_enter(e):
@@ -350,7 +589,7 @@ class MesamateApp:
 
     def show_table_selection(self, event):
         # Clear the selected tables array when entering selection screen
-        self.selected_tables = []
+        self.table_selection = []
         
         # Create a new window for table selection
         self.selection_window = tk.Toplevel(self.root)
@@ -484,21 +723,29 @@ class MesamateApp:
         
     def select_table(self, table):
         # Check if table is already selected
-        if table in self.selected_tables:
+        if table in self.table_selection:
             # Remove the table if it's already selected (toggle off)
-            self.selected_tables.remove(table)
+            self.table_selection.remove(table)
             # Update button state to white
             self.update_button_state(table, False)
         else:
+            # Tables the robot can't get to on the current layout
+            if table in self.unreachable_stations:
+                messagebox.showwarning(
+                    "Table Unreachable",
+                    f"The robot can't reach Table {table[-1]} on the current layout.\n"
+                    f"{self.unreachable_stations[table]}"
+                )
+                return
             # Check maximum table limit
-            if len(self.selected_tables) >= 3:
+            if len(self.table_selection) >= 3:
                 messagebox.showwarning(
                     "Maximum Tables Reached",
                     "You can only select up to 3 tables at a time.\nPlease clear your selection or remove a table first."
                 )
                 return
             # Add the table to selection
-            self.selected_tables.append(table)
+            self.table_selection.append(table)
             # Update button state to selected
             self.update_button_state(table, True)
             
@@ -538,7 +785,7 @@ class MesamateApp:
                                 table_name = f"table{table_num}"
                                 
                                 # Update button appearance based on selection state
-                                if table_name in self.selected_tables:
+                                if table_name in self.table_selection:
                                     button.configure(
                                         bg="#e0e0e0",  # Light gray for selected
                                         relief=tk.SUNKEN
@@ -550,7 +797,7 @@ class MesamateApp:
                                     )
                                 
                                 # Disable button if max tables reached and not selected
-                                if len(self.selected_tables) >= 3 and table_name not in self.selected_tables:
+                                if len(self.table_selection) >= 3 and table_name not in self.table_selection:
                                     button.configure(state=tk.DISABLED)
                                 else:
                                     button.configure(state=tk.NORMAL)
@@ -568,7 +815,7 @@ class MesamateApp:
                     
     def clear_selection(self):
         # Clear the selected tables array
-        self.selected_tables = []
+        self.table_selection = []
         
         # Update visual feedback
         self.update_table_boxes()
@@ -581,7 +828,7 @@ class MesamateApp:
         for widget in self.table_boxes_frame.winfo_children():
             widget.destroy()
             
-        if not self.selected_tables:
+        if not self.table_selection:
             # Show "No tables selected" in a box
             no_tables_frame = tk.Frame(
                 self.table_boxes_frame,
@@ -605,7 +852,7 @@ class MesamateApp:
             boxes_container.pack(pady=5)
             
             # Create boxes for each selected table
-            for i, table in enumerate(self.selected_tables):
+            for i, table in enumerate(self.table_selection):
                 table_frame = tk.Frame(
                     boxes_container,
                     bg="white",
@@ -624,7 +871,7 @@ class MesamateApp:
                 table_label.pack()
                 
                 # Add arrow between tables (except for the last one)
-                if i < len(self.selected_tables) - 1:
+                if i < len(self.table_selection) - 1:
                     arrow_label = tk.Label(
                         boxes_container,
                         text="→",
@@ -636,20 +883,43 @@ class MesamateApp:
         
     def start_path_visualization(self):
         # Validate selection before starting
-        if not self.selected_tables:
+        if not self.table_selection:
             messagebox.showwarning(
                 "No Tables Selected",
                 "Please select at least one table before starting."
             )
             return
             
-        if len(self.selected_tables) > 3:
+        if len(self.table_selection) > 3:
             messagebox.showerror(
                 "Invalid Selection",
                 "Maximum 3 tables allowed. Please clear and reselect."
             )
             return
             
+        # Close selection window
+        self.selection_window.destroy()
+        
+        # Same path as a tablet order, so a trip that is already running
+        # isn't abandoned; the order waits for it instead
+        self.record_event('dispatch', self.table_selection)
+        try:
+            result = self.queue_order(list(self.table_selection), source="the kiosk")
+        except OrderRejected as e:
+            messagebox.showerror("Order Rejected", str(e))
+            return
+        self.publish_status()
+        if result['queue_position']:
+            messagebox.showinfo(
+                "Order Queued",
+                f"The robot is on a trip. The order will start after it "
+                f"(position {result['queue_position']} in the queue)."
+            )
+        
+    def dispatch_tables(self, tables):
+        # Start a trip to the given tables; shared by the kiosk and the order API
+        self.selected_tables = list(tables)
+        
         # Reset all LEDs before starting new path
         if self.serial_port and self.serial_port.is_open:
             try:
@@ -670,28 +940,19 @@ class MesamateApp:
             except Exception as e:
                 print(f"Error resetting LEDs: {e}")
             
-        # Close selection window
-        self.selection_window.destroy()
-        
         # Clear main window
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self.clear_root()
             
         # Load and process the image
         try:
-            image_path = "demolayout.png"
-            self.binary_array = self.image_to_binary_array(image_path)
+            # Pick up layout edits that the watcher hasn't seen yet
+            self.refresh_layout()
             
-            # Create matplotlib figure with custom style
+            # Reuse the trip figure with custom style
             plt.style.use('default')  # Using default style instead of seaborn
-            self.fig, self.ax = plt.subplots(figsize=(10, 8))
-            self.fig.patch.set_facecolor(self.theme_color)
+            self.fig, self.ax, self.canvas = self.figures.acquire(self.root, self.theme_color)
             self.ax.imshow(self.binary_array, cmap='gray')
-            
-            # Create canvas
-            self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
             self.canvas.draw()
-            self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
             
             # Process the path
             self.process_station_sequence(self.binary_array, self.selected_tables)
@@ -705,89 +966,243 @@ class MesamateApp:
             self.selected_tables = []
             self.create_welcome_screen()
             
-    def image_to_binary_array(self, image_path, threshold=128):
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        if image is None:
-            raise ValueError("Image not found or could not be loaded.")
-        _, binary_image = cv2.threshold(image, threshold, 1, cv2.THRESH_BINARY_INV)
-        return binary_image
+    def refresh_layout(self):
+        # Reload the layout image and stations if either file changed. Only
+        # cached routes that touch the changed cells are thrown away.
+        version = tuple(os.path.getmtime(path) if os.path.exists(path) else None
+                        for path in (LAYOUT_IMAGE, stations_path(LAYOUT_IMAGE),
+                                     calibration_path(LAYOUT_IMAGE)))
+        if version == self.layout_version and self.binary_array is not None:
+            return
+            
+        start_time = time.perf_counter()
+        grid = image_to_binary_array(LAYOUT_IMAGE)
+        stations = load_stations(LAYOUT_IMAGE, STATIONS)
+        changed = layout_changes(self.binary_array, grid)
+        calibration = load_calibration(LAYOUT_IMAGE)
+        if calibration != self.calibration:
+            # Routes planned at another scale are no use
+            self.calibration = calibration
+            changed = None
+        if changed is None:
+            self.route_cache.clear()
+            dropped = None
+        elif changed.any():
+            dropped = self.route_cache.invalidate(changed)
+        else:
+            dropped = 0
+            
+        if changed is None or changed.any():
+            self.binary_array = grid
+            self.load_layout(grid)
+        stations_changed = stations != STATIONS
+        if stations_changed:
+            # Update in place so every screen sees the new table positions
+            STATIONS.clear()
+            STATIONS.update(stations)
+            print(f"Stations reloaded: {STATIONS}")
+        if changed is None or changed.any() or stations_changed:
+            self.check_stations()
+        self.layout_version = version
+        
+        elapsed = (time.perf_counter() - start_time) * 1000
+        if changed is None:
+            print(f"Layout loaded from {LAYOUT_IMAGE} in {elapsed:.1f} ms")
+        else:
+            print(f"Layout reloaded in {elapsed:.1f} ms: {int(changed.sum())} cells changed, "
+                  f"{dropped} routes invalidated, {len(self.route_cache)} still cached")
+        self.metrics.increment("layout_reloads")
         
-    def heuristic(self, a, b):
-        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+    def poll_layout(self):
+        try:
+            self.refresh_layout()
+        except Exception as e:
+            print(f"Error reloading layout: {e}")
+        self.root.after(LAYOUT_POLL_MS, self.poll_layout)
+        
+    def check_stations(self):
+        # Find stations that are off the layout, inside a wall or cut off
+        # from home as soon as the layout or stations change
+        home = (0, self.binary_array.shape[1] // 2)
+        self.unreachable_stations = self.planner.reachability.station_problems(STATIONS, home)
+        for station, problem in self.unreachable_stations.items():
+            print(f"WARNING: {station} can't be reached: {problem}")
+            self.metrics.increment("unreachable_station_warnings")
+        
+    def load_layout(self, grid):
+        # The planner structures are built in the controller process; the UI
+        # only needs the clearance map to compile speed profiles and the
+        # reachability index to refuse impossible legs up front
+        self.planner.compile_checks(grid, MetricMap(grid, **self.calibration) if self.calibration else None)
+        self.controller.load_layout(grid, {
+            'image_path': LAYOUT_IMAGE,
+            'planner_mode': self.planner.planner_mode,
+            'use_landmarks': self.planner.use_landmarks
+        })
+        
+    def compile_directions(self, path, return_home=False):
+        # Turn absolute moves into relative FWD/TURN commands, carrying the
+        # robot's heading over from the previous leg. The trip ends facing
+        # the same way it started so the next trip starts from a known heading.
+        # Commands are compiled from the corner waypoints so every straight run
+        # knows its clearance and long open runs get a speed profile
+        final_heading = INITIAL_HEADING if return_home else None
+        corners = path_corners(path)
+        if self.planner.planner_mode in ('octile', 'anyangle') or self.planner.metric_map is not None:
+            print(f"Corner waypoints: {corners}")
+        else:
+            print(f"Absolute moves: {get_directions(path)}")
+        unit_mm = self.planner.metric_map.mm_per_pixel if self.planner.metric_map is not None else None
+        commands, self.robot_heading = compile_polyline(corners, self.robot_heading, final_heading,
+                                                        self.planner.clearance, unit_mm)
+        return commands
+        
+    def queue_leg(self, grid, start, goal, description, return_home=False):
+        # Plan the leg on the worker thread; directions are compiled once the
+        # leg is dispatched because they depend on the heading left by the
+        # previous leg
+        print(f"\nQueueing {description}")
+        route = self.route_cache.get(start, goal)
+        problem = self.planner.reachability.problem(start, goal)
+        if problem is not None:
+            print(f"ERROR: Refusing {description}: {problem}")
+            self.metrics.increment("legs_refused")
+            future = Future()
+            future.set_exception(UnreachableError(f"No route: {problem}"))
+        elif route is not None:
+            print("Using cached route")
+            self.metrics.increment("route_cache_hits")
+            future = Future()
+            future.set_result(route)
+        else:
+            future = self.controller.plan(start, goal, self.route_cache.version)
+        self.paths_to_process.append({
+            'path': None,
+            'corners': None,
+            'directions': None,
+            'description': description,
+            'return_home': return_home,
+            'future': future
+        })
+        
+    def wait_for_leg(self, index):
+        # Resolve queued legs in order. This only blocks when the worker has
+        # not finished the leg yet, for at most PLAN_TIMEOUT; legs without a
+        # path are dropped.
+        while index < len(self.paths_to_process):
+            leg = self.paths_to_process[index]
+            if leg['directions'] is not None:
+                return leg
+            future = leg.pop('future')
+            try:
+                if not future.done():
+                    print(f"Waiting for {leg['description']} to finish planning...")
+                    with self.metrics.timer("leg_wait_seconds"):
+                        path = future.result(PLAN_TIMEOUT)
+                else:
+                    path = future.result()
+            except (UnreachableError, RuntimeError) as e:
+                # Refused up front or by the planner in the controller process
+                print(f"ERROR: {leg['description']}: {e}")
+                del self.paths_to_process[index]
+                continue
+            except FutureTimeout:
+                print(f"ERROR: {leg['description']} took over {PLAN_TIMEOUT:.0f} s to plan")
+                future.cancel()
+                del self.paths_to_process[index]
+                continue
+            if len(path):
+                leg['path'] = path
+                leg['corners'] = path_corners(path)
+                # Where the leg starts from, to replan it after an Arduino reset
+                leg['start_position'] = tuple(int(value) for value in leg['corners'][0])
+                leg['start_heading'] = self.robot_heading
+                leg['unit_mm'] = self.planner.metric_map.mm_per_pixel if self.planner.metric_map is not None else None
+                leg['directions'] = self.compile_directions(path, leg['return_home'])
+                print(f"{leg['description']} directions: {leg['directions']}")
+                if index == 0:
+                    elapsed = time.perf_counter() - self.trip_started
+                    self.metrics.observe("time_to_first_motion_seconds", elapsed)
+                    print(f"Time to first motion: {elapsed * 1000:.1f} ms")
+                return leg
+            print(f"ERROR: No path found for {leg['description']}")
+            del self.paths_to_process[index]
+        return None
+        
+    def replan_leg(self):
+        # The Arduino reset part way through a command and the controller
+        # dropped the rest of the leg. Plan it again from the pose after the
+        # last command the robot acknowledged.
+        delivery = self.delivery
+        leg = delivery.current_leg
+        if delivery.state not in (DRIVING, RETURNING) or leg is None:
+            return
+        acknowledged = max(delivery.current_direction_index - 1, 0)
+        position, heading = pose_after(leg['directions'][:acknowledged], leg['start_position'],
+                                       leg['start_heading'], leg['unit_mm'])
+        start = self.nearest_free_pixel(position)
+        goal = tuple(int(value) for value in leg['corners'][-1])
+        print(f"Replanning {leg['description']} from {start}, heading {heading}")
+        self.metrics.increment("legs_replanned")
+        if start is None or self.planner.reachability.problem(start, goal) is not None:
+            future = Future()
+            future.set_result([])
+        else:
+            future = self.controller.plan(start, goal, self.route_cache.version)
+        future.add_done_callback(
+            lambda future: self.root.after(0, self.leg_replanned, leg, acknowledged, start, heading, future))
+        
+    def leg_replanned(self, leg, acknowledged, start, heading, future):
+        if self.delivery.current_leg is not leg:
+            # The trip was reset while planning
+            return
+        try:
+            path = future.result()
+        except (CancelledError, RuntimeError) as e:
+            print(f"ERROR: Replanning {leg['description']}: {e}")
+            path = []
+        if len(path):
+            self.robot_heading = heading
+            leg['path'] = path
+            leg['corners'] = path_corners(path)
+            leg['start_position'] = start
+            leg['start_heading'] = heading
+            leg['directions'] = self.compile_directions(path, leg['return_home'])
+        else:
+            # Nothing better to go on: run the interrupted command again
+            print(f"WARNING: Could not replan {leg['description']}, resending from "
+                  f"{leg['directions'][acknowledged]}")
+            leg['start_position'], leg['start_heading'] = pose_after(
+                leg['directions'][:acknowledged], leg['start_position'], leg['start_heading'], leg['unit_mm'])
+            leg['directions'] = leg['directions'][acknowledged:]
+        print(f"{leg['description']} directions: {leg['directions']}")
+        self.delivery.current_direction_index = 0
+        self.delivery.send_next()
+        
+    def nearest_free_pixel(self, position):
+        # Closest free layout pixel to a dead-reckoned position, or None
+        free = np.argwhere(self.binary_array == 0)
+        if free.size == 0:
+            return None
+        distances = np.hypot(free[:, 0] - position[0], free[:, 1] - position[1])
+        r, c = free[np.argmin(distances)]
+        return (int(r), int(c))
+        
+    def cancel_queued_legs(self):
+        for leg in self.paths_to_process:
+            if 'future' in leg:
+                leg['future'].cancel()
         
-    def a_star_search(self, grid, start, goal):
-        rows, cols = grid.shape
-        open_set = []
-        heapq.heappush(open_set, (0, start))
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: self.heuristic(start, goal)}
-        
-        while open_set:
-            _, current = heapq.heappop(open_set)
-            if current == goal:
-                path = []
-                while current in came_from:
-                    path.append(current)
-                    current = came_from[current]
-                path.append(start)
-                path.reverse()
-                return path
-                
-            neighbors = [(0,1), (1,0), (0,-1), (-1,0)]
-            for dx, dy in neighbors:
-                neighbor = (current[0] + dx, current[1] + dy)
-                if 0 <= neighbor[0] < rows and 0 <= neighbor[1] < cols and grid[neighbor] == 0:
-                    tentative_g_score = g_score[current] + 1
-                    if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                        came_from[neighbor] = current
-                        g_score[neighbor] = tentative_g_score
-                        f_score[neighbor] = tentative_g_score + self.heuristic(neighbor, goal)
-                        heapq.heappush(open_set, (f_score[neighbor], neighbor))
-        return []
-        
-    def get_directions(self, path):
-        directions = []
-        current_dir = None
-        count = 0
-        
-        for i in range(len(path) - 1):
-            current = path[i]
-            next_pos = path[i + 1]
-            dx = next_pos[1] - current[1]  # x coordinate (column)
-            dy = next_pos[0] - current[0]  # y coordinate (row)
-            
-            # Determine direction
-            if dx == 1:
-                new_dir = 'right'
-            elif dx == -1:
-                new_dir = 'left'
-            elif dy == 1:
-                new_dir = 'down'
-            elif dy == -1:
-                new_dir = 'up'
-                
-            # Count consecutive same directions
-            if new_dir == current_dir:
-                count += 1
-            else:
-                if current_dir is not None:
-                    directions.append(f"{count}{current_dir}")
-                current_dir = new_dir
-                count = 1
-        
-        # Add the last direction
-        if current_dir is not None:
-            directions.append(f"{count}{current_dir}")
-        
-        return directions
-
     def process_station_sequence(self, grid, stations):
         rows, cols = grid.shape
         initial_position = (0, cols // 2)
+        self.cancel_queued_legs()
+        self.delivery.reset()
+        if self.serial_port:
+            self.serial_port.stop()
+        self.trip_started = time.perf_counter()
         self.paths_to_process = []  # Reset paths list
-        self.current_path_index = 0
-        self.processing_path = False
+        self.robot_heading = INITIAL_HEADING
         
         print("\n=== Starting Path Processing ===")
         print(f"Selected tables: {stations}")
@@ -805,56 +1220,26 @@ class MesamateApp:
         
         # First path: initial position to first station
         first_station = stations[0]
-        print(f"\nCalculating Path 1: Initial Position to {first_station}")
-        path = self.a_star_search(grid, initial_position, STATIONS[first_station])
-        if path:
-            directions = self.get_directions(path)
-            self.paths_to_process.append({
-                'path': path,
-                'directions': directions,
-                'description': f"Path 1 (Initial to {first_station})"
-            })
-            print(f"Path 1 directions: {directions}")
-        else:
-            print(f"ERROR: No path found for Initial Position to {first_station}")
+        self.queue_leg(grid, initial_position, STATIONS[first_station],
+                       f"Path 1 (Initial to {first_station})")
         
         # Process paths between consecutive stations
         for i in range(len(stations) - 1):
             current_station = stations[i]
             next_station = stations[i + 1]
-            print(f"\nCalculating Path {i+2}: {current_station} to {next_station}")
-            path = self.a_star_search(grid, STATIONS[current_station], STATIONS[next_station])
-            if path:
-                directions = self.get_directions(path)
-                self.paths_to_process.append({
-                    'path': path,
-                    'directions': directions,
-                    'description': f"Path {i+2} ({current_station} to {next_station})"
-                })
-                print(f"Path {i+2} directions: {directions}")
-            else:
-                print(f"ERROR: No path found for {current_station} to {next_station}")
+            self.queue_leg(grid, STATIONS[current_station], STATIONS[next_station],
+                           f"Path {i+2} ({current_station} to {next_station})")
         
         # Final path: last station back to initial position
         last_station = stations[-1]
-        print(f"\nCalculating Final Path: {last_station} to Initial Position")
-        path = self.a_star_search(grid, STATIONS[last_station], initial_position)
-        if path:
-            directions = self.get_directions(path)
-            self.paths_to_process.append({
-                'path': path,
-                'directions': directions,
-                'description': f"Path {len(stations)+1} ({last_station} to Initial)"
-            })
-            print(f"Final path directions: {directions}")
-        else:
-            print(f"ERROR: No path found for {last_station} to Initial Position")
+        self.queue_leg(grid, STATIONS[last_station], initial_position,
+                       f"Path {len(stations)+1} ({last_station} to Initial)", return_home=True)
         
-        print("\n=== All Paths Calculated ===")
+        print("\n=== All Paths Queued ===")
         print(f"Total paths to process: {len(self.paths_to_process)}")
         
-        # Start processing the first path
-        self.process_next_direction()
+        # Start the trip with the first path
+        self.delivery.start(stations)
         
     def show_completion_message(self):
         # Create completion message frame
@@ -917,19 +1302,18 @@ class MesamateApp:
         self.show_completion_popup()
         
     def show_completion_popup(self):
-        # Create a new window for completion message
-        popup = tk.Toplevel(self.root)
+        popup = self.dialogs.acquire('completion', self.build_completion_popup)
+        self.completion_popup = popup
+        
+        # Center the window
+        self.center_window(popup.window)
+        
+    def build_completion_popup(self, popup):
+        # Built once; later trips show the same window again
         popup.title("Order Completion")
         popup.geometry("400x200")
         popup.configure(bg=self.theme_color)
         
-        # Make window modal
-        popup.transient(self.root)
-        popup.grab_set()
-        
-        # Center the window
-        self.center_window(popup)
-        
         # Create main container
         main_container = tk.Frame(popup, bg=self.theme_color)
         main_container.pack(pady=20, padx=20, fill="both", expand=True)
@@ -959,31 +1343,37 @@ class MesamateApp:
         okay_btn = self.create_rounded_button(
             main_container,
             "OKAY",
-            lambda: [popup.destroy(), self.show_table_selection(None)],
+            self.close_completion_popup,
             width=15,
             height=2,
             font_size=14,
             is_bold=True
         )
         okay_btn.pack(pady=20)
+        return SimpleNamespace()
         
-        # Wait for window to be closed
-        self.root.wait_window(popup)
+    def close_completion_popup(self):
+        self.dialogs.release(self.completion_popup)
+        self.completion_popup = None
+        self.show_table_selection(None)
 
     def confirm_delivery(self, table):
-        # Create a new window for food delivery confirmation
-        confirm_window = tk.Toplevel(self.root)
+        # Yes confirms the table, No just closes the window
+        dialog = self.dialogs.acquire('confirm', self.build_confirmation_dialog)
+        dialog.message.configure(text=f"Has the food been received by the customer at Table {table[-1]}?")
+        dialog.yes.button.configure(command=lambda: self.handle_food_received(table, dialog))
+        dialog.no.button.configure(command=lambda: self.dialogs.release(dialog))
+        
+        # Center the window
+        self.center_window(dialog.window)
+        
+    def build_confirmation_dialog(self, confirm_window):
+        # Shared by the pickup prompt and confirm_delivery; callers fill in
+        # the message and the button commands for each table
         confirm_window.title("Food Delivery Confirmation")
         confirm_window.geometry("400x300")
         confirm_window.configure(bg=self.theme_color)
         
-        # Make window modal
-        confirm_window.transient(self.root)
-        confirm_window.grab_set()
-        
-        # Center the window
-        self.center_window(confirm_window)
-        
         # Create main container
         main_container = tk.Frame(confirm_window, bg=self.theme_color)
         main_container.pack(pady=20, padx=20, fill="both", expand=True)
@@ -1001,7 +1391,6 @@ class MesamateApp:
         # Message
         message_label = tk.Label(
             main_container,
-            text=f"Has the food been received by the customer at Table {table[-1]}?",
             font=("Helvetica", 12),
             bg=self.theme_color,
             fg=self.text_color,
@@ -1017,7 +1406,7 @@ class MesamateApp:
         yes_btn = self.create_rounded_button(
             button_frame,
             "Yes, Received",
-            lambda: self.handle_food_received(table, confirm_window),
+            None,
             width=15,
             height=1,
             font_size=12
@@ -1028,14 +1417,33 @@ class MesamateApp:
         no_btn = self.create_rounded_button(
             button_frame,
             "No, Not Yet",
-            confirm_window.destroy,
+            None,
             width=15,
             height=1,
             font_size=12
         )
         no_btn.pack(side=tk.LEFT, padx=10)
+        return SimpleNamespace(message=message_label, yes=yes_btn, no=no_btn)
 
-    def handle_food_received(self, table, window):
+    def handle_food_received(self, table, dialog):
+        self.record_event('pickup', table)
+        self.metrics.end_span(("confirmation", table), "confirmation_dwell_seconds")
+        self.metrics.increment("deliveries_confirmed")
+        self.update_pickup_leds(table)
+        
+        # Close the confirmation window
+        self.dialogs.release(dialog)
+        
+        # Let the robot head for its next leg before the info box opens
+        self.delivery.pickup_confirmed('kiosk')
+        
+        # Show success message
+        messagebox.showinfo(
+            "Delivery Confirmed",
+            f"Food delivery for Table {table[-1]} has been confirmed.\nThank you for using MESAMATE!"
+        )
+        
+    def update_pickup_leds(self, table):
         # Send command to Arduino to turn off LED and turn on next LED
         if self.serial_port and self.serial_port.is_open:
             try:
@@ -1071,40 +1479,33 @@ class MesamateApp:
                 
             except Exception as e:
                 print(f"Error sending LED control commands: {e}")
-        
-        # Close the confirmation window
-        window.destroy()
-        
-        # Show success message
-        messagebox.showinfo(
-            "Delivery Confirmed",
-            f"Food delivery for Table {table[-1]} has been confirmed.\nThank you for using MESAMATE!"
-        )
 
     def reset_and_return_to_welcome(self):
         # Clear the selected tables array
         self.selected_tables = []
         
-        # Clear any existing path visualization
-        if hasattr(self, 'canvas'):
-            self.canvas.get_tk_widget().destroy()
-        if hasattr(self, 'fig'):
-            plt.close(self.fig)
-            
-        # Return to welcome screen
+        # Return to welcome screen; the trip figure is hidden for the next trip
         self.create_welcome_screen()
 
     def on_closing(self):
-        # Close serial port if open
-        if self.serial_port and self.serial_port.is_open:
-            self.serial_port.close()
+        # Stop the controller process, which closes the serial port
+        self.controller.close()
             
         # Clear any existing selections
         self.selected_tables = []
         
-        # Close matplotlib figure if it exists
-        if hasattr(self, 'fig'):
-            plt.close(self.fig)
+        # Finish a profiling window that is still running
+        if self.profiler.running:
+            self.profiler.stop()
+        
+        # Stop taking orders from the tablets
+        if self.order_api is not None:
+            self.order_api.stop()
+        
+        # Write the final metrics snapshot
+        self.metrics.stop()
+        if self.recorder is not None:
+            self.recorder.close()
             
         # Destroy the root window
         self.root.destroy()
@@ -1123,72 +1524,30 @@ class MesamateApp:
                 messagebox.showerror("Error", "Failed to send LED test command")
 
     def show_food_delivery_confirmation(self, table):
-        # Create a new window for food delivery confirmation
-        confirm_window = tk.Toplevel(self.root)
-        confirm_window.title("Food Delivery Confirmation")
-        confirm_window.geometry("400x300")
-        confirm_window.configure(bg=self.theme_color)
-        
-        # Make window modal
-        confirm_window.transient(self.root)
-        confirm_window.grab_set()
+        self.metrics.start_span(("confirmation", table))
         
-        # Center the window
-        self.center_window(confirm_window)
+        dialog = self.dialogs.acquire('pickup', self.build_confirmation_dialog)
+        dialog.message.configure(text=f"Has the food been received by the customer at Table {table[-1]}?")
+        dialog.yes.button.configure(command=lambda: self.handle_food_received(table, dialog))
         
-        # Create main container
-        main_container = tk.Frame(confirm_window, bg=self.theme_color)
-        main_container.pack(pady=20, padx=20, fill="both", expand=True)
+        # No button keeps the robot waiting and restarts the auto-continue timer
+        dialog.no.button.configure(command=self.pickup_not_yet)
         
-        # Title
-        title_label = tk.Label(
-            main_container,
-            text="Food Delivery Confirmation",
-            font=("Helvetica", 16, "bold"),
-            bg=self.theme_color,
-            fg=self.text_color
-        )
-        title_label.pack(pady=(0, 20))
-        
-        # Message
-        message_label = tk.Label(
-            main_container,
-            text=f"Has the food been received by the customer at Table {table[-1]}?",
-            font=("Helvetica", 12),
-            bg=self.theme_color,
-            fg=self.text_color,
-            wraplength=350
-        )
-        message_label.pack(pady=10)
-        
-        # Button frame
-        button_frame = tk.Frame(main_container, bg=self.theme_color)
-        button_frame.pack(pady=20)
+        # Center the window
+        self.center_window(dialog.window)
         
-        # Yes button
-        yes_btn = self.create_rounded_button(
-            button_frame,
-            "Yes, Received",
-            lambda: self.handle_food_received(table, confirm_window),
-            width=15,
-            height=1,
-            font_size=12
-        )
-        yes_btn.pack(side=tk.LEFT, padx=10)
+        # Don't wait here; the delivery state machine continues on a tap,
+        # the pickup sensor or the timeout
+        self.pickup_window = dialog
         
-        # No button
-        no_btn = self.create_rounded_button(
-            button_frame,
-            "No, Not Yet",
-            confirm_window.destroy,
-            width=15,
-            height=1,
-            font_size=12
-        )
-        no_btn.pack(side=tk.LEFT, padx=10)
+    def pickup_not_yet(self):
+        self.record_event('not_yet')
+        self.delivery.restart_timeout()
         
-        # Wait for window to be closed
-        self.root.wait_window(confirm_window)
+    def record_event(self, name, *args):
+        # Kiosk inputs, with the delivery state they happened in
+        if self.recorder is not None:
+            self.recorder.ui(name, list(args), self.delivery)
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,122 @@
+import json
+import os
+import cv2
+import numpy as np
+
+# Calibrated metric map for a layout.
+# A layout image says nothing about scale, so on its own every planner
+# searches raw pixels and FWD counts pixels: a 2000 px drawing of the same
+# room takes 16 times the search of a 500 px one and drives 4 times as far.
+# An optional sidecar next to the layout pins the scale down:
+#   <layout>.calibration.json  {"meters_per_pixel": 0.01, "robot_diameter_m": 0.3}
+# The occupancy grid is then resampled to cells one robot diameter across.
+# A cell is free when the robot fits at its centre and all the way towards
+# the centres of its eight neighbours, up to the cell's edge. A move between
+# two free cells is covered half by each, so routes planned on the cells keep
+# the whole robot clear of walls, and searches cover a few thousand cells
+# instead of hundreds of thousands of pixels. Routes come back as pixels through the
+# cell centres, so drawing, the route cache and the shared layout are
+# unchanged, and straight runs are sent in millimetres (FWD_MM, see motion.py).
+
+# How far a station or start pixel may be moved to a free cell (cells)
+SNAP_CELLS = 1
+
+
+def calibration_path(image_path):
+    base, _ = os.path.splitext(image_path)
+    return base + ".calibration.json"
+
+
+def load_calibration(image_path):
+    # {"meters_per_pixel": ..., "robot_diameter_m": ...}, or None when the
+    # layout has no calibration and planning stays on pixels
+    path = calibration_path(image_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        calibration = json.load(f)
+    return {
+        'meters_per_pixel': float(calibration['meters_per_pixel']),
+        'robot_diameter_m': float(calibration['robot_diameter_m'])
+    }
+
+
+def load_metric_map(image_path, grid):
+    calibration = load_calibration(image_path)
+    if calibration is None:
+        return None
+    return MetricMap(grid, calibration['meters_per_pixel'], calibration['robot_diameter_m'])
+
+
+class MetricMap:
+    def __init__(self, grid, meters_per_pixel, robot_diameter_m):
+        if meters_per_pixel <= 0 or robot_diameter_m <= 0:
+            raise ValueError("meters_per_pixel and robot_diameter_m must be positive")
+        self.meters_per_pixel = meters_per_pixel
+        self.mm_per_pixel = meters_per_pixel * 1000
+        self.robot_diameter_m = robot_diameter_m
+        # Pixels per cell side
+        self.factor = max(1, round(robot_diameter_m / meters_per_pixel))
+        self.pixel_shape = grid.shape
+
+        # Distance from every pixel to the nearest wall; the image border
+        # doesn't count as a wall
+        free = (grid == 0).astype(np.uint8)
+        wall_distance = cv2.distanceTransform(free, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        rows, cols = grid.shape
+        self.center_rows = np.minimum(np.arange(0, rows, self.factor) + self.factor // 2, rows - 1)
+        self.center_cols = np.minimum(np.arange(0, cols, self.factor) + self.factor // 2, cols - 1)
+        radius = robot_diameter_m / 2 / meters_per_pixel
+        # The robot's centre only ever moves along the straight lines between
+        # neighbouring cell centres. Each cell checks its half of those lines,
+        # sampled pixel by pixel out to half a cell. Between samples the wall
+        # distance can dip by at most half a diagonal step, so that margin is
+        # added to the radius.
+        half_cell = -(-self.factor // 2)
+        steps = np.arange(-half_cell, half_cell + 1)
+        clearance = np.full((len(self.center_rows), len(self.center_cols)), np.inf, dtype=np.float32)
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            for step in steps:
+                sample_rows = np.clip(self.center_rows + dr * step, 0, rows - 1)
+                sample_cols = np.clip(self.center_cols + dc * step, 0, cols - 1)
+                clearance = np.minimum(clearance, wall_distance[np.ix_(sample_rows, sample_cols)])
+        fits = clearance >= radius + np.sqrt(2) / 2
+        # Same convention as the pixel grid: 0 is free
+        self.cells = np.where(fits, 0, 1).astype(np.uint8)
+
+    def is_free(self, cell):
+        rows, cols = self.cells.shape
+        return 0 <= cell[0] < rows and 0 <= cell[1] < cols and self.cells[cell] == 0
+
+    def to_pixel(self, cell):
+        return (int(self.center_rows[cell[0]]), int(self.center_cols[cell[1]]))
+
+    def to_cell(self, pixel):
+        # Cell holding a layout pixel, or the free cell nearest to it within
+        # SNAP_CELLS when the robot doesn't fit there. None if there is none.
+        rows, cols = self.pixel_shape
+        if not (0 <= pixel[0] < rows and 0 <= pixel[1] < cols):
+            return None
+        cell = (int(pixel[0]) // self.factor, int(pixel[1]) // self.factor)
+        if self.is_free(cell):
+            return cell
+        candidates = [(cell[0] + dr, cell[1] + dc)
+                      for dr in range(-SNAP_CELLS, SNAP_CELLS + 1)
+                      for dc in range(-SNAP_CELLS, SNAP_CELLS + 1)]
+        candidates = [candidate for candidate in candidates if self.is_free(candidate)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: np.hypot(*np.subtract(self.to_pixel(candidate), pixel)))
+
+    def to_pixels(self, path):
+        # Cell path -> the pixel centres of its cells
+        return [self.to_pixel(cell) for cell in path]
+
+    def bounds_to_pixels(self, bounds):
+        # (top, left, bottom, right) in cells -> the pixels those cells cover
+        if bounds is None:
+            return None
+        top, left, bottom, right = bounds
+        rows, cols = self.pixel_shape
+        return (top * self.factor, left * self.factor,
+                min((bottom + 1) * self.factor - 1, rows - 1), min((right + 1) * self.factor - 1, cols - 1))
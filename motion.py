@@ -0,0 +1,128 @@
+import numpy as np
+
+# Speed profiles for straight runs.
+# The firmware drives every FWD at MOTOR_SPEED unless told otherwise, and
+# MOVEMENT_DURATION (ms per cell) is calibrated for that speed. For long,
+# roomy runs we ask for a higher cruise speed with a ramp at each end:
+#   FWD:<cells>:<cruise>:<ramp_ms>
+# The firmware ramps from MIN_SPEED up to <cruise> over <ramp_ms>, starts
+# ramping down early enough to reach MIN_SPEED at the end, and scales the
+# time per cell by MOTOR_SPEED / speed so the distance is unchanged.
+# Short hops and tight spots keep the plain FWD:<cells> at MOTOR_SPEED.
+# On calibrated layouts (see metricmap.py) runs are sent in millimetres
+# instead, FWD_MM:<mm>[:<cruise>:<ramp_ms>], and the firmware times them
+# from FORWARD_SPEED_MM_S, so the distance no longer depends on the image size.
+
+# PWM values, matching MOTOR_SPEED, MIN_SPEED and MAX_SPEED in motorcontrol.ino
+BASE_SPEED = 150
+MIN_SPEED = 100
+MAX_SPEED = 255
+
+# Firmware timings: ms per cell at BASE_SPEED, ms per 90 degree pivot and
+# the pause after a pivot (MOVEMENT_DURATION, TURN_DURATION in motorcontrol.ino)
+MOVEMENT_DURATION = 200
+TURN_DURATION = 500
+TURN_PAUSE = 100
+
+# Measured ground speed at BASE_SPEED (FORWARD_SPEED_MM_S in motorcontrol.ino)
+FORWARD_SPEED_MM_S = 250
+
+# Time to ramp between MIN_SPEED and the cruise speed (milliseconds)
+RAMP_MS = 400
+
+# Runs shorter than this stay at BASE_SPEED with no ramp (cells)
+SHORT_HOP_CELLS = 20
+
+# Run length at which the cruise speed reaches MAX_SPEED (cells)
+LONG_RUN_CELLS = 100
+
+# Aisle half-width below which we stay at BASE_SPEED, and above which the
+# clearance no longer limits the cruise speed (cells)
+MIN_CLEARANCE = 5
+FULL_CLEARANCE = 25
+
+# The same limits for calibrated layouts (millimetres)
+SHORT_HOP_MM = 1000
+LONG_RUN_MM = 5000
+MIN_CLEARANCE_MM = 250
+FULL_CLEARANCE_MM = 1250
+
+
+def free_run_lengths(free):
+    # Length of the horizontal run of free cells through every cell
+    rows, cols = free.shape
+    index = np.broadcast_to(np.arange(cols), free.shape)
+    last_wall = np.maximum.accumulate(np.where(free, -1, index), axis=1)
+    next_wall = np.minimum.accumulate(np.where(free, cols, index)[:, ::-1], axis=1)[:, ::-1]
+    return np.where(free, next_wall - last_wall - 1, 0)
+
+
+def clearance_map(grid):
+    # Half the width of the aisle through every free cell, in cells. Planned
+    # routes hug walls, so the distance to the nearest wall would say every
+    # aisle is tight; the free run across the aisle says how much room the
+    # robot really has.
+    free = grid == 0
+    across = np.minimum(free_run_lengths(free), free_run_lengths(free.T).T)
+    return across.astype(np.float32) / 2
+
+
+def segment_clearance(clearance, a, b):
+    # Smallest half aisle width along the straight line from a to b
+    steps = max(abs(b[0] - a[0]), abs(b[1] - a[1])) + 1
+    rows = np.rint(np.linspace(a[0], b[0], steps)).astype(int)
+    cols = np.rint(np.linspace(a[1], b[1], steps)).astype(int)
+    return float(clearance[rows, cols].min())
+
+
+def cruise_speed(cells, clearance, unit_mm=None):
+    # Longer and roomier runs cruise faster; the tighter limit wins. With
+    # unit_mm (millimetres per cell) the limits are physical lengths.
+    short_hop, long_run = SHORT_HOP_CELLS, LONG_RUN_CELLS
+    min_clearance, full_clearance = MIN_CLEARANCE, FULL_CLEARANCE
+    if unit_mm is not None:
+        short_hop, long_run = SHORT_HOP_MM, LONG_RUN_MM
+        min_clearance, full_clearance = MIN_CLEARANCE_MM, FULL_CLEARANCE_MM
+        cells *= unit_mm
+        if clearance is not None:
+            clearance *= unit_mm
+    if cells < short_hop or clearance is None:
+        return BASE_SPEED
+    length_factor = min(1.0, (cells - short_hop) / (long_run - short_hop))
+    clearance_factor = min(1.0, max(0.0, (clearance - min_clearance) / (full_clearance - min_clearance)))
+    return int(BASE_SPEED + (MAX_SPEED - BASE_SPEED) * min(length_factor, clearance_factor))
+
+
+def forward_command(cells, clearance=None, unit_mm=None):
+    # FWD:<cells>, or FWD_MM:<mm> when the layout is calibrated
+    speed = cruise_speed(cells, clearance, unit_mm)
+    if unit_mm is None:
+        command = f"FWD:{cells}"
+    else:
+        command = f"FWD_MM:{round(cells * unit_mm)}"
+    if speed <= BASE_SPEED:
+        return command
+    return f"{command}:{speed}:{RAMP_MS}"
+
+
+def command_duration(command):
+    # Expected driving time of one firmware command in milliseconds
+    kind, _, args = command.partition(':')
+    if kind == 'TURN':
+        degrees = abs(int(args))
+        return degrees * TURN_DURATION / 90 + TURN_PAUSE if degrees else 0
+    if kind not in ('FWD', 'FWD_MM'):
+        raise ValueError(f"Unknown command: {command}")
+    fields = [int(field) for field in args.split(':')]
+    # Distance in milliseconds of driving at BASE_SPEED
+    if kind == 'FWD':
+        distance = fields[0] * MOVEMENT_DURATION
+    else:
+        distance = fields[0] * 1000 / FORWARD_SPEED_MM_S
+    if len(fields) == 1:
+        return distance
+    speed, ramp_ms = fields[1], fields[2]
+    ramp_distance = (MIN_SPEED + speed) / 2 * ramp_ms / BASE_SPEED
+    if distance < 2 * ramp_distance:
+        return distance * BASE_SPEED / ((MIN_SPEED + speed) / 2)
+    return 2 * ramp_ms + (distance - 2 * ramp_distance) * BASE_SPEED / speed
@@ -18,29 +18,73 @@ const int LED_PATH3 = 12;  // LED for third path
 // Distance threshold (in cm)
 const int DISTANCE_THRESHOLD = 30;
 
+// Ultrasonic ranging schedule
+const unsigned long RANGING_INTERVAL = 25;        // ms between pings
+const unsigned long ECHO_TIMEOUT_US = 6000;       // about 1 m, anything further counts as clear
+const float NO_ECHO_DISTANCE = 999.0;             // reported when no echo arrives in time
+const int MEDIAN_WINDOW = 5;                      // samples in the median filter
+const unsigned long OBSTACLE_REPORT_INTERVAL = 1000;  // ms between obstacle messages
+
+// Drive loop tick (in milliseconds)
+const unsigned long DRIVE_LOOP_INTERVAL = 5;
+
 // Motor speed (increased for better movement)
 const int MOTOR_SPEED = 150;  // Increased to about 60% of 255
 
+// Speed limits for profiled runs (FWD:<cells>:<cruise>:<ramp_ms>)
+const int MIN_SPEED = 100;   // Slowest PWM that still moves the robot reliably
+const int MAX_SPEED = 255;
+
 // Direction scaling factor
 const int SCALE_FACTOR = 1;
 
 // Movement duration (in milliseconds)
 const int MOVEMENT_DURATION = 200;
 
+// Ground speed at MOTOR_SPEED, for FWD_MM:<mm> (millimetres per second)
+const long FORWARD_SPEED_MM_S = 250;
+
 // Turn duration for 90 degrees (in milliseconds)
 const int TURN_DURATION = 500;
 
 // Maximum safe duration (about 5 minutes)
 const unsigned long MAX_DURATION = 300000;  // 300 seconds in milliseconds
 
+// Serial link. The board always boots at DEFAULT_BAUD; the host can ask
+// for a faster rate with BAUD:<rate> and must confirm it with PING within
+// BAUD_CONFIRM_TIMEOUT, otherwise we fall back to DEFAULT_BAUD.
+const long DEFAULT_BAUD = 9600;
+const long SUPPORTED_BAUDS[] = {19200, 38400, 57600, 115200};
+const unsigned long BAUD_CONFIRM_TIMEOUT = 1000;
+
+// Human-readable logging. LOG:QUIET limits output to protocol messages
+// (DIRECTION_DONE, PONG, BAUD_OK, LOG_OK and errors), LOG:VERBOSE restores it.
+bool verboseLogging = true;
+
+bool baudPending = false;
+unsigned long baudSwitchTime = 0;
+
+// Host session tag (SESSION:<id>) and moves finished since boot. Both start
+// at 0, so after a reconnect the host can tell whether the board reset and
+// whether the move it was waiting on finished while the link was down.
+unsigned long sessionId = 0;
+unsigned long movesDone = 0;
+
 // Buffer for receiving serial data
 String inputString = "";
 bool stringComplete = false;
 bool isMoving = false;
 
+// Recent distance samples for the median filter
+float distanceSamples[MEDIAN_WINDOW];
+int sampleCount = 0;
+int sampleIndex = 0;
+unsigned long lastPingTime = 0;
+unsigned long lastObstacleReport = 0;
+
 void setup() {
   // Initialize serial communication first
-  Serial.begin(9600);
+  Serial.begin(DEFAULT_BAUD);
   delay(1000);  // Give time for serial to initialize
   Serial.println("\n\n=== MESAMATE INITIALIZATION ===");
   
@@ -64,18 +108,15 @@ void setup() {
   pinMode(LED_PATH2, OUTPUT);
   pinMode(LED_PATH3, OUTPUT);
   
-  // Turn on all LEDs initially
-  digitalWrite(LED_PATH1, HIGH);
-  digitalWrite(LED_PATH2, HIGH);
-  digitalWrite(LED_PATH3, HIGH);
-  Serial.println("All LEDs turned ON at startup");
+  // LEDs start off; the host sets them again after connecting
+  digitalWrite(LED_PATH1, LOW);
+  digitalWrite(LED_PATH2, LOW);
+  digitalWrite(LED_PATH3, LOW);
   
   inputString.reserve(200);
   
-  // Test motors and LEDs on startup
-  Serial.println("\nTesting motors and LEDs...");
-  testMotors();
-  testLEDs();
+  // No self-test here: a reset mid-trip (DTR, brown-out) must not drive
+  // the robot around. The host asks for it with SELF_TEST on a fresh start.
   Serial.println("Arduino initialized and ready!");
 }
 
@@ -106,12 +147,72 @@ void testLEDs() {
 }
 
 void loop() {
+  // Drop back to the default rate if the host never confirmed the new one
+  if (baudPending && millis() - baudSwitchTime > BAUD_CONFIRM_TIMEOUT) {
+    switchBaud(DEFAULT_BAUD);
+    baudPending = false;
+  }
+  
   if (stringComplete) {
-    Serial.print("\nReceived command: ");
-    Serial.println(inputString);
+    if (verboseLogging) {
+      Serial.print("\nReceived command: ");
+      Serial.println(inputString);
+    }
     
+    // Link check, also confirms a baud rate change
+    if (inputString.startsWith("PING")) {
+      baudPending = false;
+      Serial.println("PONG");
+    }
+    // Baud rate change request
+    else if (inputString.startsWith("BAUD:")) {
+      String baudStr = inputString.substring(5);
+      baudStr.trim();
+      long baud = baudStr.toInt();
+      if (isSupportedBaud(baud)) {
+        Serial.print("BAUD_OK:");
+        Serial.println(baud);
+        switchBaud(baud);
+        baudPending = true;
+        baudSwitchTime = millis();
+      } else {
+        Serial.print("Error: Unsupported baud rate: ");
+        Serial.println(baud);
+      }
+    }
+    // Logging level
+    else if (inputString.startsWith("LOG:")) {
+      String level = inputString.substring(4);
+      level.trim();
+      if (level == "QUIET" || level == "VERBOSE") {
+        verboseLogging = (level == "VERBOSE");
+        Serial.print("LOG_OK:");
+        Serial.println(level);
+      } else {
+        Serial.print("Error: Unknown log level: ");
+        Serial.println(level);
+      }
+    }
+    // Session tag from the host; reply with the previous tag and the
+    // number of finished moves: SESSION_OK:<previous>:<moves>
+    else if (inputString.startsWith("SESSION:")) {
+      String idStr = inputString.substring(8);
+      idStr.trim();
+      Serial.print("SESSION_OK:");
+      Serial.print(sessionId);
+      Serial.print(":");
+      Serial.println(movesDone);
+      sessionId = strtoul(idStr.c_str(), NULL, 10);
+    }
+    // Full motor and LED self-test, only when the host asks for it
+    else if (inputString.startsWith("SELF_TEST")) {
+      Serial.println("\nTesting motors and LEDs...");
+      testMotors();
+      testLEDs();
+      Serial.println("SELF_TEST_DONE");
+    }
     // Check if it's a test LEDs command
-    if (inputString.startsWith("TEST_LEDS")) {
+    else if (inputString.startsWith("TEST_LEDS")) {
       Serial.println("Executing LED test sequence...");
       testLEDs();
     }
@@ -124,13 +225,17 @@ void loop() {
       
       // Validate path number
       if (pathNumber >= 1 && pathNumber <= 4) {
-        Serial.print("Starting Path ");
-        Serial.print(pathNumber);
-        Serial.println(" - Controlling LEDs");
+        if (verboseLogging) {
+          Serial.print("Starting Path ");
+          Serial.print(pathNumber);
+          Serial.println(" - Controlling LEDs");
+        }
         
         if (pathNumber == 4) {
           // Path 4: Turn on all LEDs
-          Serial.println("Path 4 - Turning ON all LEDs");
+          if (verboseLogging) {
+            Serial.println("Path 4 - Turning ON all LEDs");
+          }
           digitalWrite(LED_PATH1, HIGH);
           digitalWrite(LED_PATH2, HIGH);
           digitalWrite(LED_PATH3, HIGH);
@@ -168,9 +273,11 @@ void loop() {
       
       // Validate path number
       if (pathNumber >= 1 && pathNumber <= 3) {
-        Serial.print("Food received for Path ");
-        Serial.print(pathNumber);
-        Serial.println(" - Turning OFF LED");
+        if (verboseLogging) {
+          Serial.print("Food received for Path ");
+          Serial.print(pathNumber);
+          Serial.println(" - Turning OFF LED");
+        }
         
         // Turn off the appropriate LED
         switch(pathNumber) {
@@ -190,6 +297,34 @@ void loop() {
         Serial.println(" (must be between 1 and 3)");
       }
     }
+    // Relative drive command from the heading-aware planner, optionally
+    // with a speed profile: FWD:<cells>:<cruise>:<ramp_ms>. Calibrated
+    // layouts send the distance in millimetres instead: FWD_MM:<mm>...
+    else if (inputString.startsWith("FWD:") || inputString.startsWith("FWD_MM:")) {
+      bool metric = inputString.startsWith("FWD_MM:");
+      String args = inputString.substring(metric ? 7 : 4);
+      args.trim();
+      int cruiseSpeed = MOTOR_SPEED;
+      unsigned long rampTime = 0;
+      int split = args.indexOf(':');
+      if (split >= 0) {
+        String profile = args.substring(split + 1);
+        args = args.substring(0, split);
+        int rampSplit = profile.indexOf(':');
+        cruiseSpeed = constrain(profile.substring(0, rampSplit).toInt(), MIN_SPEED, MAX_SPEED);
+        if (rampSplit >= 0) {
+          rampTime = profile.substring(rampSplit + 1).toInt();
+        }
+      }
+      unsigned long duration = metric ? metricDuration(args.toInt()) : movementDuration(args.toInt());
+      processForward(duration, cruiseSpeed, rampTime);
+    }
+    // Relative pivot command, positive degrees turn clockwise (right)
+    else if (inputString.startsWith("TURN:")) {
+      String degreesStr = inputString.substring(5);
+      degreesStr.trim();
+      processTurn(degreesStr.toInt());
+    }
     else {
       processMovement(inputString);
     }
@@ -199,6 +334,27 @@ void loop() {
   }
 }
 
+bool isSupportedBaud(long baud) {
+  if (baud == DEFAULT_BAUD) {
+    return true;
+  }
+  for (unsigned int i = 0; i < sizeof(SUPPORTED_BAUDS) / sizeof(SUPPORTED_BAUDS[0]); i++) {
+    if (SUPPORTED_BAUDS[i] == baud) {
+      return true;
+    }
+  }
+  return false;
+}
+
+// Finish sending at the old rate, then reopen at the new one
+void switchBaud(long baud) {
+  Serial.flush();
+  Serial.end();
+  Serial.begin(baud);
+  inputString = "";
+  stringComplete = false;
+}
+
 void serialEvent() {
   while (Serial.available()) {
     char inChar = (char)Serial.read();
@@ -225,37 +381,37 @@ void processMovement(String movement) {
   direction = movement.substring(i);
   direction.trim();
   
-  Serial.print("Number: ");
-  Serial.print(number);
-  Serial.print(", Direction: ");
-  Serial.println(direction);
+  if (verboseLogging) {
+    Serial.print("Number: ");
+    Serial.print(number);
+    Serial.print(", Direction: ");
+    Serial.println(direction);
+  }
   
   // Calculate total movement duration
-  unsigned long totalDuration = (unsigned long)number * SCALE_FACTOR * MOVEMENT_DURATION;
+  unsigned long totalDuration = movementDuration(number);
   
-  if (totalDuration > MAX_DURATION) {
-    totalDuration = MAX_DURATION;
-    Serial.println("Warning: Duration capped at 5 minutes");
+  if (verboseLogging) {
+    Serial.print("Movement duration: ");
+    Serial.print(totalDuration);
+    Serial.println("ms");
   }
   
-  Serial.print("Movement duration: ");
-  Serial.print(totalDuration);
-  Serial.println("ms");
-  
   isMoving = true;
   
-  // Execute the movement with obstacle detection
-  unsigned long startTime = millis();
-  
   // First, handle the turn if needed
   if (direction == "right" || direction == "RIGHT") {
-    Serial.println("Turning right 90 degrees");
+    if (verboseLogging) {
+      Serial.println("Turning right 90 degrees");
+    }
     turnRight(TURN_DURATION);  // Turn right for 90 degrees
     delay(100);      // Small pause
     stopMotors();
     delay(100);      // Small pause
   } else if (direction == "left" || direction == "LEFT") {
-    Serial.println("Turning left 90 degrees");
+    if (verboseLogging) {
+      Serial.println("Turning left 90 degrees");
+    }
     turnLeft(TURN_DURATION);   // Turn left for 90 degrees
     delay(100);      // Small pause
     stopMotors();
@@ -263,30 +419,161 @@ void processMovement(String movement) {
   }
   
   // Then move forward for the specified duration
-  while (millis() - startTime < totalDuration) {
-    if (checkObstacle()) {
-      stopMotors();
-      Serial.println("Movement stopped due to obstacle");
-      delay(1000); // Wait for 1 second
-      if (!checkObstacle()) {
-        // Resume movement if obstacle is cleared
-        moveForward(MOTOR_SPEED);
+  driveForward(totalDuration, MOTOR_SPEED, 0);
+  
+  isMoving = false;
+  
+  // Send completion signal
+  sendDirectionDone();
+}
+
+// Drive straight ahead for the time the distance takes at MOTOR_SPEED
+void processForward(unsigned long duration, int cruiseSpeed, unsigned long rampTime) {
+  if (verboseLogging) {
+    Serial.print("Forward: ");
+    Serial.print(duration);
+    Serial.print("ms");
+    Serial.print(", cruise: ");
+    Serial.print(cruiseSpeed);
+    Serial.print(", ramp: ");
+    Serial.print(rampTime);
+    Serial.println("ms");
+  }
+  
+  isMoving = true;
+  driveForward(duration, cruiseSpeed, rampTime);
+  isMoving = false;
+  
+  sendDirectionDone();
+}
+
+// Pivot in place by any angle (positive = clockwise)
+void processTurn(int degrees) {
+  if (verboseLogging) {
+    Serial.print("Turning degrees: ");
+    Serial.println(degrees);
+  }
+  
+  // TURN_DURATION covers 90 degrees, other angles scale linearly
+  unsigned long duration = (unsigned long)abs(degrees) * TURN_DURATION / 90;
+  
+  isMoving = true;
+  if (duration > 0) {
+    if (degrees > 0) {
+      turnRight(duration);
+    } else {
+      turnLeft(duration);
+    }
+    stopMotors();
+    delay(100);      // Small pause
+  }
+  isMoving = false;
+  
+  sendDirectionDone();
+}
+
+// Convert a cell count into a capped driving duration
+unsigned long movementDuration(int number) {
+  return capDuration((unsigned long)number * SCALE_FACTOR * MOVEMENT_DURATION);
+}
+
+// Convert a distance in millimetres into a capped driving duration
+unsigned long metricDuration(long mm) {
+  if (mm < 0) {
+    mm = 0;
+  }
+  return capDuration((unsigned long)mm * 1000 / FORWARD_SPEED_MM_S);
+}
+
+unsigned long capDuration(unsigned long totalDuration) {
+  if (totalDuration > MAX_DURATION) {
+    totalDuration = MAX_DURATION;
+    if (verboseLogging) {
+      Serial.println("Warning: Duration capped at 5 minutes");
+    }
+  }
+  return totalDuration;
+}
+
+// Drive forward with obstacle detection, then stop.
+// Runs at a fixed tick so an obstacle stops the motors within a few pings.
+// Progress is counted in milliseconds of driving at MOTOR_SPEED, the speed
+// MOVEMENT_DURATION is calibrated for, so totalDuration always means the
+// same distance: faster cruising covers it in proportionally less time,
+// and time spent stopped for an obstacle does not count.
+void driveForward(unsigned long totalDuration, int cruiseSpeed, unsigned long rampTime) {
+  unsigned long startTime = millis();
+  unsigned long lastTick = startTime;
+  unsigned long rampStart = startTime;
+  float progress = 0;
+  int speed = 0;
+  bool blocked = false;
+  
+  // Distance covered while ramping between MIN_SPEED and cruiseSpeed
+  float rampDistance = (float)(MIN_SPEED + cruiseSpeed) / 2 * rampTime / MOTOR_SPEED;
+  
+  resetRanging();
+  
+  while (progress < totalDuration && millis() - startTime < MAX_DURATION) {
+    unsigned long now = millis();
+    if (now - lastTick < DRIVE_LOOP_INTERVAL) {
+      continue;
+    }
+    if (!blocked) {
+      progress += (float)(now - lastTick) * speed / MOTOR_SPEED;
+    }
+    lastTick = now;
+    
+    updateRanging(now);
+    bool obstacle = obstacleAhead();
+    if (obstacle) {
+      if (!blocked) {
+        stopMotors();
+        speed = 0;
+        if (verboseLogging) {
+          Serial.println("Movement stopped due to obstacle");
+        }
       }
+      reportObstacle(now);
     } else {
-      moveForward(MOTOR_SPEED);
+      if (blocked || speed == 0) {
+        // Start (again) from the bottom of the ramp
+        rampStart = now;
+      }
+      speed = profileSpeed(now - rampStart, totalDuration - progress, cruiseSpeed, rampTime, rampDistance);
+      moveForward(speed);
     }
+    blocked = obstacle;
   }
   
   stopMotors();
-  isMoving = false;
-  
-  // Send completion signal
+}
+
+// Speed for the current point of a trapezoidal profile: ramp up over
+// rampTime, cruise, and ramp down over the last rampDistance
+int profileSpeed(unsigned long sinceStart, float remaining, int cruiseSpeed, unsigned long rampTime, float rampDistance) {
+  if (rampTime == 0) {
+    return cruiseSpeed;
+  }
+  float speed = cruiseSpeed;
+  if (sinceStart < rampTime) {
+    speed = MIN_SPEED + (float)(cruiseSpeed - MIN_SPEED) * sinceStart / rampTime;
+  }
+  if (remaining < rampDistance) {
+    speed = min(speed, MIN_SPEED + (cruiseSpeed - MIN_SPEED) * remaining / rampDistance);
+  }
+  return (int)speed;
+}
+
+// Tell the Raspberry Pi the current command has finished
+void sendDirectionDone() {
+  movesDone++;
   Serial.println("DIRECTION_DONE");
   Serial.flush();
-  delay(100);
 }
 
-// Function to measure distance using ultrasonic sensor
+// Function to measure distance using ultrasonic sensor.
+// The echo wait is bounded so a missed echo costs milliseconds, not a second.
 float measureDistance() {
   digitalWrite(TRIG_PIN, LOW);
   delayMicroseconds(2);
@@ -294,20 +581,71 @@ float measureDistance() {
   delayMicroseconds(10);
   digitalWrite(TRIG_PIN, LOW);
   
-  long duration = pulseIn(ECHO_PIN, HIGH);
+  long duration = pulseIn(ECHO_PIN, HIGH, ECHO_TIMEOUT_US);
+  if (duration == 0) {
+    return NO_ECHO_DISTANCE;
+  }
   float distance = duration * 0.034 / 2;
   
   return distance;
 }
 
+// Forget old samples and take a fresh one before driving off
+void resetRanging() {
+  sampleCount = 0;
+  sampleIndex = 0;
+  lastPingTime = millis();
+  addDistanceSample(measureDistance());
+}
+
+void addDistanceSample(float distance) {
+  distanceSamples[sampleIndex] = distance;
+  sampleIndex = (sampleIndex + 1) % MEDIAN_WINDOW;
+  if (sampleCount < MEDIAN_WINDOW) {
+    sampleCount++;
+  }
+}
+
+// Ping when the ranging interval is due, otherwise return immediately
+void updateRanging(unsigned long now) {
+  if (now - lastPingTime >= RANGING_INTERVAL) {
+    lastPingTime = now;
+    addDistanceSample(measureDistance());
+  }
+}
+
+// Median of the recent samples, so single spurious echoes are ignored
+float filteredDistance() {
+  float sorted[MEDIAN_WINDOW];
+  for (int i = 0; i < sampleCount; i++) {
+    sorted[i] = distanceSamples[i];
+  }
+  // Insertion sort, the window is tiny
+  for (int i = 1; i < sampleCount; i++) {
+    float value = sorted[i];
+    int j = i - 1;
+    while (j >= 0 && sorted[j] > value) {
+      sorted[j + 1] = sorted[j];
+      j--;
+    }
+    sorted[j + 1] = value;
+  }
+  return sorted[sampleCount / 2];
+}
+
 // Function to check for obstacles
-bool checkObstacle() {
-  float distance = measureDistance();
-  if (distance < DISTANCE_THRESHOLD) {
-    Serial.println("Obstacle detected!");
-    return true;
+bool obstacleAhead() {
+  return sampleCount > 0 && filteredDistance() < DISTANCE_THRESHOLD;
+}
+
+// Report obstacles at most once per OBSTACLE_REPORT_INTERVAL
+void reportObstacle(unsigned long now) {
+  if (verboseLogging && now - lastObstacleReport >= OBSTACLE_REPORT_INTERVAL) {
+    lastObstacleReport = now;
+    Serial.print("Obstacle detected! Distance: ");
+    Serial.print(filteredDistance());
+    Serial.println(" cm");
   }
-  return false;
 }
 
 void testMotors() {
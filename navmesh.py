@@ -0,0 +1,230 @@
+import heapq
+import numpy as np
+
+# Region graph compiled from the binary layout (0 = free, 1 = wall).
+# Free space is split into axis-aligned rectangles, and neighbouring
+# rectangles are connected through portals. A layout that is a few aisles
+# wide becomes a graph of tens of regions instead of every pixel.
+
+
+def decompose_free_space(grid):
+    rows, cols = grid.shape
+    open_cells = grid == 0
+    region_map = np.full((rows, cols), -1, dtype=np.int32)
+    regions = []
+
+    for r in range(rows):
+        c = 0
+        while c < cols:
+            # Find the next free cell in this row that has no region yet
+            free = np.flatnonzero(open_cells[r, c:])
+            if free.size == 0:
+                break
+            c0 = c + free[0]
+
+            # Grow the rectangle to the right as far as the row allows
+            blocked = np.flatnonzero(~open_cells[r, c0:])
+            c1 = c0 + blocked[0] if blocked.size else cols
+
+            # Then grow it downwards while the whole span stays free
+            r1 = r + 1
+            while r1 < rows and open_cells[r1, c0:c1].all():
+                r1 += 1
+
+            region_map[r:r1, c0:c1] = len(regions)
+            open_cells[r:r1, c0:c1] = False
+            regions.append((r, c0, r1, c1))  # top, left, bottom, right (exclusive)
+            c = c1
+
+    return region_map, regions
+
+
+def find_portals(region_map):
+    boundaries = {}
+
+    # Cells that touch a different region to the right or below
+    for axis in (0, 1):
+        if axis == 0:
+            here, there = region_map[:-1, :], region_map[1:, :]
+        else:
+            here, there = region_map[:, :-1], region_map[:, 1:]
+        mask = (here >= 0) & (there >= 0) & (here != there)
+        for r, c in zip(*np.nonzero(mask)):
+            a = (int(r), int(c))
+            b = (a[0] + 1, a[1]) if axis == 0 else (a[0], a[1] + 1)
+            key = (int(here[r, c]), int(there[r, c]))
+            boundaries.setdefault(key, []).append((a, b))
+
+    # Two rectangles share one contiguous edge, kept as its first and last
+    # crossing so the planner can pick where to cross it
+    portals = {}
+    for (region_a, region_b), cells in boundaries.items():
+        (a_first, b_first), (a_last, b_last) = cells[0], cells[-1]
+        portals.setdefault(region_a, []).append((region_b, a_first, a_last, b_first))
+        portals.setdefault(region_b, []).append((region_a, b_first, b_last, a_first))
+    return portals
+
+
+def cross_portal(point, first, last, entry_first):
+    # Cross at the cell of the edge closest to where we are now, so that
+    # straight aisles stay straight instead of detouring to the middle
+    r = min(max(point[0], first[0]), last[0])
+    c = min(max(point[1], first[1]), last[1])
+    exit_cell = (r, c)
+    entry_cell = (r + entry_first[0] - first[0], c + entry_first[1] - first[1])
+    return exit_cell, entry_cell
+
+
+def manhattan(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+def waypoints_to_path(waypoints):
+    if not waypoints:
+        return []
+
+    path = [waypoints[0]]
+    rows_first = True
+    for target in waypoints[1:]:
+        current = path[-1]
+        if target == current:
+            continue
+
+        # Consecutive waypoints always share a rectangle, so an L-shaped
+        # move stays inside free space. Keep driving along the axis we were
+        # already on to avoid an extra turn.
+        if current[0] == target[0]:
+            rows_first = False
+        elif current[1] == target[1]:
+            rows_first = True
+
+        r, c = current
+        legs = [(0, target[0]), (1, target[1])]
+        if not rows_first:
+            legs.reverse()
+        for axis, end in legs:
+            step = 1 if end > (r, c)[axis] else -1
+            while (r, c)[axis] != end:
+                if axis == 0:
+                    r += step
+                else:
+                    c += step
+                path.append((r, c))
+
+        # The last leg decides which axis we continue on
+        rows_first = legs[-1][0] == 0
+    return path
+
+
+class RegionGraph:
+    def __init__(self, grid):
+        self.shape = grid.shape
+        self.free = grid == 0
+        self.region_map, self.regions = decompose_free_space(grid)
+        self.portals = find_portals(self.region_map)
+        self.nodes_expanded = 0
+        self.explored = {}
+
+    def region_of(self, cell):
+        r, c = cell
+        if not (0 <= r < self.shape[0] and 0 <= c < self.shape[1]):
+            return -1
+        return int(self.region_map[r, c])
+
+    def plan(self, start, goal):
+        # A* over (point, region) states, where points are the start, the
+        # goal and the cells on the far side of every portal
+        self.nodes_expanded = 0
+        self.explored = {}
+        start_region = self.region_of(start)
+        goal_region = self.region_of(goal)
+        if start_region < 0 or goal_region < 0:
+            return []
+
+        start_state = (start, start_region)
+        goal_state = (goal, goal_region)
+        open_set = [(manhattan(start, goal), 0, start_state)]
+        came_from = {}
+        g_score = {start_state: 0}
+        self.explored = g_score
+        counter = 1
+
+        while open_set:
+            _, _, state = heapq.heappop(open_set)
+            if state == goal_state:
+                # Walk back, adding the exit cell in front of each portal
+                waypoints = [goal]
+                while state in came_from:
+                    state, exit_cell = came_from[state]
+                    if exit_cell is not None:
+                        waypoints.append(exit_cell)
+                    waypoints.append(state[0])
+                waypoints.reverse()
+                return waypoints
+
+            self.nodes_expanded += 1
+            point, region = state
+            moves = []
+            if region == goal_region:
+                moves.append((goal_state, None, manhattan(point, goal)))
+            for neighbor_region, first, last, entry_first in self.portals.get(region, []):
+                exit_cell, entry_cell = cross_portal(point, first, last, entry_first)
+                moves.append(((entry_cell, neighbor_region), exit_cell, manhattan(point, exit_cell) + 1))
+
+            for neighbor, exit_cell, cost in moves:
+                tentative_g_score = g_score[state] + cost
+                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                    came_from[neighbor] = (state, exit_cell)
+                    g_score[neighbor] = tentative_g_score
+                    f_score = tentative_g_score + manhattan(neighbor[0], goal)
+                    heapq.heappush(open_set, (f_score, counter, neighbor))
+                    counter += 1
+        return []
+
+    def explored_bounds(self, margin=1):
+        # Bounding box of every region the last search reached
+        regions = {region for _, region in self.explored}
+        if not regions:
+            return None
+        rects = np.array([self.regions[region] for region in regions])
+        return (max(int(rects[:, 0].min()) - margin, 0), max(int(rects[:, 1].min()) - margin, 0),
+                int(rects[:, 2].max()) - 1 + margin, int(rects[:, 3].max()) - 1 + margin)
+
+    def segment_free(self, a, b):
+        if a[0] == b[0]:
+            return bool(self.free[a[0], min(a[1], b[1]):max(a[1], b[1]) + 1].all())
+        return bool(self.free[min(a[0], b[0]):max(a[0], b[0]) + 1, a[1]].all())
+
+    def straighten(self, waypoints):
+        # Replace runs of waypoints by a single straight line or L-shape
+        # whenever that stays in free space. Portal crossings on successive
+        # aisles otherwise leave 1-cell jogs that each cost the robot two
+        # pivots. Every output pair shares a row or a column.
+        if len(waypoints) < 2:
+            return waypoints
+
+        result = [waypoints[0]]
+        rows_first = True
+        i = 0
+        while i < len(waypoints) - 1:
+            current = result[-1]
+            for j in range(len(waypoints) - 1, i, -1):
+                target = waypoints[j]
+                corners = [(target[0], current[1]), (current[0], target[1])]
+                if not rows_first:
+                    corners.reverse()
+                corner = next((c for c in corners
+                               if self.segment_free(current, c) and self.segment_free(c, target)), None)
+                if corner is not None:
+                    break
+
+            for point in (corner, target):
+                if point != result[-1]:
+                    rows_first = point[1] == result[-1][1]
+                    result.append(point)
+            i = j
+        return result
+
+    def find_path(self, start, goal):
+        # Same (row, col) format as a_star_search, ready for get_directions
+        return waypoints_to_path(self.straighten(self.plan(start, goal)))
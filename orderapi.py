@@ -0,0 +1,248 @@
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import json
+import struct
+import threading
+
+# Order intake for waiter tablets.
+# A small asyncio HTTP server on its own thread, so bursts of requests never
+# touch the Tk loop:
+#   POST /orders   {"tables": ["table2", "table4"]} -> 202 with the queue position
+#   GET  /status   latest robot status as JSON
+#   GET  /ws       WebSocket that pushes every status update
+# Orders are handed to submit(tables), which must be thread-safe and return a
+# concurrent.futures.Future; the app resolves it on the Tk thread. Status is
+# pushed from the app with publish(status). Slow WebSocket clients only ever
+# get the latest status, so they can't hold anyone else up.
+# Without a token the server refuses to listen anywhere but loopback.
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+MAX_BODY_BYTES = 64 * 1024
+SUBMIT_TIMEOUT = 5.0
+
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized",
+               404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class OrderRejected(Exception):
+    # Raised by submit() for orders that can't be accepted; becomes a 400
+    pass
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def websocket_accept(key):
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def websocket_frame(payload, opcode=0x1):
+    # Unmasked server frame, FIN set
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+async def read_websocket_frame(reader):
+    # Returns (opcode, payload) of the next client frame
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("WebSocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class OrderServer:
+    def __init__(self, submit, host="127.0.0.1", port=8765, token=None):
+        self.submit = submit
+        self.host = host
+        self.port = port
+        self.token = token
+        self.status = {}
+        self.loop = None
+        self.server = None
+        self.clients = set()
+        self.thread = None
+
+    # --- Called from the app (any thread) ---
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), daemon=True, name="order-api")
+        self.thread.start()
+        ready.wait()
+
+    def publish(self, status):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._set_status, status)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    # --- Server thread ---
+
+    def _run(self, ready):
+        if self.token is None and not is_loopback(self.host):
+            print(f"Error starting order API: refusing to listen on {self.host} without a token")
+            ready.set()
+            return
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+            print(f"Order API listening on http://{self.host}:{self.port}/")
+        except OSError as e:
+            print(f"Error starting order API: {e}")
+            self.loop = None
+            ready.set()
+            return
+        ready.set()
+        self.loop.run_forever()
+        self.server.close()
+
+    def _set_status(self, status):
+        self.status = status
+        for wakeup in self.clients:
+            wakeup.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode(errors='replace').split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1].split('?')[0]
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode(errors='replace').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if self.token is not None and not self._authorized(headers, request_line[1]):
+                await self._respond(writer, 401, {'error': 'missing or wrong token'})
+            elif path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self._websocket(reader, writer, headers)
+            elif path == '/status':
+                await self._respond(writer, 200, self.status)
+            elif path == '/orders':
+                if method != 'POST':
+                    await self._respond(writer, 405, {'error': 'use POST'})
+                else:
+                    await self._order(reader, writer, headers)
+            else:
+                await self._respond(writer, 404, {'error': 'not found'})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _authorized(self, headers, target):
+        # Token in an Authorization: Bearer header, or ?token= for WebSocket clients
+        if headers.get('authorization') == f"Bearer {self.token}":
+            return True
+        _, _, query = target.partition('?')
+        return f"token={self.token}" in query.split('&')
+
+    async def _order(self, reader, writer, headers):
+        length = headers.get('content-length', '0')
+        length = int(length) if length.isdigit() else 0
+        if length > MAX_BODY_BYTES:
+            await self._respond(writer, 413, {'error': 'order too large'})
+            return
+        try:
+            order = json.loads(await reader.readexactly(length) or b'{}')
+            tables = order['tables']
+        except (ValueError, KeyError, TypeError):
+            await self._respond(writer, 400, {'error': 'expected {"tables": [...]}'})
+            return
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(self.submit(tables)), SUBMIT_TIMEOUT)
+        except OrderRejected as e:
+            await self._respond(writer, 400, {'error': str(e)})
+        except asyncio.TimeoutError:
+            await self._respond(writer, 503, {'error': 'kiosk did not accept the order in time'})
+        except Exception as e:
+            await self._respond(writer, 500, {'error': f'kiosk failed to take the order: {e}'})
+        else:
+            await self._respond(writer, 202, result)
+
+    async def _respond(self, writer, code, body):
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {code} {STATUS_TEXT[code]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Access-Control-Allow-Origin: *\r\n"
+            f"Connection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            await self._respond(writer, 400, {'error': 'missing Sec-WebSocket-Key'})
+            return
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n".encode())
+        await writer.drain()
+
+        wakeup = asyncio.Event()
+        wakeup.set()  # Send the current status straight away
+        self.clients.add(wakeup)
+        receiver = asyncio.ensure_future(self._websocket_receive(reader, writer))
+        try:
+            while not receiver.done():
+                waiter = asyncio.ensure_future(wakeup.wait())
+                await asyncio.wait((waiter, receiver), return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if wakeup.is_set():
+                    wakeup.clear()
+                    writer.write(websocket_frame(json.dumps(self.status).encode()))
+                    await writer.drain()
+        finally:
+            self.clients.discard(wakeup)
+            if receiver.done() and not receiver.cancelled():
+                receiver.exception()  # A dropped connection, nothing to report
+            receiver.cancel()
+
+    async def _websocket_receive(self, reader, writer):
+        # Clients only talk to close the socket or ping it
+        while True:
+            opcode, payload = await read_websocket_frame(reader)
+            if opcode == 0x8:
+                writer.write(websocket_frame(payload[:2], 0x8))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(websocket_frame(payload, 0xA))
+                await writer.drain()
@@ -0,0 +1,235 @@
+import heapq
+import time
+import cv2
+import numpy as np
+from navmesh import RegionGraph
+from landmarks import LandmarkTable
+from anyangle import AnyAnglePlanner
+from motion import clearance_map
+from reachability import ReachabilityIndex
+from routecache import cells_bounds
+from metricmap import load_metric_map
+
+# Route planning on a layout, without the Tk window.
+# The controller process plans every leg with a Planner. The kiosk builds
+# one with compile_checks only, for what it needs on its own side: the
+# clearance map for speed profiles and the reachability index to refuse
+# impossible legs up front. The offline tools (benchmark.py, simulator.py)
+# use it the way the controller does.
+
+# Direction names for the unit step codes used by get_directions
+STEP_DIRECTIONS = {1: 'up', 3: 'left', 5: 'right', 7: 'down'}
+
+
+def image_to_binary_array(image_path, threshold=128):
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Image not found or could not be loaded.")
+    _, binary_image = cv2.threshold(image, threshold, 1, cv2.THRESH_BINARY_INV)
+    return binary_image
+
+
+def get_directions(path):
+    # Run-length encode the unit steps of a route, e.g. ['148down', '12left']
+    path = np.asarray(path, dtype=np.int16).reshape(-1, 2)
+    if len(path) < 2:
+        return []
+
+    # Step (dy, dx) -> code (dy + 1) * 3 + (dx + 1), then group equal codes
+    steps = np.diff(path, axis=0)
+    codes = (steps[:, 0] + 1) * 3 + (steps[:, 1] + 1)
+    run_starts = np.flatnonzero(np.diff(codes)) + 1
+    run_starts = np.concatenate(([0], run_starts))
+    run_lengths = np.diff(np.concatenate((run_starts, [len(codes)])))
+
+    directions = []
+    for code, count in zip(codes[run_starts].tolist(), run_lengths.tolist()):
+        direction = STEP_DIRECTIONS.get(code)
+        if direction is None:
+            raise ValueError("Route contains a step that is not 4-connected.")
+        directions.append(f"{count}{direction}")
+    return directions
+
+
+class Planner:
+    def __init__(self, planner_mode='navmesh', use_landmarks=False):
+        # 'navmesh' plans on the region graph, 'grid' runs A* on pixels,
+        # 'bidirectional' runs a two-ended search on pixels, 'octile' allows
+        # diagonal steps and 'anyangle' pulls that path into straight lines
+        # of any angle. use_landmarks adds the ALT heuristic to grid searches.
+        self.planner_mode = planner_mode
+        self.use_landmarks = use_landmarks
+        self.region_graph = None
+        self.any_angle = None
+        self.landmarks = None
+        self.clearance = None
+        self.reachability = None
+        self.metric_map = None
+        self.nodes_expanded = 0
+        self.search_bounds = None
+        self.explored = []
+
+    def compile_checks(self, grid, metric_map=None):
+        # Clearance and reachability only, which is all the kiosk needs
+        self.metric_map = metric_map
+        self.clearance = clearance_map(grid)
+        self.reachability = ReachabilityIndex(grid, metric_map)
+
+    def compile_layout(self, grid, image_path, calibrated=True):
+        # With a calibration next to the layout every planner works on the
+        # metric map's robot-sized cells; calibrated=False keeps them on pixels
+        self.compile_checks(grid, load_metric_map(image_path, grid) if calibrated else None)
+        cells = grid
+        if self.metric_map is not None:
+            cells = self.metric_map.cells
+            print(f"Planning on {cells.shape[0]}x{cells.shape[1]} cells of "
+                  f"{self.metric_map.factor} px ({self.metric_map.robot_diameter_m:.2f} m)")
+        start_time = time.perf_counter()
+        self.region_graph = RegionGraph(cells)
+        elapsed = (time.perf_counter() - start_time) * 1000
+        print(f"Compiled layout into {len(self.region_graph.regions)} regions in {elapsed:.1f} ms")
+        self.any_angle = AnyAnglePlanner(cells)
+
+        if self.use_landmarks:
+            start_time = time.perf_counter()
+            home = (0, grid.shape[1] // 2)
+            if self.metric_map is not None:
+                home = self.metric_map.to_cell(home)
+            self.landmarks = LandmarkTable.load_or_build(image_path, cells, seed=home)
+            elapsed = (time.perf_counter() - start_time) * 1000
+            print(f"Loaded {len(self.landmarks.landmarks)} landmarks in {elapsed:.1f} ms")
+        else:
+            self.landmarks = None
+
+    def plan_path(self, grid, start, goal):
+        # Legs between separate areas raise UnreachableError without searching.
+        # On calibrated layouts the search runs on the metric map's cells and
+        # the route comes back as the pixel centres of those cells.
+        if self.reachability is not None:
+            self.reachability.check(start, goal)
+        if self.metric_map is None:
+            return self.search_path(grid, start, goal)
+        metric_map = self.metric_map
+        path = self.search_path(metric_map.cells, metric_map.to_cell(start), metric_map.to_cell(goal))
+        self.search_bounds = metric_map.bounds_to_pixels(self.search_bounds)
+        return metric_map.to_pixels(path)
+
+    def search_path(self, grid, start, goal):
+        # Plan on the region graph when available, fall back to grid search
+        if self.planner_mode in ('octile', 'anyangle') and self.any_angle is not None:
+            path = self.any_angle.find_path(start, goal, smooth=self.planner_mode == 'anyangle')
+            self.nodes_expanded = self.any_angle.nodes_expanded
+            self.search_bounds = cells_bounds([self.any_angle.explored])
+            return path
+        if self.planner_mode == 'navmesh' and self.region_graph is not None:
+            path = self.region_graph.find_path(start, goal)
+            self.nodes_expanded = self.region_graph.nodes_expanded
+            self.search_bounds = self.region_graph.explored_bounds()
+            if path:
+                return path
+            print("Region graph found no path, falling back to grid search")
+        if self.planner_mode == 'bidirectional':
+            path = self.bidirectional_search(grid, start, goal)
+        elif self.landmarks is not None:
+            path = self.a_star_search(grid, start, goal, self.landmarks.heuristic_to(goal))
+        else:
+            path = self.a_star_search(grid, start, goal)
+        self.search_bounds = cells_bounds(self.explored)
+        return path
+
+    def heuristic(self, a, b):
+        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+    def a_star_search(self, grid, start, goal, heuristic=None):
+        if heuristic is None:
+            heuristic = lambda node: self.heuristic(node, goal)
+        rows, cols = grid.shape
+        open_set = []
+        heapq.heappush(open_set, (0, start))
+        came_from = {}
+        g_score = {start: 0}
+        f_score = {start: heuristic(start)}
+        self.nodes_expanded = 0
+        self.explored = [g_score]
+
+        while open_set:
+            _, current = heapq.heappop(open_set)
+            self.nodes_expanded += 1
+            if current == goal:
+                path = []
+                while current in came_from:
+                    path.append(current)
+                    current = came_from[current]
+                path.append(start)
+                path.reverse()
+                return path
+
+            neighbors = [(0,1), (1,0), (0,-1), (-1,0)]
+            for dx, dy in neighbors:
+                neighbor = (current[0] + dx, current[1] + dy)
+                if 0 <= neighbor[0] < rows and 0 <= neighbor[1] < cols and grid[neighbor] == 0:
+                    tentative_g_score = g_score[current] + 1
+                    if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                        came_from[neighbor] = current
+                        g_score[neighbor] = tentative_g_score
+                        f_score[neighbor] = tentative_g_score + heuristic(neighbor)
+                        heapq.heappush(open_set, (f_score[neighbor], neighbor))
+        return []
+
+    def bidirectional_search(self, grid, start, goal):
+        # Every step costs 1, so search breadth-first from both ends. Always
+        # grow the smaller frontier by one full layer; the first layer that
+        # touches the other side holds a shortest meeting point.
+        rows, cols = grid.shape
+        self.nodes_expanded = 0
+        self.explored = [[start]]
+        if start == goal:
+            return [start]
+
+        came_from = ({start: None}, {goal: None})
+        self.explored = list(came_from)
+        distance = ({start: 0}, {goal: 0})
+        frontiers = [[start], [goal]]
+        neighbors = [(0,1), (1,0), (0,-1), (-1,0)]
+
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            own_parents, other_parents = came_from[side], came_from[1 - side]
+            own_distance, other_distance = distance[side], distance[1 - side]
+            next_frontier = []
+            meeting = None
+            best_length = None
+
+            for current in frontiers[side]:
+                self.nodes_expanded += 1
+                step_distance = own_distance[current] + 1
+                for dx, dy in neighbors:
+                    neighbor = (current[0] + dx, current[1] + dy)
+                    if 0 <= neighbor[0] < rows and 0 <= neighbor[1] < cols and grid[neighbor] == 0:
+                        if neighbor in own_parents:
+                            continue
+                        own_parents[neighbor] = current
+                        own_distance[neighbor] = step_distance
+                        next_frontier.append(neighbor)
+                        if neighbor in other_parents:
+                            length = step_distance + other_distance[neighbor]
+                            if best_length is None or length < best_length:
+                                meeting = neighbor
+                                best_length = length
+
+            if meeting is not None:
+                # Join the two half paths at the meeting cell
+                forward = []
+                node = meeting
+                while node is not None:
+                    forward.append(node)
+                    node = came_from[0][node]
+                forward.reverse()
+                node = came_from[1][meeting]
+                while node is not None:
+                    forward.append(node)
+                    node = came_from[1][node]
+                return forward
+
+            frontiers[side] = next_frontier
+        return []
@@ -0,0 +1,114 @@
+import tkinter as tk
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+from PIL import Image, ImageTk
+
+# Reusable Tk and matplotlib objects for the kiosk.
+# A shift runs thousands of delivery cycles. Building a new figure, a new
+# Toplevel for every prompt and new PhotoImages for every welcome screen
+# makes the process grow and redraws slow down: pyplot keeps figures until
+# they are closed, and every destroyed widget leaves Tcl state behind.
+# Instead the kiosk keeps:
+#   FigurePool   one Figure, Axes and canvas widget, hidden between trips
+#   DialogPool   Toplevels that are withdrawn after use and shown again for
+#                the next prompt of the same kind
+#   ImageCache   PhotoImages loaded and resized once per (path, size)
+# Screens that clear the root window skip anything these own (see owns()).
+
+
+class FigurePool:
+    def __init__(self, figsize=(10, 8)):
+        self.figsize = figsize
+        self.figure = None
+        self.ax = None
+        self.canvas = None
+        self.created = 0
+
+    def acquire(self, master, facecolor):
+        # Returns (figure, ax, canvas) with the axes cleared and the canvas
+        # packed into master. Built without pyplot, so no global registry
+        # holds on to it.
+        if self.figure is None:
+            self.figure = Figure(figsize=self.figsize)
+            self.ax = self.figure.add_subplot()
+            self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+            self.created += 1
+        self.figure.patch.set_facecolor(facecolor)
+        self.ax.clear()
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        return self.figure, self.ax, self.canvas
+
+    def release(self):
+        if self.canvas is not None:
+            self.canvas.get_tk_widget().pack_forget()
+
+    def owns(self, widget):
+        return self.canvas is not None and widget is self.canvas.get_tk_widget()
+
+
+class DialogPool:
+    # build(window) fills a new Toplevel and returns an object holding the
+    # widgets the caller updates for each use (a SimpleNamespace is fine).
+    # The pool adds .window and .kind to it.
+    def __init__(self, root):
+        self.root = root
+        self.dialogs = []
+        self.idle = {}
+
+    def acquire(self, kind, build):
+        idle = self.idle.setdefault(kind, [])
+        if idle:
+            dialog = idle.pop()
+            dialog.window.deiconify()
+        else:
+            window = tk.Toplevel(self.root)
+            dialog = build(window)
+            dialog.window = window
+            dialog.kind = kind
+            window.protocol("WM_DELETE_WINDOW", lambda: self.release(dialog))
+            self.dialogs.append(dialog)
+        # Modal while it is up
+        dialog.window.transient(self.root)
+        dialog.window.grab_set()
+        return dialog
+
+    def release(self, dialog):
+        # Safe to call twice, e.g. from a button and from pickup_done
+        if dialog in self.idle[dialog.kind] or not dialog.window.winfo_exists():
+            return
+        dialog.window.grab_release()
+        dialog.window.withdraw()
+        self.idle[dialog.kind].append(dialog)
+
+    def is_showing(self, dialog):
+        return dialog is not None and dialog not in self.idle.get(dialog.kind, ())
+
+    def owns(self, widget):
+        return any(widget is dialog.window for dialog in self.dialogs)
+
+    @property
+    def created(self):
+        return len(self.dialogs)
+
+
+class ImageCache:
+    def __init__(self, master):
+        self.master = master
+        self.images = {}
+
+    def get(self, path, size=None, scale=None):
+        # PhotoImage of path resized to size, or scaled by scale
+        key = (path, size, scale)
+        image = self.images.get(key)
+        if image is None:
+            picture = Image.open(path)
+            if scale is not None:
+                size = (int(picture.width * scale), int(picture.height * scale))
+            if size is not None:
+                picture = picture.resize(size, Image.Resampling.LANCZOS)
+            image = self.images[key] = ImageTk.PhotoImage(picture, master=self.master)
+        return image
+
+    @property
+    def created(self):
+        return len(self.images)
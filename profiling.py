@@ -0,0 +1,126 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# On-demand profiler for the running kiosk.
+# A sampler thread snapshots the stacks of every thread in its process at a
+# fixed rate, and cProfile records exact call counts for the Tk thread it was
+# started from. The serial listener and the planner live in the controller
+# process (see controller.py), which runs a sampler of its own; its samples
+# are merged in with the process name in front of each thread. Stopping
+# writes a pstats file plus a collapsed-stack file (one
+# "thread;outer;...;inner count" line per stack, usable with flamegraph
+# tools) and returns a short hot list.
+
+DEFAULT_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, output_dir="profiles", interval=DEFAULT_INTERVAL):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.running = False
+        self.stacks = Counter()
+        self.sample_count = 0
+        # Sample counts of merged processes, by process name
+        self.merged_counts = {}
+        self.started = None
+        self.elapsed = 0.0
+        self.stop_event = threading.Event()
+        self.sampler = None
+        self.main_profile = None
+
+    def start(self, trace=True):
+        # With trace, must be called from the thread that cProfile should trace
+        if self.running:
+            return
+        self.running = True
+        self.stacks = Counter()
+        self.sample_count = 0
+        self.merged_counts = {}
+        self.started = time.time()
+        self.stop_event.clear()
+
+        self.main_profile = None
+        if trace:
+            self.main_profile = cProfile.Profile()
+            self.main_profile.enable()
+        self.sampler = threading.Thread(target=self._sample_loop, daemon=True, name="profiler")
+        self.sampler.start()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[(names.get(thread_id, str(thread_id)), tuple(stack))] += 1
+            self.sample_count += 1
+
+    def halt(self):
+        # Stop sampling but keep the samples, for merge() and stop()
+        if not self.running:
+            return
+        self.running = False
+        if self.main_profile is not None:
+            self.main_profile.disable()
+        self.stop_event.set()
+        self.sampler.join()
+        self.elapsed = time.time() - self.started
+
+    def merge(self, stacks, process, sample_count):
+        # Add samples taken by another process's profiler
+        self.merged_counts[process] = sample_count
+        for (thread_name, stack), count in stacks.items():
+            self.stacks[(f"{process}/{thread_name}", tuple(stack))] += count
+
+    def stop(self, top=10):
+        # Returns (summary lines, list of files written)
+        if self.started is None:
+            return [], []
+        self.halt()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        stats_path = os.path.join(self.output_dir, f"profile-{stamp}.prof")
+        stacks_path = os.path.join(self.output_dir, f"profile-{stamp}.collapsed")
+        files = [stacks_path]
+        if self.main_profile is not None:
+            self.main_profile.dump_stats(stats_path)
+            files.insert(0, stats_path)
+        with open(stacks_path, "w") as f:
+            for (thread_name, stack), count in self.stacks.most_common():
+                f.write(";".join((thread_name,) + stack) + f" {count}\n")
+
+        summary = self.summary(top)
+        self.started = None
+        return summary, files
+
+    def summary(self, top=10):
+        # Hottest functions by samples spent directly in them, per thread
+        self_samples = Counter()
+        for (thread_name, stack), count in self.stacks.items():
+            if stack:
+                self_samples[(thread_name, stack[-1])] += count
+
+        lines = [f"{self.sample_count} samples over {self.elapsed:.1f} s"]
+        for (thread_name, function), count in self_samples.most_common(top):
+            # Shares are of the samples the thread's own process took
+            process = thread_name.split("/")[0] if "/" in thread_name else None
+            total = max(self.merged_counts.get(process, self.sample_count), 1)
+            lines.append(f"{100.0 * count / total:5.1f}%  [{thread_name}] {function}")
+        return lines
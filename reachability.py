@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+# Reachability index for a layout.
+# Connected-component labels of the free space, computed once per layout.
+# Two cells are connected exactly when they carry the same label, so a leg
+# between components is refused with one lookup per end instead of a search
+# that floods the whole reachable area before giving up. Components are
+# 4-connected, which matches every planner: the octile search never cuts
+# corners, so a diagonal step always has a 4-connected detour. With a
+# metric map (see metricmap.py) the components are those of its robot-sized
+# cells, and pixels are looked up through the cell the planner would use.
+
+
+class UnreachableError(ValueError):
+    pass
+
+
+class ReachabilityIndex:
+    def __init__(self, grid, metric_map=None):
+        self.shape = grid.shape
+        self.metric_map = metric_map
+        self.free = grid == 0
+        cells = grid if metric_map is None else metric_map.cells
+        free = (cells == 0).astype(np.uint8)
+        count, self.labels = cv2.connectedComponents(free, connectivity=4)
+        # Label 0 is the walls
+        self.component_count = count - 1
+
+    def component(self, cell):
+        # Component label of a cell; 0 for walls and cells off the layout
+        rows, cols = self.shape
+        r, c = cell
+        if not (0 <= r < rows and 0 <= c < cols):
+            return 0
+        if self.metric_map is not None:
+            cell = self.metric_map.to_cell(cell)
+            if cell is None:
+                return 0
+            r, c = cell
+        return int(self.labels[r, c])
+
+    def problem(self, start, goal):
+        # Why no route can exist between two cells, or None if one might
+        for name, cell in (('start', start), ('goal', goal)):
+            rows, cols = self.shape
+            if not (0 <= cell[0] < rows and 0 <= cell[1] < cols):
+                return f"{name} {cell} is outside the {rows}x{cols} layout"
+            if self.component(cell) == 0:
+                if self.free[tuple(cell)] and self.metric_map is not None:
+                    return f"{name} {cell} is too close to a wall for the robot"
+                return f"{name} {cell} is inside a wall"
+        if self.component(start) != self.component(goal):
+            return f"{start} and {goal} are in separate areas of the layout"
+        return None
+
+    def reachable(self, start, goal):
+        return self.problem(start, goal) is None
+
+    def check(self, start, goal):
+        # Raise UnreachableError when no route can exist
+        problem = self.problem(start, goal)
+        if problem is not None:
+            raise UnreachableError(f"No route: {problem}")
+
+    def station_problems(self, stations, home):
+        # {station name: reason} for every station the robot can't reach from home
+        return {name: problem for name, cell in stations.items()
+                if (problem := self.problem(home, tuple(cell))) is not None}
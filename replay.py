@@ -0,0 +1,351 @@
+import argparse
+import heapq
+import json
+import os
+import pty
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Session recording and replay for offline performance regression runs.
+#
+# With SESSION_LOG set in main.py the kiosk writes one line per event,
+# tab separated:
+#   <ms since start>  tx  <line sent to the Arduino>
+#   <ms since start>  rx  <line from the Arduino>
+#   <ms since start>  ui  <event> <JSON args> <delivery state> <leg index>
+# UI events are the kiosk's own inputs: a trip started from the table
+# selection, an order from a tablet, and the pickup prompt's two buttons.
+#
+# Replay runs the real MesamateApp, controller process included, against a
+# fake Arduino on a pseudo-terminal. The fake answers the link handshake and
+# session commands itself and every other command with the lines that
+# followed it in the recording.
+# UI events fire once the delivery state machine is where it was when they
+# were recorded. With --fast, replies and events go out as soon as they can;
+# otherwise they keep their recorded timing. Pickup timeouts always run at
+# their real length. Dialogs are answered automatically.
+#
+#   python replay.py session.log [--fast] [--save report.json] [--compare baseline.json]
+#
+# Reports the latency from a DIRECTION_DONE leaving the fake port to the UI
+# handling it, the time spent handling it and every UI event, and how late the
+# Tk loop ran. Save a report on one version and compare another against it.
+
+MOTION_COMMANDS = ('FWD', 'TURN')
+
+# Give up on a UI event whose state never comes up (seconds)
+EVENT_TIMEOUT = 120.0
+
+# Tk loop lateness is sampled this often (milliseconds)
+HEARTBEAT_MS = 20
+
+
+class SessionRecorder:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def record(self, kind, *fields):
+        elapsed_ms = int((time.perf_counter() - self.started) * 1000)
+        line = '\t'.join((str(elapsed_ms), kind) + fields)
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line + '\n')
+
+    def tx(self, line):
+        self.record('tx', line)
+
+    def rx(self, line):
+        self.record('rx', line)
+
+    def ui(self, name, args, delivery):
+        self.record('ui', name, json.dumps(args), delivery.state, str(delivery.current_path_index))
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_session(path):
+    # [(seconds, kind, fields)] in recorded order
+    events = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 3:
+                events.append((int(fields[0]) / 1000, fields[1], fields[2:]))
+    return events
+
+
+class ReplayArduino:
+    # Fake Arduino on a pseudo-terminal. Replies to a command are the rx
+    # lines that followed the same command in the recording, in order.
+    # Commands the recording never saw get DIRECTION_DONE if they move.
+    def __init__(self, events, realtime=True):
+        self.realtime = realtime
+        self.replies = {}
+        replies = None
+        for seconds, kind, fields in events:
+            if kind == 'tx':
+                sent_at, replies = seconds, []
+                self.replies.setdefault(fields[0], deque()).append(replies)
+            elif kind == 'rx' and replies is not None:
+                replies.append((seconds - sent_at, fields[0]))
+        self.master, self.slave = pty.openpty()
+        self.port_name = os.ttyname(self.slave)
+        self.outbox = []
+        self.outbox_ready = threading.Condition()
+        self.sequence = 0
+        self.emitted = deque()
+        self.unexpected = []
+        self.session = 0
+        self.moves_done = 0
+
+    def start(self):
+        threading.Thread(target=self.read_loop, daemon=True, name="replay-arduino").start()
+        threading.Thread(target=self.write_loop, daemon=True, name="replay-arduino-out").start()
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+    def schedule(self, line, delay=0.0):
+        with self.outbox_ready:
+            self.sequence += 1
+            heapq.heappush(self.outbox, (time.perf_counter() + delay, self.sequence, line))
+            self.outbox_ready.notify()
+
+    def read_loop(self):
+        buffer = b''
+        while True:
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self.answer(line.decode(errors='replace').strip())
+
+    def answer(self, command):
+        if command == 'PING':
+            self.schedule('PONG')
+        elif command.startswith('BAUD:'):
+            self.schedule(f"BAUD_OK:{command[5:]}")
+        elif command.startswith('LOG:'):
+            self.schedule(f"LOG_OK:{command[4:]}")
+        elif command.startswith('SESSION:'):
+            self.schedule(f"SESSION_OK:{self.session}:{self.moves_done}")
+            self.session = int(command[8:])
+        elif command == 'SELF_TEST':
+            self.schedule('SELF_TEST_DONE')
+        elif self.replies.get(command):
+            for delay, line in self.replies[command].popleft():
+                self.schedule(line, delay if self.realtime else 0.0)
+        elif command.startswith(MOTION_COMMANDS):
+            self.unexpected.append(command)
+            self.schedule('DIRECTION_DONE')
+
+    def write_loop(self):
+        while True:
+            with self.outbox_ready:
+                while not self.outbox or self.outbox[0][0] > time.perf_counter():
+                    self.outbox_ready.wait(self.outbox[0][0] - time.perf_counter() if self.outbox else None)
+                _, _, line = heapq.heappop(self.outbox)
+            if line == 'DIRECTION_DONE':
+                self.moves_done += 1
+                self.emitted.append(time.perf_counter())
+            try:
+                os.write(self.master, f"{line}\r\n".encode())
+            except OSError:
+                return
+
+
+class AutoAnswer:
+    # Stands in for tkinter.messagebox so modal dialogs don't stop a replay
+    def __getattr__(self, name):
+        def answer(*args, **kwargs):
+            return True if name.startswith('ask') else 'ok'
+        return answer
+
+
+class SessionReplay:
+    def __init__(self, events, realtime=True):
+        self.ui_events = [(seconds, fields) for seconds, kind, fields in events if kind == 'ui']
+        # Recorded timings count from the first UI event, not kiosk startup
+        self.first_event = self.ui_events[0][0] if self.ui_events else 0.0
+        self.arduino = ReplayArduino(events, realtime)
+        self.realtime = realtime
+        self.samples = {}
+        self.skipped = []
+        self.app = None
+        self.root = None
+
+    def observe(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def timed(self, name, handler):
+        def wrapper(*args):
+            started = time.perf_counter()
+            try:
+                return handler(*args)
+            finally:
+                self.observe(name, time.perf_counter() - started)
+        return wrapper
+
+    def run(self):
+        self.start_app()
+        self.root.after(0, self.next_event, 0, None)
+        self.root.mainloop()
+        return self.report(time.perf_counter() - self.started)
+
+    def start_app(self):
+        import tkinter as tk
+        import main
+
+        # No tablets, no recording of the replay itself, no modal dialogs
+        main.ORDER_API_PORT = None
+        main.SESSION_LOG = None
+        main.messagebox = AutoAnswer()
+
+        self.arduino.start()
+        self.root = tk.Tk()
+        self.app = main.MesamateApp(self.root, serial_ports=[self.arduino.port_name])
+        self.instrument()
+        self.started = time.perf_counter()
+        self.root.after(HEARTBEAT_MS, self.heartbeat, time.perf_counter())
+
+    def instrument(self):
+        delivery = self.app.delivery
+        direction_done = self.timed('direction_done_seconds', delivery.direction_done)
+
+        def handle_direction_done():
+            if self.arduino.emitted:
+                self.observe('serial_to_ui_seconds', time.perf_counter() - self.arduino.emitted.popleft())
+            direction_done()
+        delivery.direction_done = handle_direction_done
+
+    def heartbeat(self, scheduled):
+        now = time.perf_counter()
+        self.observe('tk_lateness_seconds', max(0.0, now - scheduled - HEARTBEAT_MS / 1000))
+        self.root.after(HEARTBEAT_MS, self.heartbeat, now)
+
+    def fire(self, name, args):
+        app = self.app
+        if name == 'dispatch':
+            app.queue_order(*args, source="the kiosk")
+        elif name == 'order':
+            app.accept_order(*args, Future())
+        elif name == 'pickup':
+            if app.pickup_window is None:
+                return False
+            app.handle_food_received(*args, app.pickup_window)
+        elif name == 'not_yet':
+            app.pickup_not_yet()
+        else:
+            return False
+        return True
+
+    def next_event(self, index, waiting_since):
+        if index == len(self.ui_events):
+            self.root.after(100, self.finish)
+            return
+        seconds, (name, args, state, leg) = self.ui_events[index]
+        now = time.perf_counter()
+        due = not self.realtime or now - self.started >= seconds - self.first_event
+        delivery = self.app.delivery
+        ready = delivery.state == state and str(delivery.current_path_index) == leg
+        if not (due and ready):
+            waiting_since = waiting_since or now
+            if now - waiting_since < EVENT_TIMEOUT:
+                self.root.after(10, self.next_event, index, waiting_since)
+                return
+            self.skipped.append(name)
+            self.root.after(0, self.next_event, index + 1, None)
+            return
+
+        started = time.perf_counter()
+        if self.fire(name, json.loads(args)):
+            self.observe(f'ui_{name}_seconds', time.perf_counter() - started)
+        else:
+            self.skipped.append(name)
+        self.root.after(0, self.next_event, index + 1, None)
+
+    def finish(self):
+        # Wait for the last trip and any queued orders to finish
+        from delivery import IDLE
+        if self.app.delivery.state != IDLE or self.app.order_queue:
+            self.root.after(100, self.finish)
+            return
+        self.close_app()
+
+    def close_app(self):
+        self.app.controller.close()
+        self.app.metrics.stop()
+        self.arduino.close()
+        self.root.quit()
+        self.root.destroy()
+
+    def report(self, session_seconds):
+        metrics = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            metrics[name] = {
+                'count': len(ordered),
+                'p50': statistics.median(ordered),
+                'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                'max': ordered[-1]
+            }
+        return {
+            'mode': 'realtime' if self.realtime else 'fast',
+            'session_seconds': session_seconds,
+            'unexpected_commands': self.arduino.unexpected,
+            'skipped_events': self.skipped,
+            'metrics': metrics
+        }
+
+
+def print_report(report, baseline=None):
+    print(f"Replayed in {report['session_seconds']:.1f} s ({report['mode']})")
+    if report['unexpected_commands']:
+        print(f"Commands not in the recording: {report['unexpected_commands']}")
+    if report['skipped_events']:
+        print(f"UI events skipped: {report['skipped_events']}")
+    print(f"{'metric':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+          + (f"{'base p95':>10}{'change':>9}" if baseline else ""))
+    for name, stats in report['metrics'].items():
+        row = (f"{name:<28}{stats['count']:>7}{1000 * stats['p50']:>10.2f}"
+               f"{1000 * stats['p95']:>10.2f}{1000 * stats['max']:>10.2f}")
+        base = baseline['metrics'].get(name) if baseline else None
+        if base:
+            change = (stats['p95'] - base['p95']) / base['p95'] * 100 if base['p95'] else 0.0
+            row += f"{1000 * base['p95']:>10.2f}{change:>+8.0f}%"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded kiosk session")
+    parser.add_argument('session', help="session log written with SESSION_LOG")
+    parser.add_argument('--fast', action='store_true', help="don't wait for recorded timings")
+    parser.add_argument('--save', help="write the report as JSON")
+    parser.add_argument('--compare', help="report from an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = SessionReplay(load_session(args.session), realtime=not args.fast).run()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import numpy as np
+
+# Route cache with incremental invalidation for hot-reloaded layouts.
+# Every cached route keeps the bounding box of the cells its search touched.
+# When the occupancy grid changes, only routes whose cells or search area
+# overlap a changed cell are dropped. Anything else is still the same route
+# the planner would return on the new layout.
+
+
+def cells_bounds(containers, margin=1):
+    # Bounding box (top, left, bottom, right inclusive) of every cell in the
+    # given containers, grown by a margin so walls at the edge of the search
+    # frontier count as touched
+    cells = [cell for container in containers for cell in container]
+    if not cells:
+        return None
+    cells = np.asarray(cells)
+    top, left = cells.min(axis=0) - margin
+    bottom, right = cells.max(axis=0) + margin
+    return (max(int(top), 0), max(int(left), 0), int(bottom), int(right))
+
+
+def layout_changes(old_grid, new_grid):
+    # Mask of cells that changed, or None when the layouts can't be compared
+    if old_grid is None or old_grid.shape != new_grid.shape:
+        return None
+    return old_grid != new_grid
+
+
+def stations_path(image_path):
+    base, _ = os.path.splitext(image_path)
+    return base + ".stations.json"
+
+
+def load_stations(image_path, default):
+    # Optional sidecar file {"table1": [row, col], ...} next to the layout
+    path = stations_path(image_path)
+    if not os.path.exists(path):
+        return dict(default)
+    with open(path) as f:
+        return {name: (int(coords[0]), int(coords[1])) for name, coords in json.load(f).items()}
+
+
+class RouteCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, start, goal):
+        # A route can be driven in either direction
+        with self.lock:
+            if (start, goal) in self.routes:
+                return self.routes[(start, goal)][0]
+            if (goal, start) in self.routes:
+                return self.routes[(goal, start)][0][::-1]
+        return None
+
+    def put(self, start, goal, route, bounds, version):
+        # Results planned against an older layout are not cached
+        with self.lock:
+            if version == self.version and bounds is not None:
+                self.routes[(start, goal)] = (route, bounds)
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+            self.version += 1
+
+    def invalidate(self, changed):
+        # Returns the number of routes dropped
+        with self.lock:
+            self.version += 1
+            stale = []
+            for key, (route, (top, left, bottom, right)) in self.routes.items():
+                if changed[top:bottom + 1, left:right + 1].any() or changed[route[:, 0], route[:, 1]].any():
+                    stale.append(key)
+            for key in stale:
+                del self.routes[key]
+            return len(stale)
@@ -0,0 +1,195 @@
+import statistics
+import sys
+import time
+
+# Serial link setup shared by the kiosk and the round-trip benchmark.
+# The firmware boots at DEFAULT_BAUD. We ask for the fastest rate in
+# BAUD_RATES it accepts (BAUD:<rate> -> BAUD_OK:<rate>), switch our side and
+# confirm with PING/PONG. If the confirmation fails the firmware drops back
+# to DEFAULT_BAUD on its own after BAUD_CONFIRM_TIMEOUT, and so do we.
+# Older firmware answers PING with DIRECTION_DONE, and we stay at 9600.
+#
+# Ports are opened with DTR low: raising it resets an Uno or Nano, which
+# would stop the robot mid-aisle. Each connection then tags the board with
+# SESSION:<id>; the reply carries the previous tag, which is 0 after a
+# reset, so the host can tell a board that kept running from one that
+# rebooted, and the number of moves finished since boot. The motor and LED
+# self-test only runs on SELF_TEST.
+
+DEFAULT_BAUD = 9600
+BAUD_RATES = (115200, 57600, 38400, 19200)
+
+# Matches BAUD_CONFIRM_TIMEOUT in motorcontrol.ino (seconds)
+BAUD_CONFIRM_TIMEOUT = 1.0
+
+# The board boots before it reads commands; older firmware also runs its
+# motor and LED self-test first
+READY_TIMEOUT = 15.0
+REPLY_TIMEOUT = 0.5
+
+# 'QUIET' keeps the link to protocol messages, 'VERBOSE' adds debug text
+LOG_LEVELS = ('QUIET', 'VERBOSE')
+
+# The motor and LED self-test takes about 9 seconds
+SELF_TEST_TIMEOUT = 15.0
+
+
+def open_port(name, baud, timeout=0.1):
+    # Open without raising DTR, so opening the port doesn't reset the board
+    import serial
+
+    port = serial.Serial()
+    port.port = name
+    port.baudrate = baud
+    port.timeout = timeout
+    port.dtr = False
+    port.open()
+    return port
+
+
+def wait_for_line(port, expected, timeout):
+    # Read lines until one is in expected (a string or tuple of strings).
+    # Returns the matching line, or None on timeout.
+    if isinstance(expected, str):
+        expected = (expected,)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        line = port.readline().decode(errors='replace').strip()
+        if line in expected:
+            return line
+    return None
+
+
+def ping(port, timeout=REPLY_TIMEOUT):
+    port.reset_input_buffer()
+    port.write(b"PING\n")
+    port.flush()
+    return wait_for_line(port, "PONG", timeout) is not None
+
+
+def handshake(port, timeout=READY_TIMEOUT):
+    # Keep pinging while the board boots (older firmware self-tests). Bytes sent
+    # during the bootloader are lost, so one PING is not enough. Returns
+    # "PONG", "DIRECTION_DONE" for older firmware (which treats PING as a
+    # zero-length move) or None if nothing answered.
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        port.reset_input_buffer()
+        port.write(b"PING\n")
+        port.flush()
+        reply = wait_for_line(port, ("PONG", "DIRECTION_DONE"), min(1.0, timeout))
+        if reply is not None:
+            return reply
+    return None
+
+
+def wait_until_ready(port, timeout=READY_TIMEOUT):
+    # True once the firmware answers PONG
+    return handshake(port, timeout) == "PONG"
+
+
+def negotiate_baud(port, rates=BAUD_RATES, ready_timeout=READY_TIMEOUT):
+    # Returns the rate both ends ended up on
+    port.baudrate = DEFAULT_BAUD
+    if not wait_until_ready(port, ready_timeout):
+        print("Firmware does not support baud negotiation, staying at 9600 baud")
+        return DEFAULT_BAUD
+
+    for rate in rates:
+        port.reset_input_buffer()
+        port.write(f"BAUD:{rate}\n".encode())
+        port.flush()
+        if wait_for_line(port, f"BAUD_OK:{rate}", REPLY_TIMEOUT) is None:
+            # Refused, the firmware is still at the default rate
+            continue
+        port.baudrate = rate
+        if ping(port):
+            print(f"Serial link running at {rate} baud")
+            return rate
+        # Let the firmware give up on the new rate and meet it back at the default
+        port.baudrate = DEFAULT_BAUD
+        time.sleep(BAUD_CONFIRM_TIMEOUT + REPLY_TIMEOUT)
+
+    print("No faster baud rate confirmed, staying at 9600 baud")
+    return DEFAULT_BAUD
+
+
+def start_session(port, session):
+    # Tag the board with a session id. Returns (previous id, moves finished
+    # since boot); the previous id is 0 if the board reset since it was last
+    # tagged. (None, None) for firmware without sessions.
+    port.reset_input_buffer()
+    port.write(f"SESSION:{session}\n".encode())
+    port.flush()
+    deadline = time.perf_counter() + REPLY_TIMEOUT
+    while time.perf_counter() < deadline:
+        line = port.readline().decode(errors='replace').strip()
+        if line.startswith("SESSION_OK:"):
+            fields = line[len("SESSION_OK:"):].split(':')
+            if len(fields) == 2 and all(field.isdigit() for field in fields):
+                return int(fields[0]), int(fields[1])
+            return None, None
+    return None, None
+
+
+def run_self_test(port, timeout=SELF_TEST_TIMEOUT):
+    # Drive each motor direction and cycle the LEDs; the robot moves
+    port.write(b"SELF_TEST\n")
+    port.flush()
+    return wait_for_line(port, "SELF_TEST_DONE", timeout) is not None
+
+
+def set_log_level(port, level):
+    port.write(f"LOG:{level}\n".encode())
+    port.flush()
+    return wait_for_line(port, f"LOG_OK:{level}", REPLY_TIMEOUT) is not None
+
+
+def measure_round_trip(port, count=20, command="FWD:0"):
+    # Seconds from writing a command to reading its DIRECTION_DONE.
+    # FWD:0 goes through the normal command path without driving.
+    samples = []
+    for _ in range(count):
+        port.reset_input_buffer()
+        started = time.perf_counter()
+        port.write(f"{command}\n".encode())
+        port.flush()
+        if wait_for_line(port, "DIRECTION_DONE", 2.0) is not None:
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples):
+    if not samples:
+        return "no replies"
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    return (f"median {1000 * statistics.median(ordered):.1f} ms, "
+            f"p95 {1000 * p95:.1f} ms over {len(ordered)} commands")
+
+
+def main():
+    # Usage: python seriallink.py [port] [count]
+    # Measures command round trips at 9600 baud with verbose logging, then
+    # again after negotiating the fastest rate with quiet logging.
+    port_name = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyACM0'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    port = open_port(port_name, DEFAULT_BAUD)
+    try:
+        if not wait_until_ready(port):
+            print("Firmware did not answer PING")
+            return
+        set_log_level(port, 'VERBOSE')
+        before = measure_round_trip(port, count)
+        print(f"Before ({DEFAULT_BAUD} baud, verbose): {summarize(before)}")
+
+        rate = negotiate_baud(port)
+        set_log_level(port, 'QUIET')
+        after = measure_round_trip(port, count)
+        print(f"After ({rate} baud, quiet): {summarize(after)}")
+    finally:
+        port.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import argparse
+import heapq
+import itertools
+import math
+import random
+import time
+import numpy as np
+from anyangle import path_corners
+from benchmark import nearest_free_cell
+from commands import compile_polyline, INITIAL_HEADING
+from delivery import DeliveryStateMachine, PICKUP_TIMEOUT_MS
+from main import STATIONS
+from planner import Planner, image_to_binary_array
+from motion import command_duration
+from routecache import load_stations
+
+# Discrete-event restaurant simulator.
+# The real DeliveryStateMachine runs against a simulated clock: the kiosk
+# hooks are answered by SimulatedKiosk, which schedules DIRECTION_DONE after
+# motion.command_duration (derived from MOVEMENT_DURATION/TURN_DURATION and
+# the speed profiles) and a pickup tap after a sampled delay. Legs are
+# planned with the real planner on the real layout and stations, so hours of
+# service run in seconds.
+#
+#   python simulator.py [--layout demolayout.png] [--hours 4] [--rate 30]
+#                       [--peak 60:90:90] [--policy tap-order nearest]
+#                       [--batch 1 3] [--planner navmesh anyangle] [--seed 1]
+#
+# Orders arrive as a Poisson process at --rate orders per hour, raised to the
+# given rate between the given minutes by each --peak start:end:rate. Each
+# order is for one table. When the robot is home and orders are waiting,
+# staff take --load seconds to load it, then send it to up to --batch tables.
+# Every combination of --policy, --batch and --planner sees the same orders
+# and reports deliveries per hour, order wait percentiles (order placed to
+# food picked up) and robot utilization. Orders whose pickup timed out rode
+# back home with the food and are counted apart, not as deliveries.
+
+# Staff time to load the tray and tap the tables (seconds)
+LOAD_SECONDS = 20
+
+# Mean time for the customer or waiter to take the food and tap Yes (seconds)
+PICKUP_MEAN_SECONDS = 15
+
+# Serial round trip and firmware overhead per command (milliseconds)
+COMMAND_OVERHEAD_MS = 15
+
+
+class EventQueue:
+    # Simulated clock in milliseconds. schedule() and cancel() have the same
+    # shape as Tk's after() and after_cancel(), so the state machine can't
+    # tell the difference.
+    def __init__(self):
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+        self.cancelled = set()
+
+    def schedule(self, delay_ms, callback, *args):
+        event_id = next(self.sequence)
+        heapq.heappush(self.events, (self.now + delay_ms, event_id, callback, args))
+        return event_id
+
+    def cancel(self, event_id):
+        self.cancelled.add(event_id)
+
+    def run(self, until_ms):
+        while self.events and self.events[0][0] <= until_ms:
+            due, event_id, callback, args = heapq.heappop(self.events)
+            if event_id in self.cancelled:
+                self.cancelled.discard(event_id)
+                continue
+            self.now = due
+            callback(*args)
+        self.now = until_ms
+
+
+def parse_peak(text):
+    start, end, rate = (float(field) for field in text.split(':'))
+    return start, end, rate
+
+
+def arrival_rate(minute, rate, peaks):
+    for start, end, peak_rate in peaks:
+        if start <= minute < end:
+            return peak_rate
+    return rate
+
+
+def generate_orders(hours, rate, peaks, tables, seed):
+    # Non-homogeneous Poisson arrivals by thinning. Returns orders in
+    # arrival order; the pickup delay is drawn here so every strategy sees
+    # the same customers.
+    rng = random.Random(seed)
+    top_rate = max([rate] + [peak[2] for peak in peaks])
+    orders = []
+    if top_rate <= 0:
+        return orders
+    minute = 0.0
+    while True:
+        minute += rng.expovariate(top_rate / 60)
+        if minute >= hours * 60:
+            return orders
+        if rng.random() * top_rate <= arrival_rate(minute, rate, peaks):
+            orders.append({
+                'id': len(orders) + 1,
+                'table': rng.choice(tables),
+                'placed': minute * 60000,
+                'pickup_ms': rng.expovariate(1 / PICKUP_MEAN_SECONDS) * 1000,
+                'delivered': None,
+                'timed_out': None
+            })
+
+
+class LayoutModel:
+    # Layout, stations and planner shared by every run, with planned routes
+    # cached per (start, goal)
+    def __init__(self, image_path, planner_mode):
+        self.planner = Planner(planner_mode)
+        self.grid = image_to_binary_array(image_path)
+        self.planner.compile_layout(self.grid, image_path)
+        rows, cols = self.grid.shape
+        self.home = nearest_free_cell(self.grid, (0, cols // 2))
+        self.stations = {name: nearest_free_cell(self.grid, cell)
+                         for name, cell in load_stations(image_path, STATIONS).items()}
+        problems = self.planner.reachability.station_problems(self.stations, self.home)
+        for name, problem in problems.items():
+            print(f"Leaving out {name}: {problem}")
+            del self.stations[name]
+        self.routes = {}
+        # Calibrated layouts are driven in millimetres, as on the kiosk
+        metric_map = self.planner.metric_map
+        self.unit_mm = metric_map.mm_per_pixel if metric_map is not None else None
+
+    def corners(self, start, goal):
+        key = (tuple(start), tuple(goal))
+        if key not in self.routes:
+            path = self.planner.plan_path(self.grid, key[0], key[1])
+            self.routes[key] = path_corners(path)
+        return self.routes[key]
+
+    def leg_length(self, start, goal):
+        corners = self.corners(start, goal).astype(float)
+        return float(np.hypot(*np.diff(corners, axis=0).T).sum())
+
+    def compile_trip(self, tables):
+        # Leg dicts for home -> tables... -> home, with the heading carried
+        # over from leg to leg as on the kiosk
+        stops = [self.home] + [self.stations[table] for table in tables] + [self.home]
+        heading = INITIAL_HEADING
+        legs = []
+        for index, (start, goal) in enumerate(zip(stops, stops[1:])):
+            return_home = index == len(tables)
+            directions, heading = compile_polyline(
+                self.corners(start, goal), heading,
+                INITIAL_HEADING if return_home else None, self.planner.clearance, self.unit_mm)
+            legs.append({'directions': directions, 'description': f"{start} -> {goal}"})
+        return legs
+
+
+def tap_order(model, tables):
+    # The kiosk today: tables in the order they were tapped
+    return tables
+
+
+def nearest_first(model, tables):
+    # Greedy nearest neighbour by driven length from home
+    ordered, position, remaining = [], model.home, list(tables)
+    while remaining:
+        table = min(remaining, key=lambda name: model.leg_length(position, model.stations[name]))
+        remaining.remove(table)
+        ordered.append(table)
+        position = model.stations[table]
+    return ordered
+
+
+POLICIES = {'tap-order': tap_order, 'nearest': nearest_first}
+
+
+class SimulatedKiosk:
+    # Stands in for MesamateApp as the state machine's controller
+    def __init__(self, model, orders, policy, batch, load_seconds=LOAD_SECONDS,
+                 command_overhead_ms=COMMAND_OVERHEAD_MS, pickup_timeout_ms=PICKUP_TIMEOUT_MS):
+        self.model = model
+        self.orders = orders
+        self.policy = policy
+        self.batch = batch
+        self.load_ms = load_seconds * 1000
+        self.command_overhead_ms = command_overhead_ms
+        self.clock = EventQueue()
+        self.delivery = DeliveryStateMachine(self, self.clock.schedule, self.clock.cancel,
+                                             pickup_timeout_ms)
+        self.queue = []
+        self.trip_orders = {}
+        self.legs = []
+        self.busy = False
+        self.busy_since = None
+        self.busy_ms = 0.0
+        self.driving_ms = 0.0
+        self.trips = 0
+        self.stops = 0
+        self.timeouts = 0
+
+    def run(self, hours):
+        for order in self.orders:
+            self.clock.schedule(order['placed'], self.order_placed, order)
+        self.clock.run(hours * 3600000)
+        if self.busy:
+            self.busy_ms += self.clock.now - self.busy_since
+
+    # --- Orders and dispatch ---
+
+    def order_placed(self, order):
+        self.queue.append(order)
+        self.try_dispatch()
+
+    def try_dispatch(self):
+        if self.busy or not self.queue:
+            return
+        self.busy = True
+        self.busy_since = self.clock.now
+        self.clock.schedule(self.load_ms, self.dispatch)
+
+    def dispatch(self):
+        # Take waiting orders first come first served; an order for a table
+        # already on the trip rides along without an extra stop
+        self.trip_orders = {}
+        for order in list(self.queue):
+            table = order['table']
+            if table not in self.trip_orders and len(self.trip_orders) == self.batch:
+                continue
+            self.trip_orders.setdefault(table, []).append(order)
+            self.queue.remove(order)
+        tables = self.policy(self.model, list(self.trip_orders))
+        self.legs = self.model.compile_trip(tables)
+        self.trips += 1
+        self.delivery.start(tables)
+
+    # --- Delivery state machine hooks ---
+
+    def resolve_leg(self, index):
+        return self.legs[index] if index < len(self.legs) else None
+
+    def leg_started(self, index):
+        pass
+
+    def send_command(self, leg, index):
+        duration = command_duration(leg['directions'][index])
+        self.driving_ms += duration
+        self.clock.schedule(duration + self.command_overhead_ms, self.delivery.direction_done)
+
+    def prompt_pickup(self, table):
+        self.stops += 1
+        pickup_ms = self.trip_orders[table][0]['pickup_ms']
+        self.clock.schedule(pickup_ms, self.tap_yes, self.delivery.current_path_index)
+
+    def tap_yes(self, leg_index):
+        # A tap that comes after the timeout has already moved the robot on
+        if self.delivery.current_path_index == leg_index:
+            self.delivery.pickup_confirmed('kiosk')
+
+    def pickup_done(self, table, source):
+        # A timed out pickup leaves the food on the tray
+        outcome = 'delivered'
+        if source == 'timeout':
+            self.timeouts += 1
+            outcome = 'timed_out'
+        for order in self.trip_orders[table]:
+            order[outcome] = self.clock.now
+
+    def trip_complete(self):
+        self.busy = False
+        self.busy_ms += self.clock.now - self.busy_since
+        self.try_dispatch()
+
+    # --- Results ---
+
+    def report(self, hours):
+        waits = sorted((order['delivered'] - order['placed']) / 1000
+                       for order in self.orders if order['delivered'] is not None)
+
+        def percentile(fraction):
+            if not waits:
+                return math.nan
+            return waits[min(len(waits) - 1, int(fraction * len(waits)))]
+
+        timed_out = sum(order['timed_out'] is not None for order in self.orders)
+        horizon_ms = hours * 3600000
+        return {
+            'orders': len(self.orders),
+            'delivered': len(waits),
+            'timed_out': timed_out,
+            'waiting': len(self.orders) - len(waits) - timed_out,
+            'deliveries_per_hour': len(waits) / hours,
+            'wait_p50': percentile(0.50),
+            'wait_p90': percentile(0.90),
+            'wait_p99': percentile(0.99),
+            'wait_max': waits[-1] if waits else math.nan,
+            'utilization': self.busy_ms / horizon_ms,
+            'driving': self.driving_ms / horizon_ms,
+            'trips': self.trips,
+            'tables_per_trip': self.stops / self.trips if self.trips else 0.0,
+            'timeouts': self.timeouts
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate service and report dispatch throughput")
+    parser.add_argument('--layout', default='demolayout.png')
+    parser.add_argument('--hours', type=float, default=4.0)
+    parser.add_argument('--rate', type=float, default=30.0, help="orders per hour")
+    parser.add_argument('--peak', type=parse_peak, action='append', default=[],
+                        help="start_minute:end_minute:orders_per_hour")
+    parser.add_argument('--policy', nargs='+', default=['tap-order'], choices=sorted(POLICIES))
+    parser.add_argument('--batch', type=int, nargs='+', default=[3], help="tables per trip")
+    parser.add_argument('--planner', nargs='+', default=['navmesh'],
+                        help="planner modes (navmesh, grid, bidirectional, octile, anyangle)")
+    parser.add_argument('--load', type=float, default=LOAD_SECONDS, help="loading seconds per trip")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    models = {planner_mode: LayoutModel(args.layout, planner_mode) for planner_mode in args.planner}
+    print(f"{'policy':<11}{'batch':>6}{'planner':>10}{'orders':>8}{'deliv/h':>9}{'timeout':>8}{'waiting':>8}"
+          f"{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'busy':>7}{'drive':>7}{'trips':>7}{'tbl/trip':>9}"
+          f"{'sim s':>7}")
+    for (planner_mode, model), policy, batch in itertools.product(models.items(), args.policy, args.batch):
+        orders = generate_orders(args.hours, args.rate, args.peak, sorted(model.stations), args.seed)
+        started = time.perf_counter()
+        kiosk = SimulatedKiosk(model, orders, POLICIES[policy], batch, args.load)
+        kiosk.run(args.hours)
+        elapsed = time.perf_counter() - started
+        result = kiosk.report(args.hours)
+        print(f"{policy:<11}{batch:>6}{planner_mode:>10}{result['orders']:>8}"
+              f"{result['deliveries_per_hour']:>9.1f}{result['timed_out']:>8}{result['waiting']:>8}"
+              f"{result['wait_p50']:>8.0f}{result['wait_p90']:>8.0f}{result['wait_p99']:>8.0f}"
+              f"{result['utilization']:>7.0%}{result['driving']:>7.0%}{result['trips']:>7}"
+              f"{result['tables_per_trip']:>9.2f}{elapsed:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
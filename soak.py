@@ -0,0 +1,196 @@
+import argparse
+import gc
+import random
+import resource
+import statistics
+import time
+from replay import SessionReplay
+
+# Soak run: thousands of unattended delivery cycles through the real kiosk.
+# Each cycle opens the table selection, picks 1-3 reachable tables, starts
+# the trip, confirms every pickup on the prompt and closes the completion
+# popup, alternating between its OKAY (straight to the next selection) and
+# the main OKAY (back to the welcome screen). The Arduino is a ReplayArduino
+# with no recording, so every command is acknowledged at once and the run is
+# bound by the kiosk itself. No operator or robot is needed; on a machine
+# without a display run it under xvfb-run.
+#
+#   python soak.py [--cycles 2000] [--every 50] [--seed 1]
+#
+# Every --every cycles it prints the RSS of the kiosk and controller
+# processes, Python object, Tk widget and image counts, pyplot figures and
+# how many objects the pools (see pools.py) have built. At the end it
+# reports the drift in cycle time and DIRECTION_DONE handling between the
+# first and last tenth of the run and the growth per 1000 cycles.
+
+# How often the driver checks on the kiosk (milliseconds)
+POLL_MS = 5
+
+
+def rss_mb(pid='self'):
+    # Resident set size of a process, from /proc where there is one
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == 'self':
+        # Peak rather than current, but it still shows growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+def widget_count(widget):
+    return 1 + sum(widget_count(child) for child in widget.winfo_children())
+
+
+def growth_per_1000(cycles, values):
+    # Least-squares slope of values over cycles, per 1000 cycles
+    if len(cycles) < 2 or len(set(cycles)) < 2:
+        return 0.0
+    return statistics.linear_regression(cycles, values).slope * 1000
+
+
+class SoakRun(SessionReplay):
+    def __init__(self, cycles, every=50, seed=1):
+        super().__init__([], realtime=False)
+        self.cycles = cycles
+        self.every = every
+        self.random = random.Random(seed)
+        self.cycle = 0
+        self.cycle_started = None
+        self.rows = []
+        self.snapshots = []
+
+    def run(self):
+        self.start_app()
+        self.take_snapshot()
+        self.root.after(0, self.start_cycle)
+        self.root.mainloop()
+        return self.summary()
+
+    def start_cycle(self):
+        import main
+        from delivery import IDLE
+        app = self.app
+        if app.delivery.state != IDLE:
+            self.root.after(POLL_MS, self.start_cycle)
+            return
+        selection = getattr(app, 'selection_window', None)
+        if selection is None or not selection.winfo_exists():
+            app.show_table_selection(None)
+        tables = [table for table in app.table_buttons
+                  if table in main.STATIONS and table not in app.unreachable_stations]
+        for table in self.random.sample(tables, self.random.randint(1, min(3, len(tables)))):
+            app.select_table(table)
+        self.cycle_started = time.perf_counter()
+        app.start_path_visualization()
+        self.root.after(POLL_MS, self.drive_cycle)
+
+    def drive_cycle(self):
+        from delivery import AWAITING_PICKUP, IDLE
+        app = self.app
+        delivery = app.delivery
+        if delivery.state == AWAITING_PICKUP and app.dialogs.is_showing(app.pickup_window):
+            app.handle_food_received(delivery.current_table(), app.pickup_window)
+        elif delivery.state == IDLE:
+            self.end_cycle()
+            return
+        self.root.after(POLL_MS, self.drive_cycle)
+
+    def end_cycle(self):
+        app = self.app
+        self.cycle += 1
+        handled = self.samples.get('direction_done_seconds', [])
+        self.rows.append((
+            time.perf_counter() - self.cycle_started,
+            statistics.median(handled) if handled else 0.0,
+            max(self.samples.get('tk_lateness_seconds', [0.0]))
+        ))
+        # Keep the harness itself from growing
+        self.samples.clear()
+        self.arduino.unexpected.clear()
+
+        if app.completion_popup is not None:
+            if self.cycle % 2:
+                app.close_completion_popup()
+            else:
+                app.dialogs.release(app.completion_popup)
+                app.completion_popup = None
+                app.reset_and_return_to_welcome()
+
+        if self.cycle % self.every == 0 or self.cycle == self.cycles:
+            self.take_snapshot()
+        if self.cycle < self.cycles:
+            self.root.after(0, self.start_cycle)
+        else:
+            self.close_app()
+
+    def take_snapshot(self):
+        import matplotlib.pyplot as plt
+        app = self.app
+        gc.collect()
+        snapshot = {
+            'cycle': self.cycle,
+            'rss_mb': rss_mb(),
+            'controller_rss_mb': rss_mb(app.controller.process.pid),
+            'objects': len(gc.get_objects()),
+            'widgets': widget_count(self.root),
+            'tk_images': len(self.root.tk.call('image', 'names')),
+            'figures': len(plt.get_fignums()),
+            'pooled': (app.figures.created, app.dialogs.created, app.images.created)
+        }
+        self.snapshots.append(snapshot)
+        recent = self.rows[-self.every:]
+        cycle_ms = 1000 * statistics.median(row[0] for row in recent) if recent else 0.0
+        controller_rss = snapshot['controller_rss_mb']
+        print(f"cycle {self.cycle:>6}  rss {snapshot['rss_mb']:7.1f} MB"
+              f"  controller {controller_rss if controller_rss is not None else float('nan'):7.1f} MB"
+              f"  objects {snapshot['objects']:>8}  widgets {snapshot['widgets']:>5}"
+              f"  images {snapshot['tk_images']:>3}  figures {snapshot['figures']:>2}"
+              f"  pooled {snapshot['pooled']}  cycle {cycle_ms:8.1f} ms", flush=True)
+
+    def summary(self):
+        tenth = max(1, len(self.rows) // 10)
+        first, last = self.rows[:tenth], self.rows[-tenth:]
+        drift = {}
+        for index, name in enumerate(('cycle_seconds', 'direction_done_seconds', 'tk_lateness_seconds')):
+            before = statistics.median(row[index] for row in first)
+            after = statistics.median(row[index] for row in last)
+            drift[name] = {
+                'first': before,
+                'last': after,
+                'change_percent': (after - before) / before * 100 if before else 0.0,
+                'per_1000_cycles': growth_per_1000(list(range(len(self.rows))),
+                                                   [row[index] for row in self.rows])
+            }
+        cycles = [snapshot['cycle'] for snapshot in self.snapshots]
+        growth = {name: growth_per_1000(cycles, [snapshot[name] for snapshot in self.snapshots])
+                  for name in ('rss_mb', 'objects', 'widgets', 'tk_images')}
+        return {'cycles': len(self.rows), 'drift': drift, 'growth_per_1000_cycles': growth,
+                'snapshots': self.snapshots}
+
+
+def print_summary(summary):
+    print(f"\n{summary['cycles']} cycles")
+    print(f"{'latency (median)':<26}{'first ms':>10}{'last ms':>10}{'change':>9}{'per 1000':>10}")
+    for name, stats in summary['drift'].items():
+        print(f"{name:<26}{1000 * stats['first']:>10.2f}{1000 * stats['last']:>10.2f}"
+              f"{stats['change_percent']:>+8.0f}%{1000 * stats['per_1000_cycles']:>+10.2f}")
+    print("Growth per 1000 cycles: " + ", ".join(
+        f"{name} {value:+.1f}" for name, value in summary['growth_per_1000_cycles'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run unattended delivery cycles and watch for growth")
+    parser.add_argument('--cycles', type=int, default=2000)
+    parser.add_argument('--every', type=int, default=50, help="cycles between snapshots")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print_summary(SoakRun(args.cycles, args.every, args.seed).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+# Low-overhead runtime metrics: counters, histograms and spans that start on
+# one thread and end on another (e.g. command sent -> DIRECTION_DONE).
+# Recording is a dict update under a lock; snapshots are written to a
+# rotating local file in the background and can also be scraped as
+# Prometheus text from a local HTTP endpoint.
+
+# Histogram buckets for durations in seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Histogram buckets for counts such as nodes expanded
+COUNT_BUCKETS = (10, 100, 1000, 5000, 10000, 25000, 50000, 100000, 250000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.total, 'buckets': list(self.counts)}
+
+
+class Telemetry:
+    def __init__(self, path="mesamate_metrics.log", max_bytes=1_000_000, backup_count=3,
+                 flush_interval=10.0, prefix="mesamate"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.spans = {}
+        self.logger = None
+        self.stop_event = threading.Event()
+        self.http_server = None
+
+    # --- Recording API (safe to call from any thread) ---
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    def start_span(self, key):
+        self.spans[key] = time.perf_counter()
+
+    def end_span(self, key, name):
+        # Returns the elapsed seconds, or None if the span was never started
+        start_time = self.spans.pop(key, None)
+        if start_time is None:
+            return None
+        elapsed = time.perf_counter() - start_time
+        self.observe(name, elapsed)
+        return elapsed
+
+    # --- Export ---
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'counters': dict(self.counters),
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()}
+            }
+
+    def render_prometheus(self):
+        with self.lock:
+            lines = []
+            for name, value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if self.logger is not None:
+            self.logger.info(json.dumps(self.snapshot()))
+
+    def start(self, http_port=None):
+        # Write snapshots to the rotating file every flush_interval seconds
+        handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger = logging.getLogger(f"{self.prefix}.metrics")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = [handler]
+
+        def writer():
+            while not self.stop_event.wait(self.flush_interval):
+                self.flush()
+
+        threading.Thread(target=writer, daemon=True, name="metrics-writer").start()
+        if http_port is not None:
+            self.serve_http(http_port)
+
+    def serve_http(self, port, host="127.0.0.1"):
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True, name="metrics-http").start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def stop(self):
+        self.stop_event.set()
+        self.flush()
+        if self.http_server is not None:
+            self.http_server.shutdown()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from metricmap import MetricMap
+
+
+def wall_stub():
+    # 60x60 px room at 2 cm/px with a short wall at column 14, rows 0-2
+    grid = np.zeros((60, 60), dtype=np.uint8)
+    grid[0:3, 14] = 1
+    return grid
+
+
+def segment_distance(a, b, point):
+    a, b, point = (np.asarray(p, dtype=float) for p in (a, b, point))
+    t = np.clip(np.dot(point - a, b - a) / np.dot(b - a, b - a), 0, 1)
+    return np.hypot(*(a + t * (b - a) - point))
+
+
+def test_cell_too_close_to_wall_is_blocked():
+    metric = MetricMap(wall_stub(), 0.02, 0.3)
+    # The centre of cell (0, 0) is 7.07 px from the wall, but the cell
+    # reaches to column 14 itself
+    assert not metric.is_free((0, 0))
+    assert not metric.is_free((0, 1))
+
+
+def test_moves_between_free_cells_clear_the_wall():
+    grid = wall_stub()
+    metric = MetricMap(grid, 0.02, 0.3)
+    radius = 0.3 / 2 / 0.02
+    walls = np.argwhere(grid == 1)
+    rows, cols = metric.cells.shape
+    for r in range(rows):
+        for c in range(cols):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                a, b = (r, c), (r + dr, c + dc)
+                if not (metric.is_free(a) and metric.is_free(b)):
+                    continue
+                pa, pb = metric.to_pixel(a), metric.to_pixel(b)
+                assert min(segment_distance(pa, pb, wall) for wall in walls) >= radius, (a, b)